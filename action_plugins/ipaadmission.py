@@ -0,0 +1,292 @@
+# Authors:
+#   Thomas Woerner <twoerner@redhat.com>
+#
+# Copyright (C) 2017  Red Hat
+# see file 'COPYING' for use and warranty information
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import json
+import time
+import uuid
+import fcntl
+import random
+
+from ansible.plugins.action import ActionBase
+
+ADMISSION_DIR = "~/.ansible/ipa_admission"
+
+
+class AdmissionTimeout(Exception):
+    pass
+
+
+class AdmissionControl(object):
+    """
+    Controller side admission control for operations on IPA servers.
+
+    The forks of the controller are separate processes, therefore the state
+    is kept in a JSON file per IPA server, that is protected with flock.
+    The number of operations in flight is limited with leases, a lease that
+    has not been released in time (for example because the fork died)
+    expires. Additionally the start of new operations can be limited with a
+    token bucket that is refilled with rate tokens per second up to
+    max_inflight tokens.
+    """
+
+    def __init__(self, server, max_inflight=10, rate=0, lease_time=600,
+                 state_dir=ADMISSION_DIR):
+        self.server = server
+        self.max_inflight = max_inflight
+        self.rate = rate
+        self.lease_time = lease_time
+        self.state_dir = os.path.expanduser(state_dir)
+        self.state_file = os.path.join(self.state_dir, "%s.json" % server)
+        self.lock_file = os.path.join(self.state_dir, "%s.lock" % server)
+
+    def _update(self, func):
+        """
+        Call func with the state of the server while holding the lock and
+        save the modified state.
+        """
+        if not os.path.isdir(self.state_dir):
+            try:
+                os.makedirs(self.state_dir, 0o700)
+            except OSError:
+                if not os.path.isdir(self.state_dir):
+                    raise
+        with open(self.lock_file, "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                try:
+                    with open(self.state_file) as f:
+                        state = json.load(f)
+                except (IOError, OSError, ValueError):
+                    state = dict(leases=dict(), tokens=self.max_inflight,
+                                 updated=time.time())
+                result = func(state)
+                temp_name = "%s.%d" % (self.state_file, os.getpid())
+                with open(temp_name, "w") as f:
+                    json.dump(state, f)
+                os.rename(temp_name, self.state_file)
+                return result
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _try_acquire(self, state, owner):
+        now = time.time()
+
+        # Drop expired leases
+        leases = state["leases"]
+        for lease_id in list(leases):
+            if leases[lease_id]["expires"] < now:
+                del leases[lease_id]
+
+        # Refill the token bucket
+        if self.rate > 0:
+            state["tokens"] = min(
+                self.max_inflight,
+                state["tokens"] + (now - state["updated"]) * self.rate)
+        state["updated"] = now
+
+        if len(leases) >= self.max_inflight:
+            return None
+        if self.rate > 0 and state["tokens"] < 1:
+            return None
+
+        lease_id = str(uuid.uuid4())
+        leases[lease_id] = dict(owner=owner, expires=now + self.lease_time)
+        if self.rate > 0:
+            state["tokens"] -= 1
+        return lease_id
+
+    def acquire(self, owner, timeout=0, poll_interval=0.5):
+        """
+        Wait for a free slot and return the lease id.
+
+        :param owner: the name of the host the lease is acquired for
+        :param timeout: the maximum time to wait in seconds, 0 is unlimited
+        :returns: tuple (lease id, waited seconds)
+        """
+        start = time.time()
+        while True:
+            lease_id = self._update(
+                lambda state: self._try_acquire(state, owner))
+            if lease_id is not None:
+                return (lease_id, time.time() - start)
+            if timeout > 0 and time.time() - start > timeout:
+                raise AdmissionTimeout(
+                    "No free slot for %s on %s within %d seconds" %
+                    (owner, self.server, timeout))
+            # Add jitter to not wake up all waiting forks at once
+            time.sleep(poll_interval * (0.5 + random.random()))
+
+    def release(self, lease_id):
+        """
+        Release the lease.
+
+        :returns: True if the lease was still active
+        """
+        return self._update(
+            lambda state: state["leases"].pop(lease_id, None) is not None)
+
+
+ADMISSION_ARGS = ('max_inflight', 'rate', 'admission_server',
+                  'admission_timeout')
+
+
+def admission_acquire(args, owner, server):
+    """
+    Acquire a slot on the server with the admission options of the task.
+
+    :param args: the task args with max_inflight, rate and admission_timeout
+    :param owner: the name of the host the slot is acquired for
+    :param server: the IPA server, the admission_server of the task
+    :returns: tuple (admission control, lease id, waited seconds), the
+              lease id is None if max_inflight is not set
+    :raises AdmissionTimeout: if there was no free slot within
+                              admission_timeout
+    :raises ValueError: if the admission options are not valid
+    """
+    max_inflight = args.get('max_inflight', None)
+    if not max_inflight:
+        return (None, None, 0)
+    if not server:
+        raise ValueError("admission_server is required with max_inflight")
+    admission = AdmissionControl(server, max_inflight=int(max_inflight),
+                                 rate=float(args.get('rate', 0)))
+    lease, waited = admission.acquire(
+        owner, timeout=int(args.get('admission_timeout', 0)))
+    return (admission, lease, waited)
+
+
+class AdmissionActionModule(ActionBase):
+    """
+    Action plugin base for modules that are executed with a slot on an IPA
+    server.
+
+    The slot is acquired before and released after the module execution
+    within the same action. With separate acquire and release tasks, the
+    hosts holding a slot can not reach the release task with the linear
+    strategy as long as other hosts of the play are still waiting in the
+    acquire task.
+
+    The options max_inflight, rate, admission_server and admission_timeout
+    are used for the admission control and not passed to the module. The
+    module is executed without limit if max_inflight is not set.
+    """
+
+    def run(self, tmp=None, task_vars=None):
+        if task_vars is None:
+            task_vars = dict()
+
+        result = super(AdmissionActionModule, self).run(tmp, task_vars)
+        module_args = self._task.args.copy()
+        for arg in ADMISSION_ARGS:
+            module_args.pop(arg, None)
+
+        try:
+            admission, lease, waited = admission_acquire(
+                self._task.args, task_vars.get('inventory_hostname', ''),
+                self._task.args.get('admission_server', None))
+        except (AdmissionTimeout, ValueError) as e:
+            result['failed'] = True
+            result['msg'] = str(e)
+            return result
+        try:
+            result.update(self._execute_module(module_args=module_args,
+                                               task_vars=task_vars))
+        finally:
+            if lease is not None:
+                admission.release(lease)
+        if lease is not None:
+            result['admission_waited'] = round(waited, 3)
+        return result
+
+
+class ActionModule(ActionBase):
+
+    TRANSFERS_FILES = False
+
+    def run(self, tmp=None, task_vars=None):
+        """
+        Acquire or release a slot for operations on an IPA server.
+
+        The plugin is running on the controller only. The modules of the
+        role that support max_inflight acquire and release their slot within
+        their own action, see AdmissionActionModule. Separate acquire and
+        release tasks need the free strategy and a timeout, the hosts holding
+        a slot can not reach the release task otherwise while other hosts
+        are still waiting. Example:
+
+        - ipaadmission:
+            server: "{{ ipadiscovery.servers[0] }}"
+            max_inflight: 20
+            timeout: 300
+          register: ipaadmission
+
+        - ipajoin:
+            ...
+
+        - ipaadmission:
+            server: "{{ ipadiscovery.servers[0] }}"
+            state: release
+            lease: "{{ ipaadmission.lease }}"
+        """
+        if task_vars is None:
+            task_vars = dict()
+
+        result = super(ActionModule, self).run(tmp, task_vars)
+        server = self._task.args.get('server', None)
+        state = self._task.args.get('state', 'acquire')
+        lease = self._task.args.get('lease', None)
+
+        if not server:
+            result['failed'] = True
+            result['msg'] = "server is required"
+            return result
+
+        try:
+            control = AdmissionControl(
+                server,
+                max_inflight=int(self._task.args.get('max_inflight', 10)),
+                rate=float(self._task.args.get('rate', 0)),
+                lease_time=int(self._task.args.get('lease_time', 600)),
+                state_dir=self._task.args.get('state_dir', ADMISSION_DIR))
+
+            if state == 'acquire':
+                lease, waited = control.acquire(
+                    task_vars.get('inventory_hostname', ''),
+                    timeout=int(self._task.args.get('timeout', 0)))
+                result['lease'] = lease
+                result['waited'] = waited
+            elif state == 'release':
+                if not lease:
+                    result['failed'] = True
+                    result['msg'] = "lease is required to release a slot"
+                    return result
+                result['released'] = control.release(lease)
+            else:
+                result['failed'] = True
+                result['msg'] = "state needs to be acquire or release"
+                return result
+        except (AdmissionTimeout, ValueError) as e:
+            result['failed'] = True
+            result['msg'] = str(e)
+            return result
+
+        result['changed'] = False
+        result['server'] = server
+        return result
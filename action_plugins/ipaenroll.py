@@ -0,0 +1,30 @@
+# Authors:
+#   Thomas Woerner <twoerner@redhat.com>
+#
+# Copyright (C) 2017  Red Hat
+# see file 'COPYING' for use and warranty information
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import imp
+import os
+
+# The ipaenroll module is executed with a slot of the admission control
+ipaadmission = imp.load_source(
+    "ipaadmission",
+    os.path.join(os.path.dirname(__file__), "ipaadmission.py"))
+
+
+class ActionModule(ipaadmission.AdmissionActionModule):
+    pass
@@ -17,15 +17,26 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import base64
 import gssapi
+import imp
+import json
 import os
 import shutil
 import subprocess
 import tempfile
 from jinja2 import Template
 
+try:
+    import requests
+except ImportError:
+    HAS_REQUESTS = False
+else:
+    HAS_REQUESTS = True
+
 from ansible.errors import AnsibleError
 from ansible.module_utils._text import to_native
+from ansible.module_utils.six import string_types
 from ansible.plugins.action import ActionBase
 
 try:
@@ -34,6 +45,22 @@ except ImportError:
     from ansible.utils.display import Display
     display = Display()
 
+# The admission control is shared with the ipaadmission action plugin
+ipaadmission = imp.load_source(
+    "ipaadmission",
+    os.path.join(os.path.dirname(__file__), "ipaadmission.py"))
+
+# The session store and the certificate and SSH key helpers are shared
+# with the modules
+ansible_ipa_client = imp.load_source(
+    "ansible_ipa_client",
+    os.path.join(os.path.dirname(__file__), os.pardir, "module_utils",
+                 "ansible_ipa_client.py"))
+
+# The session cookies of the controller are kept apart from the ones of
+# modules running on the controller.
+CONTROLLER_SESSION_STORE = "~/.cache/ansible_ipa_controller_sessions.json"
+
 def run_cmd(args, stdin=None):
     """
     Execute an external command.
@@ -100,7 +127,8 @@ KRB5CONF_TEMPLATE = """
 [libdefaults]
  default_realm = {{ ipa_realm }}
  dns_lookup_realm = false
- dns_lookup_kdc = true
+ dns_lookup_kdc = false
+ dns_canonicalize_hostname = false
  rdns = false
  ticket_lifetime = {{ ipa_lifetime }}
  forwardable = true
@@ -120,6 +148,286 @@ KRB5CONF_TEMPLATE = """
  {{ ipa_domain }} = {{ ipa_realm}}
 """
 
+class IPARPCError(Exception):
+    """
+    Error returned by the IPA JSON-RPC interface.
+    """
+    def __init__(self, error):
+        super(IPARPCError, self).__init__(error.get('message'))
+        self.code = error.get('code')
+        self.name = error.get('name')
+
+
+# IPA error codes
+NOT_FOUND = 4001
+
+
+class IPAJSONClient(object):
+    """
+    Minimal client for the JSON-RPC interface of an IPA server.
+
+    The IPA session cookie is reused for all calls of the client. A new
+    session cookie is requested with Kerberos (Negotiate) if there is no
+    cookie or if the server rejects it. The action plugins run in a forked
+    worker per host and task, with session_reuse the cookie is loaded from
+    and saved to the session store on the controller, so that it is also
+    used by the following tasks and hosts.
+    """
+
+    def __init__(self, server, principal, ccache_name, krb5conf_name,
+                 ca_cert=None, session_reuse=False):
+        self.server = server
+        self.principal = principal
+        self.ccache_name = ccache_name
+        self.krb5conf_name = krb5conf_name
+        self.session_reuse = session_reuse
+        self.url = "https://%s/ipa" % server
+        self.session = requests.Session()
+        self.session.headers.update({
+            'Referer': self.url,
+            'Content-Type': 'application/json',
+            'Accept': 'application/json',
+        })
+        self.session.verify = ca_cert if ca_cert else True
+        if session_reuse:
+            cookie = ansible_ipa_client.stored_session_cookie(
+                principal, server, CONTROLLER_SESSION_STORE)
+            if cookie:
+                self.session.cookies.set('ipa_session', cookie,
+                                         domain=server, path='/ipa')
+
+    def save_session(self):
+        """
+        Save the session cookie in the session store with session_reuse.
+        """
+        cookie = self.session.cookies.get('ipa_session')
+        if self.session_reuse and cookie:
+            ansible_ipa_client.store_session_cookie(
+                self.principal, self.server, cookie,
+                CONTROLLER_SESSION_STORE)
+
+    def _negotiate_token(self):
+        old_config = os.environ.get('KRB5_CONFIG')
+        os.environ['KRB5_CONFIG'] = self.krb5conf_name
+        try:
+            name = gssapi.Name('HTTP@%s' % self.server,
+                               gssapi.NameType.hostbased_service)
+            creds = gssapi.Credentials(usage='initiate',
+                                       store={'ccache': self.ccache_name})
+            context = gssapi.SecurityContext(name=name, creds=creds,
+                                             usage='initiate')
+            return base64.b64encode(context.step()).decode('ascii')
+        finally:
+            if old_config is not None:
+                os.environ['KRB5_CONFIG'] = old_config
+            else:
+                os.environ.pop('KRB5_CONFIG', None)
+
+    def login(self):
+        """
+        Get a new session cookie with Kerberos.
+        """
+        response = self.session.post(
+            self.url + "/session/login_kerberos",
+            headers={'Authorization': 'Negotiate %s' %
+                     self._negotiate_token()})
+        response.raise_for_status()
+
+    def call(self, method, args=None, options=None):
+        """
+        Call the method and return the result.
+
+        :raises IPARPCError: if the method failed
+        """
+        data = json.dumps(dict(method=method,
+                               params=[args or [], options or dict()],
+                               id=0))
+        for attempt in (0, 1):
+            if attempt > 0 or 'ipa_session' not in self.session.cookies:
+                self.login()
+            response = self.session.post(self.url + "/session/json",
+                                         data=data)
+            if response.status_code != 401:
+                break
+            # The session cookie has expired or has been rejected
+            self.session.cookies.clear()
+        response.raise_for_status()
+        reply = response.json()
+        if reply.get('error'):
+            raise IPARPCError(reply['error'])
+        return reply['result']
+
+
+def cert_base64(der):
+    """
+    Return the JSON-RPC encoding of a DER encoded certificate.
+    """
+    return dict(__base64__=base64.b64encode(der).decode('ascii'))
+
+
+def project_host(client, fqdn, entry, return_attributes):
+    """
+    Reduce the host entry to return_attributes, see project_host in the
+    ipahost module.
+    """
+    if return_attributes is None:
+        return entry
+    if any(attr not in entry for attr in return_attributes):
+        entry = client.call('host_show', [fqdn],
+                            dict(all=True, no_members=True))['result']
+    return dict((attr, entry[attr]) for attr in return_attributes
+                if attr in entry)
+
+
+def controller_host(client, args, check_mode):
+    """
+    Execute the host operation of the ipahost module with the JSON-RPC
+    client on the controller.
+
+    :returns: the result dict as returned by the ipahost module
+    """
+    fqdn = args.get('fqdn')
+    hosts = args.get('hosts')
+    state = args.get('state', 'present')
+    random = args.get('random', False)
+    if isinstance(random, string_types):
+        random = random.lower() in ('yes', 'true', '1')
+    return_attributes = args.get('return_attributes')
+    if isinstance(return_attributes, string_types):
+        return_attributes = [attr.strip() for attr in
+                             return_attributes.split(',') if attr.strip()]
+
+    if hosts is not None:
+        if state != 'present' or not random:
+            raise ValueError("hosts can only be used with random and state "
+                             "present")
+        return controller_hosts_random(client, hosts, check_mode)
+
+    try:
+        if return_attributes is None:
+            options = dict(all=True)
+        else:
+            options = dict(no_members=True)
+        host = client.call('host_show', [fqdn], options)['result']
+    except IPARPCError as e:
+        if e.code != NOT_FOUND:
+            raise
+        host = None
+
+    if state == 'absent':
+        if host is None:
+            return dict(changed=False, server=client.server)
+        if not check_mode:
+            client.call('host_del', [fqdn])
+        return dict(changed=True, server=client.server)
+
+    options = dict()
+    certs_add = []
+    certs_remove = []
+    certificates = args.get('certificates')
+    if certificates:
+        # The certificates are compared and sent like in the ipahost
+        # module, PEM and DER certificates are accepted
+        wanted = dict()
+        for cert in certificates:
+            der = ansible_ipa_client.cert_der(cert)
+            wanted[ansible_ipa_client.cert_fingerprint(der)] = \
+                cert_base64(der)
+        if host is None:
+            options['usercertificate'] = [wanted[fp] for fp in sorted(wanted)]
+        else:
+            current = dict(
+                (ansible_ipa_client.cert_fingerprint(
+                    ansible_ipa_client.cert_der(c)), c)
+                for c in host.get('usercertificate', []))
+            certs_add = [wanted[fp] for fp in sorted(wanted)
+                         if fp not in current]
+            certs_remove = [current[fp] for fp in sorted(current)
+                            if fp not in wanted]
+    sshpubkey = args.get('sshpubkey')
+    if sshpubkey and (host is None or
+                      set(ansible_ipa_client.sshpubkey_key(k)
+                          for k in host.get('ipasshpubkey', [])) !=
+                      set([ansible_ipa_client.sshpubkey_key(sshpubkey)])):
+        options['ipasshpubkey'] = [sshpubkey]
+    if random:
+        options['random'] = True
+
+    if host is not None and not options and not certs_add and \
+       not certs_remove:
+        return dict(changed=False, server=client.server,
+                    host=project_host(client, fqdn, host, return_attributes))
+    if check_mode:
+        return dict(changed=True, server=client.server)
+
+    result = None
+    if host is None:
+        ipaddress = args.get('ipaddress')
+        if ipaddress:
+            options['ip_address'] = ipaddress
+        result = client.call('host_add', [fqdn], options)
+    else:
+        # A password can not be set if the host has a keytab
+        if random and host.get('has_keytab'):
+            client.call('host_disable', [fqdn])
+        # Only the changed certificates are sent and written to LDAP
+        if certs_remove:
+            result = client.call('host_remove_cert', [fqdn],
+                                 dict(usercertificate=certs_remove))
+        if certs_add:
+            result = client.call('host_add_cert', [fqdn],
+                                 dict(usercertificate=certs_add))
+        if options:
+            result = client.call('host_mod', [fqdn], options)
+    randompassword = result['result'].get('randompassword')
+    if return_attributes is None:
+        host = client.call('host_show', [fqdn])['result']
+    else:
+        host = project_host(client, fqdn, result['result'],
+                            return_attributes)
+    if random:
+        host['randompassword'] = randompassword
+    return dict(changed=True, server=client.server, host=host)
+
+
+def controller_hosts_random(client, hosts, check_mode):
+    """
+    Generate random passwords for the hosts with two batch calls, see
+    ensure_hosts_random in the ipahost module.
+    """
+    if not hosts:
+        return dict(changed=False, server=client.server, hosts=dict())
+
+    def batch(methods):
+        return client.call('batch', [[dict(method=command,
+                                           params=[args, options])
+                                      for command, args, options
+                                      in methods]])['results']
+
+    methods = []
+    for fqdn, show in zip(hosts, batch([('host_show', [fqdn], dict())
+                                        for fqdn in hosts])):
+        if show.get('error'):
+            methods.append(('host_add', [fqdn], dict(random=True)))
+        else:
+            if show['result'].get('has_keytab'):
+                methods.append(('host_disable', [fqdn], dict()))
+            methods.append(('host_mod', [fqdn], dict(random=True)))
+
+    if check_mode:
+        return dict(changed=True, server=client.server)
+
+    result = dict()
+    for (command, args, options), res in zip(methods, batch(methods)):
+        fqdn = args[0]
+        if res.get('error'):
+            result.setdefault(fqdn, dict(error=res['error']))
+        elif command != 'host_disable' and fqdn not in result:
+            result[fqdn] = dict(
+                randompassword=res['result']['randompassword'])
+    return dict(changed=True, server=client.server, hosts=result)
+
+
 class ActionModule(ActionBase):
 
     def run(self, tmp=None, task_vars=None):
@@ -139,6 +447,22 @@ class ActionModule(ActionBase):
         - copy the credential cache file on the managed node
 
         Then the IPA commands can use this credential cache file.
+
+        With execution set to controller, the module is not executed on the
+        IPA server. The host operations are done directly from the controller
+        with the JSON-RPC interface of the server, using the TGT obtained on
+        the control node. The IPA CA certificate can be given with ca_cert
+        (path on the controller), otherwise the system CA store is used.
+
+        If realm and domain are given, they are not read from the facts of
+        the IPA server.
+
+        If max_inflight is given, the module execution on the IPA server is
+        queued until less than max_inflight operations are in flight on the
+        server. The start of new operations can additionally be limited with
+        rate (operations per second). The slots are counted per
+        admission_server like for the enrollment modules, the task fails if
+        there is no free slot within admission_timeout.
         """
 
         if task_vars is None:
@@ -149,6 +473,21 @@ class ActionModule(ActionBase):
         keytab = self._task.args.get('keytab', None)
         password = self._task.args.get('password', None)
         lifetime = self._task.args.get('lifetime', '1h')
+        execution = self._task.args.get('execution', 'remote')
+        ca_cert = self._task.args.get('ca_cert', None)
+        realm = self._task.args.get('realm', None)
+        domain = self._task.args.get('domain', None)
+
+        if execution not in ('remote', 'controller'):
+            result['failed'] = True
+            result['msg'] = "execution needs to be remote or controller"
+            return result
+
+        if execution == 'controller' and not HAS_REQUESTS:
+            result['failed'] = True
+            result['msg'] = "python requests is needed on the controller " \
+                            "for execution on the controller"
+            return result
 
         if (not keytab and not password):
             result['failed'] = True
@@ -160,15 +499,19 @@ class ActionModule(ActionBase):
             result['msg'] = "principal is required"
             return result
 
-        data = self._execute_module(module_name='ipa_facts', module_args=dict(),
-                                    task_vars=None)
-        try:
-            domain = data['ansible_facts']['ipa']['domain']
-            realm = data['ansible_facts']['ipa']['realm']
-        except KeyError:
-            result['failed'] = True
-            result['msg'] = "The host is not an IPA server"
-            return result
+        if not realm or not domain:
+            # Only realm and domain are needed from the facts
+            data = self._execute_module(
+                module_name='ipa_facts',
+                module_args=dict(gather_subset=['client']),
+                task_vars=None)
+            try:
+                domain = data['ansible_facts']['ipa']['domain']
+                realm = data['ansible_facts']['ipa']['realm']
+            except KeyError:
+                result['failed'] = True
+                result['msg'] = "The host is not an IPA server"
+                return result
 
         items = principal.split('@')
         if len(items) < 2:
@@ -216,6 +559,14 @@ class ActionModule(ActionBase):
                 result['msg'] = 'kinit %s with keytab %s failed' % (principal, keytab)
                 return result
 
+        if execution == 'controller':
+            try:
+                return self._run_on_controller(
+                    result, task_vars, principal, ccache_name,
+                    krb5conf_name, ca_cert)
+            finally:
+                shutil.rmtree(local_temp_dir, ignore_errors=True)
+
         try:
             # Create the remote tmp dir
             tmp = self._make_tmp_path()
@@ -230,13 +581,90 @@ class ActionModule(ActionBase):
             new_module_args.pop('password', None)
             new_module_args.pop('keytab', None)
             new_module_args.pop('lifetime', None)
+            for arg in ipaadmission.ADMISSION_ARGS + ('execution', 'ca_cert',
+                                                      'realm', 'domain'):
+                new_module_args.pop(arg, None)
             new_module_args.update(ccache=tmp_ccache)
 
-            # Execute module
-            result.update(self._execute_module(module_args=new_module_args,
-                                               task_vars=task_vars))
+            try:
+                admission, lease = self._acquire_slot(task_vars)
+            except (ipaadmission.AdmissionTimeout, ValueError) as e:
+                result['failed'] = True
+                result['msg'] = str(e)
+                return result
+            try:
+                # Execute module
+                result.update(self._execute_module(
+                    module_args=new_module_args, task_vars=task_vars))
+            finally:
+                if lease is not None:
+                    admission.release(lease)
             return result
         finally:
             # delete the local temp directory
             shutil.rmtree(local_temp_dir, ignore_errors=True)
             run_cmd(['/usr/bin/kdestroy', '-c', tmp_ccache])
+
+    def _acquire_slot(self, task_vars):
+        """
+        Acquire a slot on the IPA server like AdmissionActionModule, the
+        server is admission_server or the host the task is delegated to.
+
+        :returns: tuple (admission control, lease id), the lease id is None
+                  if max_inflight is not set
+        """
+        server = self._task.args.get('admission_server', None) or \
+            task_vars['ansible_host']
+        admission, lease, waited = ipaadmission.admission_acquire(
+            self._task.args, task_vars.get('inventory_hostname', ''), server)
+        if waited > 1:
+            display.vvv("Waited %.1f seconds for a free slot on %s" %
+                        (waited, server))
+        return (admission, lease)
+
+    def _controller_operation(self, client, args, check_mode):
+        """
+        The operation of the module with the JSON-RPC client, action plugins
+        sharing the authentication of ipahost override this.
+        """
+        return controller_host(client, args, check_mode)
+
+    def _run_on_controller(self, result, task_vars, principal, ccache_name,
+                           krb5conf_name, ca_cert):
+        """
+        Execute the host operation on the controller with JSON-RPC.
+        """
+        server = task_vars['ansible_host']
+        if ca_cert:
+            try:
+                ca_cert = self._find_needle('files', ca_cert)
+            except AnsibleError as e:
+                result['failed'] = True
+                result['msg'] = to_native(e)
+                return result
+
+        session_reuse = self._task.args.get('session_reuse', False)
+        if isinstance(session_reuse, string_types):
+            session_reuse = session_reuse.lower() in ('yes', 'true', '1')
+
+        try:
+            admission, lease = self._acquire_slot(task_vars)
+        except (ipaadmission.AdmissionTimeout, ValueError) as e:
+            result['failed'] = True
+            result['msg'] = str(e)
+            return result
+        try:
+            client = IPAJSONClient(server, principal, ccache_name,
+                                   krb5conf_name, ca_cert, session_reuse)
+            result.update(self._controller_operation(
+                client, self._task.args, self._play_context.check_mode))
+            client.save_session()
+        except (IPARPCError, ValueError, gssapi.exceptions.GSSError,
+                requests.exceptions.RequestException) as e:
+            result['failed'] = True
+            result['msg'] = "%s module failed : %s" % (self._task.action,
+                                                       to_native(e))
+        finally:
+            if lease is not None:
+                admission.release(lease)
+        return result
@@ -0,0 +1,82 @@
+# Authors:
+#   Thomas Woerner <twoerner@redhat.com>
+#
+# Copyright (C) 2017  Red Hat
+# see file 'COPYING' for use and warranty information
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import imp
+import os
+
+# The authentication, the admission control and the JSON-RPC client are
+# shared with the ipahost action plugin
+ipahost = imp.load_source(
+    "ipahost_action",
+    os.path.join(os.path.dirname(__file__), "ipahost.py"))
+
+# The membership changes are computed like in the ipahostgroup module
+ansible_ipa_client = imp.load_source(
+    "ansible_ipa_client",
+    os.path.join(os.path.dirname(__file__), os.pardir, "module_utils",
+                 "ansible_ipa_client.py"))
+
+
+def controller_hostgroup(client, args, check_mode):
+    """
+    Execute the hostgroup operation of the ipahostgroup module with the
+    JSON-RPC client on the controller.
+
+    :returns: the result dict as returned by the ipahostgroup module
+    """
+    members = dict((group.lower(), hosts or [])
+                   for group, hosts in args.get('members', dict()).items())
+    state = args.get('state', 'present')
+    if state not in ('present', 'absent', 'exact'):
+        raise ValueError("state needs to be present, absent or exact")
+
+    def batch(methods):
+        return client.call('batch', [[dict(method=command,
+                                           params=[cmd_args, options])
+                                      for command, cmd_args, options
+                                      in methods]])['results']
+
+    groups = sorted(members)
+    current, read_failed = ansible_ipa_client.current_membership(
+        groups, batch([('hostgroup_show', [group], dict())
+                       for group in groups]))
+
+    methods, added, removed = ansible_ipa_client.plan_membership(
+        current, members, state)
+    if not methods:
+        return dict(changed=False, server=client.server, added=dict(),
+                    removed=dict(), failed=read_failed)
+    if check_mode:
+        return dict(changed=True, server=client.server, added=added,
+                    removed=removed, failed=read_failed)
+
+    failed = ansible_ipa_client.apply_membership(methods, added, removed,
+                                                 batch(methods))
+    failed.update(read_failed)
+    created = [method[1][0] for method in methods
+               if method[0] == 'hostgroup_add' and method[1][0] not in failed]
+    return dict(changed=len(added) > 0 or len(removed) > 0 or
+                len(created) > 0, server=client.server, added=added,
+                removed=removed, failed=failed)
+
+
+class ActionModule(ipahost.ActionModule):
+
+    def _controller_operation(self, client, args, check_mode):
+        return controller_hostgroup(client, args, check_mode)
@@ -4,34 +4,81 @@
 import os
 import re
 import six
+import json
+import pkgutil
 from six.moves.configparser import RawConfigParser
 
 from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.ansible_ipa_client import profiled
 
-try:
-    from ipalib import api
-except ImportError:
-    HAS_IPALIB = False
-else:
-    HAS_IPALIB = True
+# Only check for the availability of ipalib and ipaserver here, importing
+# ipalib is expensive and only needed for a configured client.
+HAS_IPALIB = pkgutil.find_loader('ipalib') is not None
+if HAS_IPALIB:
     from ipaplatform.paths import paths
-    try:
-        # FreeIPA >= 4.5
-        from ipalib.install import sysrestore
-    except ImportError:
-        # FreeIPA 4.4 and older
-        from ipapython import sysrestore
 
-try:
-    import ipaserver
-except ImportError:
-    HAS_IPASERVER = False
-else:
-    HAS_IPASERVER = True
+HAS_IPASERVER = pkgutil.find_loader('ipaserver') is not None
 
 SERVER_SYSRESTORE_STATE = "/var/lib/ipa/sysrestore/sysrestore.state"
 NAMED_CONF = "/etc/named.conf"
 VAR_LIB_PKI_TOMCAT = "/var/lib/pki/pki-tomcat"
+FACTS_CACHE = "/var/cache/ansible_ipa_facts.json"
+
+GATHER_SUBSETS = ['client', 'server', 'dns', 'ca', 'kra', 'ntpd', 'version']
+SERVER_SUBSETS = ['server', 'dns', 'ca', 'kra', 'ntpd']
+
+
+class FactsCache(object):
+    """
+    Cache for facts that are parsed from files.
+
+    The cached values are keyed with the inode, mtime and size of the files
+    they are depending on, a changed file invalidates the value.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.modified = False
+        self.data = dict()
+        if filename:
+            try:
+                with open(filename) as f:
+                    self.data = json.load(f)
+            except (IOError, OSError, ValueError):
+                pass
+
+    @staticmethod
+    def file_key(path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return "%d:%r:%d" % (st.st_ino, st.st_mtime, st.st_size)
+
+    def get(self, name, paths, func):
+        key = [self.file_key(path) for path in paths]
+        entry = self.data.get(name)
+        if entry is not None and entry.get('key') == key:
+            return entry.get('value')
+        value = func()
+        self.data[name] = dict(key=key, value=value)
+        self.modified = True
+        return value
+
+    def save(self):
+        if not self.filename or not self.modified:
+            return
+        temp_name = "%s.%d" % (self.filename, os.getpid())
+        try:
+            with open(temp_name, "w") as f:
+                json.dump(self.data, f)
+            os.rename(temp_name, self.filename)
+        except (IOError, OSError):
+            # The cache is optional
+            try:
+                os.remove(temp_name)
+            except OSError:
+                pass
 
 
 def is_ntpd_configured():
@@ -80,8 +127,14 @@ def is_client_configured():
     # IPA Client is configured when /etc/ipa/default.conf exists
     # and /var/lib/ipa-client/sysrestore/sysrestore.state exists
 
-    fstore = sysrestore.FileStore(paths.IPA_CLIENT_SYSRESTORE)
-    return (os.path.isfile(paths.IPA_DEFAULT_CONF) and fstore.has_files())
+    if not os.path.isfile(paths.IPA_DEFAULT_CONF):
+        return False
+
+    # The sysrestore index is read directly instead of using
+    # sysrestore.FileStore.has_files, which would import ipalib
+    parser = RawConfigParser()
+    parser.read(os.path.join(paths.IPA_CLIENT_SYSRESTORE, "sysrestore.index"))
+    return parser.has_section('files') and len(parser.items('files')) > 0
 
 def is_server_configured():
     # IPA server is configured when /etc/ipa/default.conf exists
@@ -128,13 +181,32 @@ def get_ipa_version():
         
 def main():
     module = AnsibleModule(
-        argument_spec = dict(),
+        argument_spec = dict(
+            gather_subset=dict(required=False, type='list', default=['all']),
+            cache=dict(required=False, type='bool', default=False),
+        ),
         supports_check_mode=True
     )
 
     # The module does not change anything, meaning that
     # check mode is supported
 
+    gather_subset = module.params.get('gather_subset')
+    # With all, the version is only returned for configured clients
+    gather_all = 'all' in gather_subset
+    if gather_all:
+        gather_subset = GATHER_SUBSETS
+    for subset in gather_subset:
+        if subset not in GATHER_SUBSETS:
+            module.fail_json(msg="Invalid gather_subset '%s', valid subsets "
+                             "are: all, %s" % (subset,
+                                               ", ".join(GATHER_SUBSETS)))
+
+    # The cache is opt-in, the module does not write anything by default
+    cache = FactsCache(
+        FACTS_CACHE if module.params.get('cache') and not module.check_mode
+        else None)
+
     ipa_facts = dict(
         packages= dict(
             ipalib=HAS_IPALIB,
@@ -151,20 +223,38 @@ def main():
     )
 
     if HAS_IPALIB:
-        if is_client_configured():
-            ipa_facts['configured']['client'] = True
-
+        if 'version' in gather_subset and not gather_all:
             ipa_facts['version'] = get_ipa_version()
-            for key,value in six.iteritems(get_ipa_conf()):
-                ipa_facts[key] = value
 
-    if HAS_IPASERVER:
+        if 'client' in gather_subset:
+            client_index = os.path.join(paths.IPA_CLIENT_SYSRESTORE,
+                                        "sysrestore.index")
+            if cache.get('client', [paths.IPA_DEFAULT_CONF, client_index],
+                         is_client_configured):
+                ipa_facts['configured']['client'] = True
+                if gather_all:
+                    ipa_facts['version'] = get_ipa_version()
+
+                ipa_conf = cache.get('ipa_conf', [paths.IPA_DEFAULT_CONF],
+                                     get_ipa_conf)
+                for key,value in six.iteritems(ipa_conf):
+                    ipa_facts[key] = value
+
+    if HAS_IPASERVER and set(gather_subset) & set(SERVER_SUBSETS):
         if is_server_configured():
             ipa_facts['configured']['server'] = True
-            ipa_facts['configured']['dns'] = is_dns_configured()
-            ipa_facts['configured']['ca'] = is_ca_configured()
-            ipa_facts['configured']['kra'] = is_kra_configured()
-            ipa_facts['configured']['ntpd'] = is_ntpd_configured()
+            if 'dns' in gather_subset:
+                ipa_facts['configured']['dns'] = cache.get(
+                    'dns', [NAMED_CONF], is_dns_configured)
+            if 'ca' in gather_subset:
+                ipa_facts['configured']['ca'] = is_ca_configured()
+            if 'kra' in gather_subset:
+                ipa_facts['configured']['kra'] = is_kra_configured()
+            if 'ntpd' in gather_subset:
+                ipa_facts['configured']['ntpd'] = cache.get(
+                    'ntpd', [SERVER_SYSRESTORE_STATE], is_ntpd_configured)
+
+    cache.save()
 
     module.exit_json(
         changed=False,
@@ -172,4 +262,4 @@ def main():
         )
 
 if __name__ == '__main__':
-    main()
+    profiled(main)
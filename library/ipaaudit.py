@@ -0,0 +1,434 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Authors:
+#   Thomas Woerner <twoerner@redhat.com>
+#
+# Copyright (C) 2017  Red Hat
+# see file 'COPYING' for use and warranty information
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+ANSIBLE_METADATA = {
+    'metadata_version': '1.0',
+    'supported_by': 'community',
+    'status': ['preview'],
+}
+
+DOCUMENTATION = '''
+---
+module: ipaaudit
+short description: Audit the IPA client configuration against the intended one
+description:
+  Audit the IPA client configuration against the intended one without
+  changing anything. The options that the role and the modules write to
+  default.conf, krb5.conf and sssd.conf are derived from the parameters and
+  compared with the files on disk by hash, only for a mismatch the single
+  options are compared. The host keytab and the CA certificates in the IPA
+  NSS database are checked as well. Only the differences are returned.
+  The checks are done in the order of their cost and stop when the time
+  budget is used up, the remaining checks are returned as skipped. The
+  certutil calls of the NSS database check are killed when the budget is
+  used up, the check is then also returned as skipped.
+options:
+  servers:
+    description: The FQDN of the IPA servers. Can be omitted with dnsok, the servers are then not checked.
+    required: false
+  domain:
+    description: The primary DNS domain of the IPA deployment.
+    required: true
+  realm:
+    description: The Kerberos realm of the IPA deployment.
+    required: true
+  hostname:
+    description: The hostname of the machine (FQDN).
+    required: true
+  basedn:
+    description: The basedn of the IPA server (of the form dc=example,dc=com). Not checked if not set.
+    required: false
+  dnsok:
+    description: True if the client has been installed with DNS discovery, the KDCs are then looked up in DNS and not listed in krb5.conf.
+    required: false
+    default: no
+  krb5_tuned:
+    description: True if krb5.conf has been written latency tuned, see ipaclient_krb5_tuned. The KDCs are then always listed and DNS lookups and hostname canonicalization are turned off.
+    required: false
+    default: no
+  ccache:
+    description: The default credential cache in krb5.conf, see ipaclient_krb5_ccache.
+    required: false
+    default: KEYRING:persistent:%{uid}
+  services:
+    description: The services that should be enabled in the sssd configuration.
+    required: false
+    default: ["ssh", "sudo"]
+  performance_profile:
+    description: The SSSD performance profile, see ipasssd. The options of the profile are checked in sssd.conf.
+    required: false
+    default: default
+  time_budget:
+    description: The maximum time in seconds for the audit. The file checks are only stopped between checks, the certutil calls at the time budget.
+    required: false
+    default: 5
+author:
+    - Thomas Woerner
+'''
+
+EXAMPLES = '''
+- name: Audit the IPA client configuration
+  ipaaudit:
+    servers: "{{ groups.ipaservers }}"
+    domain: example.com
+    realm: EXAMPLE.COM
+    hostname: "{{ ansible_fqdn }}"
+    time_budget: 2
+  register: ipaaudit
+'''
+
+RETURN = '''
+drifted:
+  description: True if there are differences.
+  returned: always
+  type: bool
+differences:
+  description: The differences, each one with item (default.conf, krb5.conf, sssd.conf, keytab or nssdb), option, expected and actual.
+  returned: always
+  type: list
+skipped:
+  description: The items that have not been checked because the time budget was used up.
+  returned: always
+  type: list
+elapsed:
+  description: The time in seconds needed for the audit.
+  returned: always
+  type: float
+'''
+
+import json
+import time
+import hashlib
+from six.moves.configparser import RawConfigParser
+
+from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.ansible_ipa_client import read_keytab, \
+    read_pem_file, nssdb_ca_certs, cert_fingerprint, \
+    SSSD_PERFORMANCE_PROFILES, profiled
+
+
+def digest(values):
+    return hashlib.sha256(
+        json.dumps(values, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def compare(item, expected, actual):
+    """
+    Compare the expected and actual option values by hash first.
+
+    Values are normalized to sorted lists of strings, options that are only
+    in actual are ignored.
+
+    :returns: list of differences
+    """
+    actual = dict((key, actual.get(key)) for key in expected)
+    if digest(expected) == digest(actual):
+        return []
+    return [dict(item=item, option=key, expected=expected[key],
+                 actual=actual[key])
+            for key in sorted(expected) if expected[key] != actual[key]]
+
+
+def normalize(value):
+    if isinstance(value, list):
+        return sorted(str(v).lower() for v in value)
+    return [str(value).lower()]
+
+
+def read_ini(filename):
+    """
+    Return dict "section.option" -> normalized value of the ini file.
+    """
+    parser = RawConfigParser()
+    parser.optionxform = str
+    values = dict()
+    try:
+        if not parser.read(filename):
+            return values
+    except Exception:
+        return values
+    for section in parser.sections():
+        for (option, value) in parser.items(section):
+            values["%s.%s" % (section, option)] = normalize(value)
+    return values
+
+
+def read_krb5_conf(filename):
+    """
+    Return dict "section.[subsection.]option" -> normalized list of values
+    of the krb5.conf file.
+    """
+    values = dict()
+    section = None
+    stack = []
+    try:
+        with open(filename) as f:
+            lines = f.readlines()
+    except (IOError, OSError):
+        return values
+    for line in lines:
+        line = line.split("#", 1)[0].split(";", 1)[0].strip()
+        if not line:
+            continue
+        if line.startswith("[") and line.endswith("]"):
+            section = line[1:-1].strip()
+            stack = []
+            continue
+        if section is None:
+            continue
+        if line == "}":
+            if stack:
+                stack.pop()
+            continue
+        if "=" not in line:
+            continue
+        key, value = [part.strip() for part in line.split("=", 1)]
+        if value == "{":
+            stack.append(key)
+            continue
+        name = ".".join([section] + stack + [key])
+        values.setdefault(name, []).append(value.lower())
+    for name in values:
+        values[name] = sorted(values[name])
+    return values
+
+
+def audit_default_conf(servers, domain, realm, hostname, basedn):
+    from ipaplatform.paths import paths
+
+    actual = read_ini(paths.IPA_DEFAULT_CONF)
+    expected = {
+        "global.realm": normalize(realm),
+        "global.domain": normalize(domain),
+        "global.host": normalize(hostname),
+    }
+    if basedn:
+        expected["global.basedn"] = normalize(basedn)
+    differences = compare("default.conf", expected, actual)
+
+    # The server is pinned per client, it only needs to be one of servers
+    server = actual.get("global.server", [None])[0]
+    if not servers:
+        return differences
+    if server not in [s.lower() for s in servers]:
+        differences.append(dict(item="default.conf", option="global.server",
+                                expected=normalize(servers),
+                                actual=actual.get("global.server")))
+    elif actual.get("global.xmlrpc_uri") != \
+            normalize("https://%s/ipa/xml" % server):
+        differences.append(dict(item="default.conf",
+                                option="global.xmlrpc_uri",
+                                expected=normalize(
+                                    "https://%s/ipa/xml" % server),
+                                actual=actual.get("global.xmlrpc_uri")))
+    return differences
+
+
+def audit_krb5_conf(servers, realm, dnsok, krb5_tuned, ccache):
+    """
+    The expected options follow the krb5 role template with the variables
+    install.yml passes to it.
+    """
+    from ipaplatform.paths import paths
+
+    kdcs = [] if dnsok and not krb5_tuned else servers
+    no_dns = krb5_tuned and len(kdcs) > 0
+    dns = "true" if dnsok and not no_dns else "false"
+    expected = {
+        "libdefaults.default_realm": normalize(realm),
+        "libdefaults.dns_lookup_realm": [dns],
+        "libdefaults.dns_lookup_kdc": [dns],
+        "libdefaults.rdns": ["false"],
+        "libdefaults.udp_preference_limit": ["0"],
+        "libdefaults.default_ccache_name": normalize(ccache),
+    }
+    if no_dns:
+        expected["libdefaults.dns_canonicalize_hostname"] = ["false"]
+    realm_key = "realms.%s" % realm.lower()
+    if kdcs:
+        expected["%s.kdc" % realm_key] = \
+            normalize(["%s:88" % s for s in kdcs])
+        if not krb5_tuned:
+            expected["%s.master_kdc" % realm_key] = \
+                normalize(["%s:88" % s for s in kdcs])
+            expected["%s.admin_server" % realm_key] = \
+                normalize(["%s:749" % s for s in kdcs])
+    actual = read_krb5_conf(paths.KRB5_CONF)
+    # realm names are normalized to lower case
+    actual = dict((key.lower() if key.startswith("realms.") else key, value)
+                  for key, value in actual.items())
+    differences = compare("krb5.conf", expected, actual)
+
+    # The tuned KDCs are ordered by the latency measured at install time,
+    # the first one is the master and admin server
+    if kdcs and krb5_tuned:
+        for option, port in (("master_kdc", 88), ("admin_server", 749)):
+            name = "%s.%s" % (realm_key, option)
+            allowed = normalize(["%s:%d" % (s, port) for s in kdcs])
+            value = actual.get(name)
+            if value is None or len(value) != 1 or value[0] not in allowed:
+                differences.append(dict(item="krb5.conf", option=name,
+                                        expected=allowed, actual=value))
+    return differences
+
+
+def audit_sssd_conf(servers, domain, realm, hostname, services,
+                    performance_profile):
+    from ipaplatform.paths import paths
+
+    section = "domain/%s" % domain
+    expected = {
+        "%s.id_provider" % section: ["ipa"],
+        "%s.ipa_domain" % section: normalize(domain),
+        "%s.ipa_hostname" % section: normalize(hostname),
+        "%s.cache_credentials" % section: ["true"],
+    }
+    if domain.lower() != realm.lower():
+        expected["%s.krb5_realm" % section] = normalize(realm)
+    profile = SSSD_PERFORMANCE_PROFILES[performance_profile]
+    for name, values in profile.items():
+        prefix = section if name == "domain" else name
+        for option, value in values.items():
+            expected["%s.%s" % (prefix, option)] = normalize(value)
+
+    actual = read_ini(paths.SSSD_CONF)
+    differences = compare("sssd.conf", expected, actual)
+
+    ipa_server = [s.strip() for s in
+                  actual.get("%s.ipa_server" % section, [""])[0].split(",")]
+    if any(s.lower() not in ipa_server for s in servers):
+        differences.append(dict(item="sssd.conf",
+                                option="%s.ipa_server" % section,
+                                expected=normalize(servers),
+                                actual=actual.get("%s.ipa_server" % section)))
+    enabled = [s.strip() for s in
+               actual.get("sssd.services", [""])[0].split(",")]
+    missing = [s for s in ["nss", "pam"] + services
+               if s not in enabled and s != "sshd"]
+    if missing:
+        differences.append(dict(item="sssd.conf", option="sssd.services",
+                                expected=sorted(enabled + missing),
+                                actual=actual.get("sssd.services")))
+    return differences
+
+
+def audit_keytab(realm, hostname):
+    from ipaplatform.paths import paths
+
+    host_principal = 'host/%s@%s' % (hostname, realm)
+    entries = read_keytab(paths.KRB5_KEYTAB)
+    if entries is None or \
+       host_principal not in [entry[0] for entry in entries]:
+        return [dict(item="keytab", option="principal",
+                     expected=host_principal, actual=None)]
+    return []
+
+
+def audit_nssdb(module, deadline):
+    from ipaplatform.paths import paths
+
+    ca_certs = read_pem_file(paths.IPA_CA_CRT)
+    nssdb_certs = nssdb_ca_certs(module, paths.IPA_NSSDB_DIR, deadline)
+    if nssdb_certs is None:
+        # The time budget has been used up
+        return None
+    missing = [cert_fingerprint(der) for der in ca_certs
+               if der not in nssdb_certs]
+    if not ca_certs or missing:
+        return [dict(item="nssdb", option="ca_certs",
+                     expected=sorted(cert_fingerprint(der)
+                                     for der in ca_certs),
+                     actual=sorted(cert_fingerprint(der)
+                                   for der in nssdb_certs))]
+    return []
+
+
+def main():
+    module = AnsibleModule(
+        argument_spec = dict(
+            servers=dict(required=False, type='list', default=[]),
+            domain=dict(required=True),
+            realm=dict(required=True),
+            hostname=dict(required=True),
+            basedn=dict(required=False),
+            dnsok=dict(required=False, type='bool', default=False),
+            krb5_tuned=dict(required=False, type='bool', default=False),
+            ccache=dict(required=False,
+                        default='KEYRING:persistent:%{uid}'),
+            services=dict(required=False, type='list',
+                          default=["ssh", "sudo"]),
+            performance_profile=dict(
+                required=False, default='default',
+                choices=sorted(SSSD_PERFORMANCE_PROFILES)),
+            time_budget=dict(required=False, type='float', default=5),
+        ),
+        supports_check_mode = True,
+    )
+
+    servers = module.params.get('servers')
+    domain = module.params.get('domain')
+    realm = module.params.get('realm')
+    hostname = module.params.get('hostname')
+    basedn = module.params.get('basedn')
+    dnsok = module.params.get('dnsok')
+    krb5_tuned = module.params.get('krb5_tuned')
+    ccache = module.params.get('ccache')
+    if not servers and not dnsok:
+        module.fail_json(msg="servers are required without dnsok")
+    services = module.params.get('services')
+    performance_profile = module.params.get('performance_profile')
+    time_budget = module.params.get('time_budget')
+
+    start = time.time()
+    deadline = start + time_budget
+
+    # Ordered by cost, the NSS database needs certutil runs
+    checks = [
+        ("keytab", lambda: audit_keytab(realm, hostname)),
+        ("default.conf", lambda: audit_default_conf(
+            servers, domain, realm, hostname, basedn)),
+        ("krb5.conf", lambda: audit_krb5_conf(servers, realm, dnsok,
+                                              krb5_tuned, ccache)),
+        ("sssd.conf", lambda: audit_sssd_conf(
+            servers, domain, realm, hostname, services,
+            performance_profile)),
+        ("nssdb", lambda: audit_nssdb(module, deadline)),
+    ]
+
+    differences = []
+    skipped = []
+    for name, check in checks:
+        if time.time() > deadline:
+            skipped.append(name)
+            continue
+        result = check()
+        if result is None:
+            skipped.append(name)
+            continue
+        differences.extend(result)
+
+    module.exit_json(changed=False, drifted=len(differences) > 0,
+                     differences=differences, skipped=skipped,
+                     elapsed=round(time.time() - start, 3))
+
+if __name__ == '__main__':
+    profiled(main)
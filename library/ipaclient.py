@@ -139,10 +139,7 @@ tbd
 import os
 from six.moves.configparser import RawConfigParser
 from ansible.module_utils.basic import AnsibleModule
-try:
-    from ipalib.install.sysrestore import SYSRESTORE_STATEFILE
-except ImportError:
-    from ipapython.sysrestore import SYSRESTORE_STATEFILE
+from ansible.module_utils.ansible_ipa_client import profiled
 from ipaplatform.paths import paths
 
 
@@ -156,6 +153,14 @@ def is_client_configured():
     :returns: boolean
     """
 
+    if not os.path.isfile(paths.IPA_DEFAULT_CONF):
+        return False
+
+    try:
+        from ipalib.install.sysrestore import SYSRESTORE_STATEFILE
+    except ImportError:
+        from ipapython.sysrestore import SYSRESTORE_STATEFILE
+
     return (os.path.isfile(paths.IPA_DEFAULT_CONF) and
             os.path.isfile(os.path.join(paths.IPA_CLIENT_SYSRESTORE,
                                         SYSRESTORE_STATEFILE)))
@@ -338,4 +343,4 @@ def main():
         ensure_not_ipa_client(module)
 
 if __name__ == '__main__':
-    main()
+    profiled(main)
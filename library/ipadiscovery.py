@@ -55,6 +55,12 @@ options:
     description: Check if IPA client is installed and matching.
     required: false
     default: false
+  srv_seed:
+    description: The seed for the weighted random ordering of servers with the same SRV priority. The hostname is used by default, the order is stable for the host.
+    required: false
+  location:
+    description: The IPA DNS location of the client. The servers and KDCs of the location are preferred. If not set, the location is detected from the DNS answer for the _ldap._tcp SRV records of the domain.
+    required: false
 author:
     - Thomas Woerner
 '''
@@ -83,6 +89,13 @@ EXAMPLES = '''
     realm: DOMAIN.COM
   register: ipadiscovery
 
+# Discovery preferring the servers of a DNS location
+- name: IPA discovery
+  ipadiscovery:
+    domain: domain.com
+    location: europe
+  register: ipadiscovery
+
 # Discovery using hostname, register return values as ipadiscovery
 - name: IPA discovery
   ipadiscovery:
@@ -92,10 +105,15 @@ EXAMPLES = '''
 
 RETURN = '''
 servers:
-  description: The list of detected or passed in IPA servers.
+  description: The list of detected or passed in IPA servers. Discovered servers are ordered by SRV priority and by weighted random selection within a priority (RFC 2782).
   returned: always
   type: list
   sample: ["server1.example.com","server2.example.com"]
+server:
+  description: The server the client uses for the enrollment. This is the first server of the SRV order (of the location), servers without SRV records are selected with rendezvous hashing of the client hostname. The selection is stable for the client and spreads the clients over the servers.
+  returned: always
+  type: string
+  sample: server2.example.com
 domain:
   description: The DNS domain of the detected or passed in IPA deployment.
   returned: always
@@ -140,6 +158,11 @@ ntp_servers:
   returned: always
   type: list
   sample: ["ntp.example.com"]
+location:
+  description: The IPA DNS location that is used, if any. The servers and KDCs of the location are returned first.
+  returned: always
+  type: string
+  sample: europe
 ipa_python_version:
   description: The IPA python version as a number: <major version>*10000+<minor version>*100+<release>
   returned: always
@@ -148,7 +171,10 @@ ipa_python_version:
 '''
 
 import os
+import random
 import socket
+import dns.resolver
+import dns.exception
 
 from six.moves.configparser import RawConfigParser
 from ansible.module_utils.basic import AnsibleModule
@@ -163,6 +189,7 @@ else:
     IPA_PYTHON_VERSION = NUM_VERSION
 from ipapython.dn import DN
 from ipaplatform.paths import paths
+from ansible.module_utils.ansible_ipa_client import select_server, profiled
 try:
     from ipaclient.install import ipadiscovery
 except ImportError:
@@ -223,6 +250,89 @@ def get_ipa_conf():
 
     return result
 
+def srv_lookup(name, default_port, rng):
+    """
+    Query the SRV records and order them as described in RFC 2782.
+
+    The records are ordered by priority, records with the same priority are
+    ordered by weighted random selection using rng.
+
+    :returns: list of servers, with ":port" if the port is not default_port
+    """
+    try:
+        answer = dns.resolver.query(name, "SRV")
+    except dns.exception.DNSException:
+        return []
+
+    priorities = dict()
+    for record in answer:
+        priorities.setdefault(record.priority, []).append(record)
+
+    servers = []
+    for priority in sorted(priorities):
+        # Records with weight 0 first, to give them a small chance
+        records = sorted(priorities[priority],
+                         key=lambda r: (r.weight, r.target.to_text()))
+        while records:
+            total = sum([r.weight for r in records])
+            value = rng.uniform(0, total)
+            running = 0
+            for record in records:
+                running += record.weight
+                if running >= value:
+                    break
+            records.remove(record)
+            server = record.target.to_text(omit_final_dot=True)
+            if record.port != default_port:
+                server = "%s:%d" % (server, record.port)
+            servers.append(server)
+    return servers
+
+
+def order_servers(servers, ordered):
+    """
+    Order the servers as in ordered, servers not in ordered are kept at the
+    end.
+    """
+    return [s for s in ordered if s in servers] + \
+        [s for s in servers if s not in ordered]
+
+
+def detect_location(domain):
+    """
+    Detect the IPA DNS location of the client.
+
+    The DNS servers of a location answer the query for the _ldap._tcp SRV
+    records of the domain with an alias to
+    _ldap._tcp.<location>._locations.<domain>.
+
+    :returns: the location or None
+    """
+    try:
+        answer = dns.resolver.query("_ldap._tcp.%s." % domain, "SRV")
+    except dns.exception.DNSException:
+        return None
+    labels = answer.canonical_name.to_text().split(".")
+    if "_locations" in labels:
+        index = labels.index("_locations")
+        if index > 2:
+            return labels[index-1]
+    return None
+
+
+def prefer_location(servers, location_servers, dnsok):
+    """
+    Order the servers of the location first. Discovered server lists are
+    extended with the servers of the location, passed in server lists are
+    only ordered.
+    """
+    if dnsok:
+        preferred = location_servers
+    else:
+        preferred = [s for s in location_servers if s in servers]
+    return preferred + [s for s in servers if s not in preferred]
+
+
 def main():
     module = AnsibleModule(
         argument_spec = dict(
@@ -232,6 +342,8 @@ def main():
             hostname=dict(required=False),
             ca_cert_file=dict(required=False),
             check=dict(required=False, type='bool', default=False),
+            location=dict(required=False),
+            srv_seed=dict(required=False),
         ),
         supports_check_mode = True,
     )
@@ -243,6 +355,8 @@ def main():
     opt_hostname = module.params.get('hostname')
     opt_ca_cert_file = module.params.get('ca_cert_file')
     opt_check = module.params.get('check')
+    opt_location = module.params.get('location')
+    opt_srv_seed = module.params.get('srv_seed')
 
     hostname = None
     hostname_source = None
@@ -440,8 +554,61 @@ def main():
                 "installation may fail.")
             break
 
-    # Detect NTP servers
+    # Order the discovered servers and KDCs by SRV priority and weight. The
+    # random generator is seeded per host to get a stable order.
+    rng = random.Random(opt_srv_seed or hostname)
+    srv_ordered = False
+    if dnsok:
+        ordered = srv_lookup("_ldap._tcp.%s." % cli_domain, 389, rng)
+        if ordered:
+            cli_server = order_servers(cli_server, ordered)
+            srv_ordered = True
+        ordered = srv_lookup("_kerberos._udp.%s." % cli_domain, 88, rng)
+        if ordered and cli_kdc:
+            cli_kdc = ','.join(order_servers(cli_kdc.split(','), ordered))
+
+    # Prefer the servers and KDCs of the IPA DNS location, fall back to the
+    # global records if the location does not have any. The location is
+    # only detected with DNS discovery, passed in servers are not ordered
+    # by a location that has not been requested.
     ds = ipadiscovery.IPADiscovery()
+    location = opt_location
+    if not location and dnsok:
+        location = detect_location(cli_domain)
+    location_servers = []
+    if location:
+        location_servers = srv_lookup(
+            "_ldap._tcp.%s._locations.%s." % (location, cli_domain), 389, rng)
+        if location_servers:
+            cli_server = prefer_location(cli_server, location_servers, dnsok)
+            location_kdcs = srv_lookup(
+                "_kerberos._udp.%s._locations.%s." % (location, cli_domain),
+                88, rng)
+            if not dnsok:
+                location_kdcs = [k for k in location_kdcs if k in cli_server]
+            if location_kdcs:
+                kdcs = cli_kdc.split(',') if cli_kdc else []
+                cli_kdc = ','.join(location_kdcs +
+                                   [k for k in kdcs if k not in location_kdcs])
+            module.log("Location: %s" % location)
+        else:
+            module.warn("No servers found for location '%s', using global "
+                        "servers" % location)
+            location = None
+    local_servers = [s for s in cli_server if s in location_servers]
+
+    # The server for the enrollment: The first server of the SRV order
+    # respects the published weights, servers without SRV records are
+    # selected with rendezvous hashing. This is also done if none of the
+    # servers of the location are in the given servers.
+    if local_servers:
+        server = local_servers[0]
+    elif srv_ordered:
+        server = cli_server[0]
+    else:
+        server = select_server(cli_server, hostname)
+
+    # Detect NTP servers
     ntp_servers = ds.ipadns_search_srv(cli_domain, '_ntp._udp',
                                        None, break_on_first=False)
 
@@ -459,6 +626,7 @@ def main():
     # Done
     module.exit_json(changed=True,
                      servers=cli_server,
+                     server=server,
                      domain=cli_domain,
                      realm=cli_realm,
                      kdc=cli_kdc,
@@ -468,7 +636,8 @@ def main():
                      dnsok=dnsok,
                      subject_base=subject_base,
                      ntp_servers=ntp_servers,
+                     location=location,
                      ipa_python_version=IPA_PYTHON_VERSION)
 
 if __name__ == '__main__':
-    main()
+    profiled(main)
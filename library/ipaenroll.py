@@ -0,0 +1,425 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Authors:
+#   Thomas Woerner <twoerner@redhat.com>
+#
+# Based on ipa-client-install code
+#
+# Copyright (C) 2017  Red Hat
+# see file 'COPYING' for use and warranty information
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+ANSIBLE_METADATA = {
+    'metadata_version': '1.0',
+    'supported_by': 'community',
+    'status': ['preview'],
+}
+
+DOCUMENTATION = '''
+---
+module: ipaenroll
+short description: Enroll a machine as IPA client in a single module run
+description:
+  Enroll a machine as IPA client in a single module run. The phases of the
+  ipatest, ipajoin, ipasssd, ipaapi, ipanss and ipaextras modules and the
+  configuration of default.conf and krb5.conf are done in one process,
+  sharing the loaded libraries, the temporary krb5.conf, the host TGT and
+  the CA certificates between the phases.
+options:
+  servers:
+    description: The FQDN of the IPA servers to connect to.
+    required: true
+  domain:
+    description: The primary DNS domain of an existing IPA deployment.
+    required: true
+  realm:
+    description: The Kerberos realm of an existing IPA deployment.
+    required: true
+  hostname:
+    description: The hostname of the machine to join (FQDN).
+    required: true
+  server:
+    description: The IPA server that created the host entry, for example the server returned by ipahost. The test, join and API phases are pinned to this server to not wait for replication. By default the server is selected from servers.
+    required: false
+  kdc:
+    description: The name or address of the host running the KDC.
+    required: true
+  basedn:
+    description: The basedn of the IPA server (of the form dc=example,dc=com).
+    required: true
+  subject_base:
+    description: The subject base, needed for certmonger
+    required: true
+  dnsok:
+    description: True if DNS discovery worked and not passed in any servers.
+    required: false
+    default: no
+  ntp_servers:
+    description: The ntp servers to configure if ntp is enabled.
+    required: false
+  principal:
+    description: The authorized kerberos principal used to join the IPA realm.
+    required: false
+  password:
+    description: The password to use if not using Kerberos to authenticate.
+    required: false
+  keytab:
+    description: The path to a backed-up host keytab from previous enrollment.
+    required: false
+  ca_cert_file:
+    description: A CA certificate to use. Do not acquire the IPA CA certificate via automated means.
+    required: false
+  force_join:
+    description: Force enrolling the host even if host entry exists.
+    required: false
+    default: no
+  allow_repair:
+    description: Allow repair of already joined hosts.
+    required: false
+    default: no
+  purge_keytab:
+    description: Purge the realm from the host keytab before joining. This is not done if the host keytab is working and force_join is not set.
+    required: false
+    default: no
+  kinit_attempts:
+    description: Repeat the request for host Kerberos ticket X times.
+    required: false
+    default: 5
+  services:
+    description: The services that should be enabled in the ssd configuration.
+    required: false
+    default: ["ssh", "sudo"]
+  krb5_offline_passwords:
+    description: Whether user passwords are stored when the server is offline.
+    required: false
+    default: yes
+  mkhomedir:
+    description: Whether to create home directories for users on their first login.
+    required: false
+    default: no
+  ntp:
+    description: Set to no to not configure and enable NTP
+    required: false
+    default: no
+  performance_profile:
+    description: The SSSD performance profile, see ipasssd.
+    required: false
+    default: default
+    choices: ["default", "large_directory", "high_churn", "login_heavy"]
+  debug:
+    description: Enable debug mode.
+    required: false
+  max_inflight:
+    description: The maximum number of concurrent operations on admission_server, the module execution is queued on the controller until a slot is free. The slot is released when the module is done. Not limited if not set.
+    required: false
+  rate:
+    description: The maximum number of operations started per second on admission_server, only used with max_inflight.
+    required: false
+  admission_server:
+    description: The IPA server the slot is acquired for, required with max_inflight.
+    required: false
+  admission_timeout:
+    description: The maximum time in seconds to wait for a slot, 0 is unlimited.
+    required: false
+    default: 0
+author:
+    - Thomas Woerner
+'''
+
+EXAMPLES = '''
+# Enroll the client using ipadiscovery return values
+- name: Enroll IPA client
+  ipaenroll:
+    servers: "{{ ipadiscovery.servers }}"
+    domain: "{{ ipadiscovery.domain }}"
+    realm: "{{ ipadiscovery.realm }}"
+    kdc: "{{ ipadiscovery.kdc }}"
+    basedn: "{{ ipadiscovery.basedn }}"
+    hostname: "{{ ipadiscovery.hostname }}"
+    subject_base: "{{ ipadiscovery.subject_base }}"
+    dnsok: "{{ ipadiscovery.dnsok }}"
+    ntp_servers: "{{ ipadiscovery.ntp_servers }}"
+    principal: admin
+    password: MySecretPassword
+  register: ipaenroll
+'''
+
+RETURN = '''
+krb5_keytab_ok:
+  description: The flag describes if krb5.keytab on the host was usable before the enrollment.
+  returned: always
+  type: bool
+already_joined:
+  description: The flag describes if the host is already joined.
+  returned: always
+  type: bool
+ca_enabled:
+  description: Wheter the Certificate Authority is enabled or not.
+  returned: if the configuration phases have been done
+  type: bool
+phases:
+  description: The results of the single phases (test, join, conf, sssd, krb5, api, nss, extras) as returned by the corresponding modules.
+  returned: always
+  type: dict
+plan:
+  description: The changes that would be done, computed from the local state without contacting the IPA server. Dict with the lists files, certs (SHA-256 fingerprints), services and rpcs.
+  returned: in check mode
+  type: dict
+'''
+
+import os
+
+from ansible.module_utils.basic import AnsibleModule
+from ipapython.version import NUM_VERSION, VERSION
+if NUM_VERSION < 40400:
+    raise Exception, "freeipa version '%s' is too old" % VERSION
+from ipaplatform.paths import paths
+from ansible.module_utils.ansible_ipa_client import client_install, \
+    configure_krb5_conf, sysrestore, temp_krb5_conf, remove_temp_krb5_conf, \
+    check_keytab, join_ipa, configure_sssd, api_enrollment, configure_nss, \
+    configure_extras, rendezvous_order, select_server, plan_join, plan_api, \
+    plan_nss, plan_extras, merge_plans, plan_changed, new_plan, \
+    SSSD_PERFORMANCE_PROFILES, profiled
+
+
+def purge_host_keytab(module, realm):
+    """
+    Purge the realm from the host keytab.
+
+    Error codes 3 (Unable to open keytab) and 5 (Principal name or realm not
+    found in keytab) are not treated as failures.
+    """
+    retcode, stdout, stderr = module.run_command(
+        ["/usr/sbin/ipa-rmkeytab", "-k", paths.KRB5_KEYTAB, "-r", realm])
+    if retcode not in (0, 3, 5):
+        module.fail_json(msg="Failed to purge %s from host keytab: %s" %
+                         (realm, stderr))
+
+
+def check_mode_plan(module, servers, domain, realm, hostname, server, basedn,
+                    ntp_servers, force_join, allow_repair, services,
+                    krb5_offline_passwords, mkhomedir, ntp,
+                    performance_profile):
+    """
+    Exit with the plan of all phases, nothing is changed.
+    """
+    join_plan, krb5_keytab_ok = plan_join(module, [server], realm, hostname,
+                                          force_join)
+    phases = dict(test=dict(changed=False, krb5_keytab_ok=krb5_keytab_ok,
+                            keytab_check="local"))
+    if krb5_keytab_ok and not force_join and not allow_repair:
+        module.exit_json(changed=False, krb5_keytab_ok=krb5_keytab_ok,
+                         already_joined=krb5_keytab_ok, phases=phases,
+                         plan=join_plan)
+
+    conf_plan = new_plan()
+    conf_plan['files'].extend([paths.IPA_DEFAULT_CONF, paths.KRB5_CONF])
+    applied, sssd_plan = configure_sssd(
+        module, servers, domain, realm, hostname, services,
+        krb5_offline_passwords, False, False, False, False, False, False,
+        dry_run=True, performance_profile=performance_profile)
+    api_plan, ca_enabled = plan_api([server], hostname)
+    nss_plan = plan_nss(module, [server], hostname, basedn, ca_enabled,
+                        mkhomedir, False)
+    extras_plan = plan_extras(module, servers, domain, ntp, False,
+                              ntp_servers, True, True, True, True, None,
+                              False, None, False, None, False)
+    for name, phase_plan in (("join", join_plan), ("conf", conf_plan),
+                             ("sssd", sssd_plan), ("api", api_plan),
+                             ("nss", nss_plan), ("extras", extras_plan)):
+        phases[name] = dict(changed=plan_changed(phase_plan), plan=phase_plan)
+    phases['sssd']['performance_profile'] = applied
+    plan = merge_plans(join_plan, conf_plan, sssd_plan, api_plan, nss_plan,
+                       extras_plan)
+    module.exit_json(changed=plan_changed(plan),
+                     krb5_keytab_ok=krb5_keytab_ok,
+                     already_joined=krb5_keytab_ok and not force_join,
+                     ca_enabled=ca_enabled, phases=phases, plan=plan)
+
+
+def main():
+    module = AnsibleModule(
+        argument_spec = dict(
+            servers=dict(required=True, type='list'),
+            domain=dict(required=True),
+            realm=dict(required=True),
+            hostname=dict(required=True),
+            server=dict(required=False),
+            kdc=dict(required=True),
+            basedn=dict(required=True),
+            subject_base=dict(required=True),
+            dnsok=dict(required=False, type='bool', default=False),
+            ntp_servers=dict(required=False, type='list'),
+            principal=dict(required=False),
+            password=dict(required=False, no_log=True),
+            keytab=dict(required=False),
+            ca_cert_file=dict(required=False),
+            force_join=dict(required=False, type='bool', default=False),
+            allow_repair=dict(required=False, type='bool', default=False),
+            purge_keytab=dict(required=False, type='bool', default=False),
+            kinit_attempts=dict(required=False, type='int', default=5),
+            services=dict(required=False, type='list',
+                          default=["ssh", "sudo"]),
+            krb5_offline_passwords=dict(required=False, type='bool',
+                                        default=True),
+            mkhomedir=dict(required=False, type='bool', default=False),
+            ntp=dict(required=False, type='bool', default=False),
+            performance_profile=dict(
+                required=False, default='default',
+                choices=sorted(SSSD_PERFORMANCE_PROFILES)),
+            debug=dict(required=False, type='bool'),
+        ),
+        supports_check_mode = True,
+    )
+
+    module._ansible_debug = True
+    servers = module.params.get('servers')
+    domain = module.params.get('domain')
+    realm = module.params.get('realm')
+    hostname = module.params.get('hostname')
+    server = module.params.get('server')
+    kdc = module.params.get('kdc')
+    basedn = module.params.get('basedn')
+    subject_base = module.params.get('subject_base')
+    dnsok = module.params.get('dnsok')
+    ntp_servers = module.params.get('ntp_servers')
+    principal = module.params.get('principal')
+    password = module.params.get('password')
+    keytab = module.params.get('keytab')
+    ca_cert_file = module.params.get('ca_cert_file')
+    force_join = module.params.get('force_join')
+    allow_repair = module.params.get('allow_repair')
+    purge_keytab = module.params.get('purge_keytab')
+    kinit_attempts = module.params.get('kinit_attempts')
+    services = module.params.get('services')
+    krb5_offline_passwords = module.params.get('krb5_offline_passwords')
+    mkhomedir = module.params.get('mkhomedir')
+    ntp = module.params.get('ntp')
+    performance_profile = module.params.get('performance_profile')
+    debug = module.params.get('debug')
+
+    if password is not None and password != "" and \
+       keytab is not None and keytab != "":
+        module.fail_json(msg="Password and keytab cannot be used together")
+
+    client_domain = hostname[hostname.find(".")+1:]
+    phases = dict()
+    changed = False
+    already_joined = False
+
+    # test, join and api phases are pinned to one server
+    if server is None:
+        server = select_server(servers, hostname)
+
+    if module.check_mode:
+        check_mode_plan(module, servers, domain, realm, hostname, server,
+                        basedn, ntp_servers, force_join, allow_repair,
+                        services, krb5_offline_passwords, mkhomedir, ntp,
+                        performance_profile)
+
+    # test and join phases, using the same temporary krb5.conf
+    krb_name = temp_krb5_conf(module, [server], domain, realm, hostname,
+                              server)
+    try:
+        krb5_keytab_ok, keytab_check = check_keytab(
+            module, [server], domain, realm, hostname, server,
+            kinit_attempts, krb_name=krb_name)
+        phases['test'] = dict(changed=False, krb5_keytab_ok=krb5_keytab_ok,
+                              keytab_check=keytab_check)
+
+        if not krb5_keytab_ok or force_join:
+            if not password and not keytab:
+                module.fail_json(
+                    msg="At least one of password or keytab must be "
+                    "specified")
+
+            if purge_keytab or force_join:
+                purge_host_keytab(module, realm)
+
+            _changed, already_joined = join_ipa(
+                module, [server], domain, realm, hostname, server, basedn,
+                principal, password, keytab, ca_cert_file, force_join,
+                kinit_attempts, debug, krb_name=krb_name)
+            changed = changed or _changed
+            phases['join'] = dict(changed=_changed,
+                                  already_joined=already_joined)
+    finally:
+        remove_temp_krb5_conf(module, krb_name)
+
+    if not allow_repair and (krb5_keytab_ok or already_joined):
+        try:
+            os.remove(paths.IPA_DNS_CCACHE)
+        except OSError:
+            pass
+        module.exit_json(changed=changed,
+                         krb5_keytab_ok=krb5_keytab_ok,
+                         already_joined=already_joined,
+                         phases=phases)
+
+    client = client_install()
+    fstore = sysrestore().FileStore(paths.IPA_CLIENT_SYSRESTORE)
+
+    # IPA default.conf, the first server is used for the API calls
+    conf_servers = [server]
+    conf_servers.extend([s for s in rendezvous_order(servers, hostname)
+                         if s != server])
+    client.configure_ipa_conf(fstore, basedn, realm, domain, conf_servers,
+                              hostname)
+    phases['conf'] = dict(changed=True)
+
+    applied, plan = configure_sssd(
+        module, servers, domain, realm, hostname, services,
+        krb5_offline_passwords, False, False, False, False, False, False,
+        performance_profile=performance_profile)
+    phases['sssd'] = dict(changed=True, performance_profile=applied)
+
+    # krb5.conf
+    if not fstore.has_file(paths.KRB5_CONF):
+        fstore.backup_file(paths.KRB5_CONF)
+    configure_krb5_conf(
+        cli_realm=realm,
+        cli_domain=domain,
+        cli_server=servers,
+        cli_kdc=kdc,
+        dnsok=dnsok,
+        filename=paths.KRB5_CONF,
+        client_domain=client_domain,
+        client_hostname=hostname,
+        configure_sssd=True,
+        force=False)
+    phases['krb5'] = dict(changed=True)
+
+    ca_enabled = api_enrollment(module, realm, hostname, debug,
+                                server=server)
+    phases['api'] = dict(changed=True, ca_enabled=ca_enabled)
+
+    configure_nss(module, [server], domain, realm, hostname, basedn,
+                  principal, subject_base, ca_enabled, mkhomedir, False)
+    phases['nss'] = dict(changed=True, ca_enabled_ra=ca_enabled)
+
+    configure_extras(module, servers, domain, ntp, False, ntp_servers,
+                     True, True, True, True, None, False, None, False, None,
+                     False)
+    phases['extras'] = dict(changed=True)
+
+    module.exit_json(changed=True,
+                     krb5_keytab_ok=krb5_keytab_ok,
+                     already_joined=already_joined,
+                     ca_enabled=ca_enabled,
+                     phases=phases)
+
+if __name__ == '__main__':
+    profiled(main)
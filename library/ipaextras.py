@@ -97,66 +97,18 @@ EXAMPLES = '''
 '''
 
 RETURN = '''
+plan:
+  description: The changes that would be done, computed from the local state without contacting the IPA server. Dict with the lists files, certs (SHA-256 fingerprints), services and rpcs.
+  returned: in check mode
+  type: dict
 '''
 
-import os
-import sys
-import tempfile
-import inspect
-import logging
-
 from ansible.module_utils.basic import AnsibleModule
 from ipapython.version import NUM_VERSION, VERSION
 if NUM_VERSION < 40400:
     raise Exception, "freeipa version '%s' is too old" % VERSION
-try:
-    from ipalib.install import sysrestore
-except ImportError:
-    from ipapython import sysrestore
-from ipaplatform.paths import paths
-try:
-    from ipaclient.install.client import CCACHE_FILE, configure_ssh_config, \
-        configure_sshd_config, configure_automount, configure_firefox, \
-        configure_nisdomain
-except ImportError:
-    # Create temporary copy of ipa-client-install script (as
-    # ipa_client_install.py) to be able to import the script easily and also
-    # to remove the global finally clause in which the generated ccache file
-    # gets removed. The ccache file will be needed in the next step.
-    # This is done in a temporary directory that gets removed right after
-    # ipa_client_install has been imported.
-    import shutil
-    temp_dir = tempfile.mkdtemp(dir="/tmp")
-    sys.path.append(temp_dir)
-    temp_file = "%s/ipa_client_install.py" % temp_dir
-
-    with open("/usr/sbin/ipa-client-install", "r") as f_in:
-        with open(temp_file, "w") as f_out:
-            for line in f_in:
-                if line.startswith("finally:"):
-                    break
-                f_out.write(line)
-    import ipa_client_install
-
-    shutil.rmtree(temp_dir, ignore_errors=True)
-    sys.path.remove(temp_dir)
-
-    argspec = inspect.getargspec(ipa_client_install.configure_nisdomain)
-    if len(argspec.args) == 3:
-        configure_nisdomain = ipa_client_install.configure_nisdomain
-    else:
-        def configure_nisdomain(options, domain, statestore=None):
-            return ipa_client_install.configure_nisdomain(options, domain)
-
-    CCACHE_FILE = paths.IPA_DNS_CCACHE
-    configure_ssh_config = ipa_client_install.configure_ssh_config
-    configure_sshd_config = ipa_client_install.configure_sshd_config
-    configure_automount = ipa_client_install.configure_automount
-    configure_firefox = ipa_client_install.configure_firefox
-try:
-    from ipaclient.install import ntpconf
-except ImportError:
-    from ipaclient import ntpconf
+from ansible.module_utils.ansible_ipa_client import configure_extras, \
+    plan_extras, plan_changed, profiled
 
 def main():
     module = AnsibleModule(
@@ -197,53 +149,18 @@ def main():
     nisdomain = module.params.get('nisdomain')
     on_master = module.params.get('on_master')
     
-    fstore = sysrestore.FileStore(paths.IPA_CLIENT_SYSRESTORE)
-    statestore = sysrestore.StateFile(paths.IPA_CLIENT_SYSRESTORE)
-    logger = logging.getLogger("ipa-client-install")
-
-    os.environ['KRB5CCNAME'] = CCACHE_FILE
-    
-    class Object(object):
-        pass
-    options = Object()
-    options.sssd = sssd
-    options.trust_sshfp = trust_sshfp
-    options.location = automount_location
-    options.server = servers
-    options.firefox_dir = firefox_dir
-    options.nisdomain = nisdomain
-
-    if ntp and not on_master:
-        # disable other time&date services first
-        if force_ntpd:
-            ntpconf.force_ntpd(statestore)
-
-        ntpconf.config_ntp(ntp_servers, fstore, statestore)
-        module.log("NTP enabled")
-
-    if ssh:
-        configure_ssh_config(fstore, options)
-
-    if sshd:
-        configure_sshd_config(fstore, options)
-
-    if automount_location:
-        configure_automount(options)
-
-    if firefox:
-        configure_firefox(options, statestore, domain)
-
-    if not no_nisdomain:
-        configure_nisdomain(
-            options=options, domain=domain, statestore=statestore)
+    if module.check_mode:
+        plan = plan_extras(module, servers, domain, ntp, force_ntpd,
+                           ntp_servers, ssh, sssd, trust_sshfp, sshd,
+                           automount_location, firefox, firefox_dir,
+                           no_nisdomain, nisdomain, on_master)
+        module.exit_json(changed=plan_changed(plan), plan=plan)
 
-    # Cleanup: Remove CCACHE_FILE
-    try:
-        os.remove(CCACHE_FILE)
-    except Exception:
-        pass
+    configure_extras(module, servers, domain, ntp, force_ntpd, ntp_servers,
+                     ssh, sssd, trust_sshfp, sshd, automount_location,
+                     firefox, firefox_dir, no_nisdomain, nisdomain, on_master)
 
     module.exit_json(changed=True)
 
 if __name__ == '__main__':
-    main()
+    profiled(main)
@@ -0,0 +1,252 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Authors:
+#   Thomas Woerner <twoerner@redhat.com>
+#
+# Copyright (C) 2017  Red Hat
+# see file 'COPYING' for use and warranty information
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+ANSIBLE_METADATA = {
+    'metadata_version': '1.0',
+    'supported_by': 'community',
+    'status': ['preview'],
+}
+
+DOCUMENTATION = '''
+---
+module: ipafingerprint
+short description: Fingerprint the IPA client configuration
+description:
+  Create a fingerprint of the IPA client configuration in a single local
+  pass. The fingerprint covers default.conf, krb5.conf, sssd.conf, the
+  principals and kvnos in the host keytab, the IPA NSS database and the
+  sysrestore index. The fingerprint is compared with the one that has been
+  stored after the last successful enrollment. Nothing is contacted on the
+  network, a converged result does not mean that the host entry still exists
+  on the server.
+options:
+  domain:
+    description: The expected primary DNS domain of the IPA deployment.
+    required: false
+  realm:
+    description: The expected Kerberos realm of the IPA deployment.
+    required: false
+  servers:
+    description: The expected FQDN of the IPA servers.
+    required: false
+    type: list
+  hostname:
+    description: The hostname of the machine (FQDN).
+    required: true
+  settings:
+    description: The other parameters that affect the generated configuration, for example the SSSD profile or the krb5.conf settings. A change of the settings is reported as drift of expected.
+    required: false
+    type: dict
+    default: {}
+  store:
+    description: Store the fingerprint of the current configuration as the expected one.
+    required: false
+    default: no
+  fingerprint_file:
+    description: The file the expected fingerprint is stored in.
+    required: false
+    default: /var/lib/ipa-client/fingerprint.json
+author:
+    - Thomas Woerner
+'''
+
+EXAMPLES = '''
+# Check if the client configuration has drifted
+- name: Check IPA client fingerprint
+  ipafingerprint:
+    domain: example.com
+    realm: EXAMPLE.COM
+    hostname: client1.example.com
+  register: ipafingerprint
+
+# Store the fingerprint after enrollment
+- name: Store IPA client fingerprint
+  ipafingerprint:
+    domain: "{{ ipadiscovery.domain }}"
+    realm: "{{ ipadiscovery.realm }}"
+    hostname: "{{ ipadiscovery.hostname }}"
+    store: yes
+'''
+
+RETURN = '''
+fingerprint:
+  description: The fingerprint (sha256) of the current client configuration.
+  returned: always
+  type: string
+converged:
+  description: True if the fingerprint matches the stored one and the expected values.
+  returned: always
+  type: bool
+drift:
+  description: The list of items that differ from the stored fingerprint.
+  returned: always
+  type: list
+  sample: ["krb5.conf", "keytab"]
+'''
+
+import os
+import json
+import hashlib
+
+from ansible.module_utils.basic import AnsibleModule
+from ipaplatform.paths import paths
+from ansible.module_utils.ansible_ipa_client import read_keytab, profiled
+
+FINGERPRINT_FILE = "/var/lib/ipa-client/fingerprint.json"
+
+
+def hash_file(filename):
+    """
+    Return the sha256 of the file content or None if it does not exist.
+    """
+    digest = hashlib.sha256()
+    try:
+        with open(filename, "rb") as f:
+            for block in iter(lambda: f.read(65536), b""):
+                digest.update(block)
+    except (IOError, OSError):
+        return None
+    return digest.hexdigest()
+
+
+def hash_dir(dirname):
+    """
+    Return the sha256 of the names and contents of the regular files in the
+    directory or None if the directory does not exist.
+    """
+    if not os.path.isdir(dirname):
+        return None
+    digest = hashlib.sha256()
+    for name in sorted(os.listdir(dirname)):
+        value = hash_file(os.path.join(dirname, name))
+        if value is not None:
+            digest.update(("%s:%s\n" % (name, value)).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def hash_keytab(filename):
+    """
+    Return the sha256 of the principals, kvnos and enctypes in the keytab.
+    Keytabs that can not be parsed are hashed as a file.
+    """
+    entries = read_keytab(filename)
+    if entries is None:
+        return hash_file(filename)
+    digest = hashlib.sha256()
+    for entry in sorted(entries):
+        digest.update(("%s:%d:%d\n" % entry).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def get_fingerprint(domain, realm, servers, hostname, settings):
+    """
+    Create the fingerprint items of the current client configuration.
+
+    :returns: dict item name -> sha256 digest
+    """
+    expected = json.dumps(dict(domain=domain, realm=realm,
+                               servers=sorted(servers or []),
+                               hostname=hostname, settings=settings or {}),
+                          sort_keys=True)
+    return {
+        "expected": hashlib.sha256(expected.encode("utf-8")).hexdigest(),
+        "default.conf": hash_file(paths.IPA_DEFAULT_CONF),
+        "krb5.conf": hash_file(paths.KRB5_CONF),
+        "sssd.conf": hash_file(paths.SSSD_CONF),
+        "keytab": hash_keytab(paths.KRB5_KEYTAB),
+        "nssdb": hash_dir(paths.IPA_NSSDB_DIR),
+        "sysrestore": hash_file(os.path.join(paths.IPA_CLIENT_SYSRESTORE,
+                                             "sysrestore.index")),
+    }
+
+
+def combine(items):
+    """
+    Combine the fingerprint items to a single sha256 digest.
+    """
+    digest = hashlib.sha256()
+    for key in sorted(items):
+        digest.update(("%s:%s\n" % (key, items[key])).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def main():
+    module = AnsibleModule(
+        argument_spec = dict(
+            domain=dict(required=False),
+            realm=dict(required=False),
+            servers=dict(required=False, type='list'),
+            hostname=dict(required=True),
+            settings=dict(required=False, type='dict', default=dict()),
+            store=dict(required=False, type='bool', default=False),
+            fingerprint_file=dict(required=False, type='path',
+                                  default=FINGERPRINT_FILE),
+        ),
+        supports_check_mode = True,
+    )
+
+    module._ansible_debug = True
+    domain = module.params.get('domain')
+    realm = module.params.get('realm')
+    servers = module.params.get('servers')
+    hostname = module.params.get('hostname')
+    settings = module.params.get('settings')
+    store = module.params.get('store')
+    fingerprint_file = module.params.get('fingerprint_file')
+
+    items = get_fingerprint(domain, realm, servers, hostname, settings)
+    fingerprint = combine(items)
+
+    try:
+        with open(fingerprint_file, "r") as f:
+            stored = json.load(f)
+    except (IOError, OSError, ValueError):
+        stored = None
+
+    if stored is None:
+        drift = sorted(items)
+    else:
+        # A client without default.conf or host keytab is never converged
+        drift = sorted([key for key in items
+                        if stored.get("items", {}).get(key) != items[key] or
+                        (items[key] is None and
+                         key in ("default.conf", "keytab"))])
+    converged = len(drift) == 0
+
+    if store and (stored is None or stored.get("fingerprint") != fingerprint):
+        if not module.check_mode:
+            dirname = os.path.dirname(fingerprint_file)
+            if not os.path.isdir(dirname):
+                module.fail_json(msg="Directory %s does not exist" % dirname)
+            temp_name = fingerprint_file + ".tmp"
+            with open(temp_name, "w") as f:
+                json.dump(dict(fingerprint=fingerprint, items=items), f)
+            os.chmod(temp_name, 0o600)
+            os.rename(temp_name, fingerprint_file)
+        module.exit_json(changed=True, fingerprint=fingerprint,
+                         converged=True, drift=[])
+
+    module.exit_json(changed=False, fingerprint=fingerprint,
+                     converged=converged, drift=drift)
+
+if __name__ == '__main__':
+    profiled(main)
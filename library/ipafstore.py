@@ -55,11 +55,9 @@ from ansible.module_utils.basic import AnsibleModule
 from ipapython.version import NUM_VERSION, VERSION
 if NUM_VERSION < 40400:
     raise Exception, "freeipa version '%s' is too old" % VERSION
-try:
-    from ipalib.install import sysrestore
-except ImportError:
-    from ipapython import sysrestore
 from ipaplatform.paths import paths
+from ansible.module_utils.ansible_ipa_client import is_file_backed_up, \
+    sysrestore, profiled
 
 def main():
     module = AnsibleModule(
@@ -71,12 +69,15 @@ def main():
     module._ansible_debug = True
     backup = module.params.get('backup')
 
-    fstore = sysrestore.FileStore(paths.IPA_CLIENT_SYSRESTORE)
-    if not fstore.has_file(backup):
-        fstore.backup_file(backup)
-        module.exit_json(changed=True)
+    # Check the sysrestore index directly, the FileStore is only needed
+    # if the file has not been backed up yet.
+    if not is_file_backed_up(paths.IPA_CLIENT_SYSRESTORE, backup):
+        fstore = sysrestore().FileStore(paths.IPA_CLIENT_SYSRESTORE)
+        if not fstore.has_file(backup):
+            fstore.backup_file(backup)
+            module.exit_json(changed=True)
 
     module.exit_json(changed=False)
 
 if __name__ == '__main__':
-    main()
+    profiled(main)
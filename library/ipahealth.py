@@ -0,0 +1,267 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Authors:
+#   Thomas Woerner <twoerner@redhat.com>
+#
+# Copyright (C) 2017  Red Hat
+# see file 'COPYING' for use and warranty information
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+ANSIBLE_METADATA = {
+    'metadata_version': '1.0',
+    'supported_by': 'community',
+    'status': ['preview'],
+}
+
+DOCUMENTATION = '''
+---
+module: ipahealth
+short description: Measure the performance of an enrolled IPA client
+description:
+  Measure the performance of an enrolled IPA client. The latency of
+  getent passwd and getent group with a cold and a warm SSSD cache, of a
+  kinit with the host keytab per KDC, of a LDAP bind per server and of the
+  sudo rule lookup is compared with thresholds. Nothing is changed on the
+  host, except that the SSSD cache entries of the tested users and groups
+  are invalidated for the cold cache measurement.
+options:
+  servers:
+    description: The FQDN of the IPA servers. Every server is tested as KDC and LDAP server.
+    required: true
+  domain:
+    description: The primary DNS domain of an existing IPA deployment.
+    required: true
+  realm:
+    description: The Kerberos realm of an existing IPA deployment.
+    required: true
+  hostname:
+    description: The hostname of the machine (FQDN).
+    required: true
+  users:
+    description: The users to look up with getent passwd and sudo.
+    required: false
+    default: ["admin"]
+  groups:
+    description: The groups to look up with getent group.
+    required: false
+    default: ["admins"]
+  cold_cache:
+    description: Invalidate the SSSD cache entries of the users and groups before the first lookup to measure the cold cache latency. Not done in check mode.
+    required: false
+    default: yes
+  thresholds:
+    description: The maximum latencies in seconds for getent_cold, getent_warm, kinit, ldap_bind and sudo. Missing keys are set to the defaults 2.0, 0.1, 1.0, 0.5 and 2.0.
+    required: false
+  fail_on_threshold:
+    description: Fail if a check is over its threshold or fails. Otherwise the result is only reported.
+    required: false
+    default: no
+author:
+    - Thomas Woerner
+'''
+
+EXAMPLES = '''
+# Check the client after the enrollment
+- name: IPA client performance health check
+  ipahealth:
+    servers: "{{ ipadiscovery.servers }}"
+    domain: "{{ ipadiscovery.domain }}"
+    realm: "{{ ipadiscovery.realm }}"
+    hostname: "{{ ipadiscovery.hostname }}"
+    users: ["admin", "jdoe"]
+    groups: ["admins"]
+    thresholds:
+      kinit: 0.5
+    fail_on_threshold: yes
+  register: ipahealth
+'''
+
+RETURN = '''
+passed:
+  description: True if all checks succeeded within their thresholds.
+  returned: always
+  type: bool
+failures:
+  description: The checks that failed or were over their thresholds.
+  returned: always
+  type: list
+report:
+  description: The measured latencies in seconds, with the keys getent (passwd and group per name with cold and warm), kinit (per KDC), ldap_bind (per server) and sudo (per user). Every entry contains the time, the threshold, ok and the error message if the check failed.
+  returned: always
+  type: dict
+thresholds:
+  description: The thresholds that have been used.
+  returned: always
+  type: dict
+'''
+
+import os
+import time
+import shutil
+import tempfile
+
+from ansible.module_utils.basic import AnsibleModule
+from ipapython.version import NUM_VERSION, VERSION
+if NUM_VERSION < 40400:
+    raise Exception, "freeipa version '%s' is too old" % VERSION
+from ansible.module_utils.ansible_ipa_client import temp_krb5_conf, \
+    remove_temp_krb5_conf, profiled
+
+DEFAULT_THRESHOLDS = dict(
+    getent_cold=2.0,
+    getent_warm=0.1,
+    kinit=1.0,
+    ldap_bind=0.5,
+    sudo=2.0,
+)
+
+
+def timed_run(module, args, threshold, environ_update=None):
+    """
+    Run the command and return the result entry for the report.
+    """
+    start = time.time()
+    retcode, stdout, stderr = module.run_command(
+        args, environ_update=environ_update)
+    elapsed = time.time() - start
+    result = dict(time=round(elapsed, 4), threshold=threshold,
+                  ok=retcode == 0 and elapsed <= threshold)
+    if retcode != 0:
+        result['error'] = (stderr or stdout).strip() or "rc %d" % retcode
+    return result
+
+
+def main():
+    module = AnsibleModule(
+        argument_spec = dict(
+            servers=dict(required=True, type='list'),
+            domain=dict(required=True),
+            realm=dict(required=True),
+            hostname=dict(required=True),
+            users=dict(required=False, type='list', default=["admin"]),
+            groups=dict(required=False, type='list', default=["admins"]),
+            cold_cache=dict(required=False, type='bool', default=True),
+            thresholds=dict(required=False, type='dict', default=dict()),
+            fail_on_threshold=dict(required=False, type='bool',
+                                   default=False),
+        ),
+        supports_check_mode = True,
+    )
+
+    module._ansible_debug = True
+    servers = module.params.get('servers')
+    domain = module.params.get('domain')
+    realm = module.params.get('realm')
+    hostname = module.params.get('hostname')
+    users = module.params.get('users')
+    groups = module.params.get('groups')
+    cold_cache = module.params.get('cold_cache')
+    fail_on_threshold = module.params.get('fail_on_threshold')
+
+    thresholds = dict(DEFAULT_THRESHOLDS)
+    for key, value in module.params.get('thresholds').items():
+        if key not in DEFAULT_THRESHOLDS:
+            module.fail_json(msg="Unknown threshold '%s'" % key)
+        try:
+            thresholds[key] = float(value)
+        except ValueError:
+            module.fail_json(msg="Threshold '%s' is not a number" % key)
+
+    from ipaplatform.paths import paths
+
+    report = dict(getent=dict(passwd=dict(), group=dict()), kinit=dict(),
+                  ldap_bind=dict(), sudo=dict())
+
+    # getent, cold and warm cache
+    lookups = [("passwd", name) for name in users] + \
+              [("group", name) for name in groups]
+    if cold_cache and not module.check_mode:
+        for database, name in lookups:
+            module.run_command(
+                ["sss_cache", "-u" if database == "passwd" else "-g", name])
+    for database, name in lookups:
+        report['getent'][database][name] = dict(
+            cold=timed_run(module, ["getent", database, name],
+                           thresholds['getent_cold']),
+            warm=timed_run(module, ["getent", database, name],
+                           thresholds['getent_warm']))
+
+    # kinit with the host keytab and LDAP bind per server, every server is
+    # used with a temporary krb5.conf that only contains this server
+    host_principal = 'host/%s@%s' % (hostname, realm)
+    ccache_dir = tempfile.mkdtemp(prefix='krbcc')
+    try:
+        for server in servers:
+            krb_name = temp_krb5_conf(module, [server], domain, realm,
+                                      hostname, server)
+            env = dict(KRB5_CONFIG=krb_name,
+                       KRB5CCNAME=os.path.join(ccache_dir, server))
+            try:
+                report['kinit'][server] = timed_run(
+                    module, ["kinit", "-k", "-t", paths.KRB5_KEYTAB,
+                             host_principal],
+                    thresholds['kinit'], environ_update=env)
+                if "error" in report['kinit'][server]:
+                    report['ldap_bind'][server] = dict(
+                        time=None, threshold=thresholds['ldap_bind'],
+                        ok=False, error="No host TGT from %s" % server)
+                    continue
+                report['ldap_bind'][server] = timed_run(
+                    module, ["ldapwhoami", "-Q", "-Y", "GSSAPI",
+                             "-H", "ldap://%s" % server],
+                    thresholds['ldap_bind'], environ_update=env)
+            finally:
+                remove_temp_krb5_conf(module, krb_name)
+    finally:
+        shutil.rmtree(ccache_dir, ignore_errors=True)
+
+    # sudo rule lookup
+    for name in users:
+        report['sudo'][name] = timed_run(
+            module, ["sudo", "-n", "-l", "-U", name], thresholds['sudo'])
+
+    failures = []
+
+    def check(label, result):
+        if result['ok']:
+            return
+        if "error" in result:
+            failures.append("%s: %s" % (label, result['error']))
+        else:
+            failures.append("%s: %.3fs > %.3fs" %
+                            (label, result['time'], result['threshold']))
+
+    for database in ("passwd", "group"):
+        for name, result in report['getent'][database].items():
+            check("getent %s %s (cold)" % (database, name), result['cold'])
+            check("getent %s %s (warm)" % (database, name), result['warm'])
+    for server in servers:
+        check("kinit %s" % server, report['kinit'][server])
+        check("ldap bind %s" % server, report['ldap_bind'][server])
+    for name in users:
+        check("sudo %s" % name, report['sudo'][name])
+
+    if failures and fail_on_threshold:
+        module.fail_json(msg="Performance health check failed: %s" %
+                         ", ".join(failures),
+                         passed=False, failures=failures, report=report,
+                         thresholds=thresholds)
+
+    module.exit_json(changed=False, passed=not failures, failures=failures,
+                     report=report, thresholds=thresholds)
+
+if __name__ == '__main__':
+    profiled(main)
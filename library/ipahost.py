@@ -48,9 +48,40 @@ options:
     description: Sets the default lifetime for initial ticket requests
     required: false
     default: 1h
+  realm:
+    description: The Kerberos realm, read from the IPA server if not set together with domain
+    required: false
+  domain:
+    description: The DNS domain, read from the IPA server if not set together with realm
+    required: false
+  execution:
+    description: Run the host operations with the module on the IPA server (remote) or directly from the controller with the JSON-RPC interface of the server (controller)
+    required: false
+    default: remote
+    choices: [ "remote", "controller" ]
+  ca_cert:
+    description: The IPA CA certificate on the controller to verify the server with execution controller, the system CA store is used by default
+    required: false
+  max_inflight:
+    description: The maximum number of concurrent operations on the IPA server, additional operations are queued on the controller
+    required: false
+  rate:
+    description: The maximum number of operations started per second on the IPA server, only used with max_inflight
+    required: false
+  admission_server:
+    description: The IPA server the slot is acquired for, the host the task is delegated to by default.
+    required: false
+  admission_timeout:
+    description: The maximum time in seconds to wait for a slot, 0 is unlimited.
+    required: false
+    default: 0
   fqdn:
     description: the fully-qualified hostname of the host to add/modify/remove
-    required: true
+    required: false
+  hosts:
+    description: A list of fully-qualified hostnames to generate random passwords for. The hosts are added or modified in a single batch call, random needs to be set. Mutually exclusive with fqdn.
+    required: false
+    type: list
   random:
     description: generate a random password to be used in bulk enrollment
     type: bool
@@ -69,6 +100,15 @@ options:
   ipaddress:
     description: the IP address for the host
     required: false
+  session_reuse:
+    description: Reuse the IPA session cookie of the principal for the server from earlier runs (stored in ~/.cache/ansible_ipa_sessions.json on the IPA server, with execution controller in ~/.cache/ansible_ipa_controller_sessions.json on the controller) instead of a new Kerberos negotiation. Kerberos is used if the cookie has expired or is rejected.
+    required: false
+    default: no
+    type: bool
+  return_attributes:
+    description: The attributes of the host entry to return in host. The host is then looked up without the additional attributes of all and the host entry returned by the last change is used instead of reading it again, unless it does not contain all of these attributes. With an empty list only randompassword is returned. The full host entry is returned if not set.
+    required: false
+    type: list
 
 author:
     - "Florence Blanc-Renaud"
@@ -90,6 +130,25 @@ EXAMPLES = '''
     keytab: admin.keytab
     fqdn: ipaclient.ipa.domain.com
 
+# Generate random OTPs for several hosts in one batch
+- ipahost:
+    principal: admin
+    password: MySecretPassword
+    hosts:
+    - ipaclient1.ipa.domain.com
+    - ipaclient2.ipa.domain.com
+    random: True
+  register: ipahost
+
+# Add a new host with a random OTP, only return the OTP
+- ipahost:
+    principal: admin
+    password: MySecretPassword
+    fqdn: ipaclient.ipa.domain.com
+    random: True
+    return_attributes: []
+  register: ipahost
+
 # Remove a host, authenticate using principal/password
 - ipahost:
     principal: admin
@@ -107,30 +166,66 @@ EXAMPLES = '''
 '''
 
 RETURN = '''
-tbd
+host:
+  description: The host entry as returned by IPA or the attributes of return_attributes, with randompassword if a random password has been requested.
+  returned: if state is present
+  type: dict
+hosts:
+  description: The random passwords per host, if hosts is used. Hosts that failed contain the error message instead of the password.
+  returned: if hosts is used
+  type: dict
+  sample: {"ipaclient1.ipa.domain.com": {"randompassword": "..."}, "ipaclient2.ipa.domain.com": {"error": "..."}}
+server:
+  description: The IPA server the changes have been sent to. The host entry is available on this server first, further enrollment steps should use it to not wait for replication.
+  returned: always
+  type: string
+  sample: server1.example.com
 '''
 
 import os
 import tempfile
+from six.moves.urllib.parse import urlparse
 
 from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.ansible_ipa_client import load_session_cookie, \
+    save_session_cookie, cert_der, cert_fingerprint, sshpubkey_key, profiled
 
-from ipalib import api, errors, x509
-from ipalib.install.kinit import kinit_keytab, kinit_password
+from ipalib import api, errors
 from ipaplatform.paths import paths
 from ipapython.ipautil import run
 
+def get_server(api):
+    """
+    Return the name of the IPA server the API is connected to.
+    """
+    return urlparse(api.env.xmlrpc_uri).hostname
+
+
+def normalize_values(key, values):
+    """
+    Return the set of normalized values of a multi-valued attribute.
+    """
+    if key == 'usercertificate':
+        return set(cert_fingerprint(cert_der(value)) for value in values)
+    if key == 'ipasshpubkey':
+        return set(sshpubkey_key(value) for value in values)
+    return set(unicode(value) for value in values)
+
+
 def get_host_diff(ipa_host, module_host):
     """
     Compares two dictionaries containing host attributes and builds a dict
     of differences.
 
+    Multi-valued attributes are compared as sets of normalized values.
+    Certificates are not part of the result, see get_cert_delta.
+
     :param ipa_host: the host structure seen from IPA
     :param module_host: the target host structure seen from the module params
 
     :return: a dict representing the host attributes to apply
     """
-    non_updateable_keys = ['ip_address']
+    non_updateable_keys = ['ip_address', 'usercertificate']
     data = dict()
     for key in non_updateable_keys:
         if key in module_host:
@@ -139,16 +234,46 @@ def get_host_diff(ipa_host, module_host):
     for key in module_host.keys():
         ipa_value = ipa_host.get(key, None)
         module_value = module_host.get(key, None)
-        if isinstance(ipa_value, list) and not isinstance(module_value, list):
-            module_value = [module_value]
-        if isinstance(ipa_value, list) and isinstance(module_value, list):
-            ipa_value = sorted(ipa_value)
-            module_value = sorted(module_value)
-        if ipa_value != module_value:
-            data[key]=unicode(module_value)
+        if isinstance(ipa_value, list) or isinstance(module_value, list):
+            if not isinstance(module_value, list):
+                module_value = [module_value]
+            if normalize_values(key, ipa_value or []) != \
+               normalize_values(key, module_value):
+                data[key] = [unicode(value) for value in module_value]
+        elif ipa_value != module_value:
+            if isinstance(module_value, bool):
+                data[key] = module_value
+            else:
+                data[key] = unicode(module_value)
     return data
 
 
+def get_cert_delta(ipa_host, certificates):
+    """
+    Compares the certificates of the host in IPA with the certificates of
+    the module params by the fingerprints of the DER encoding.
+
+    :param ipa_host: the host structure seen from IPA
+    :param certificates: the certificates of the module params
+
+    :return: tuple (add, remove) with the DER encoded certificates to add
+             to and to remove from the host
+    """
+    if not certificates:
+        return ([], [])
+    current = dict()
+    for cert in ipa_host.get('usercertificate', []):
+        der = cert_der(cert)
+        current[cert_fingerprint(der)] = der
+    wanted = dict()
+    for cert in certificates:
+        der = cert_der(cert)
+        wanted[cert_fingerprint(der)] = der
+    add = [wanted[fp] for fp in sorted(wanted) if fp not in current]
+    remove = [current[fp] for fp in sorted(current) if fp not in wanted]
+    return (add, remove)
+
+
 def get_module_host(module):
     """
     Creates a structure representing the host information
@@ -164,7 +289,7 @@ def get_module_host(module):
         data['usercertificate'] = certificates
     sshpubkey = module.params.get('sshpubkey')
     if sshpubkey:
-        data['ipasshpubkey'] = unicode(sshpubkey)
+        data['ipasshpubkey'] = [unicode(sshpubkey)]
     ipaddress = module.params.get('ipaddress')
     if ipaddress:
         data['ip_address'] = unicode(ipaddress)
@@ -174,6 +299,44 @@ def get_module_host(module):
     return data
 
 
+def project_host(module, api, fqdn, entry):
+    """
+    Reduces the host entry to the attributes in return_attributes.
+
+    The entry is only read again with host_show if it does not contain all
+    of the attributes.
+
+    :param module: the ansible module
+    :param api: IPA api handle
+    :param fqdn: the fully-qualified hostname
+    :param entry: the host entry returned by the last command
+    :returns: the host entry for the module result
+    """
+    return_attributes = module.params.get('return_attributes')
+    if return_attributes is None:
+        return entry
+    if any(attr not in entry for attr in return_attributes):
+        entry = api.Command.host_show(fqdn, all=True,
+                                      no_members=True)['result']
+    return dict((attr, entry[attr]) for attr in return_attributes
+                if attr in entry)
+
+
+def result_host(module, api, fqdn, entry):
+    """
+    Returns the host entry for the module result after a change.
+
+    :param module: the ansible module
+    :param api: IPA api handle
+    :param fqdn: the fully-qualified hostname
+    :param entry: the host entry returned by the last command
+    :returns: the host entry for the module result
+    """
+    if module.params.get('return_attributes') is None:
+        return api.Command.host_show(fqdn)['result']
+    return project_host(module, api, fqdn, entry)
+
+
 def ensure_host_present(module, api, ipahost):
     """
     Ensures that the host exists in IPA and has the same attributes.
@@ -188,14 +351,17 @@ def ensure_host_present(module, api, ipahost):
         # Host already present, need to compare the attributes
         module_host = get_module_host(module)
         diffs = get_host_diff(ipahost, module_host)
+        certs_add, certs_remove = get_cert_delta(
+            ipahost, module.params.get('certificates'))
 
-        if not diffs:
+        if not diffs and not certs_add and not certs_remove:
             # Same attributes, success
-            module.exit_json(changed=False, host=ipahost)
+            module.exit_json(changed=False, server=get_server(api),
+                             host=project_host(module, api, fqdn, ipahost))
 
         # Need to modify the host - only if not in check_mode
         if module.check_mode:
-            module.exit_json(changed=True)
+            module.exit_json(changed=True, server=get_server(api))
 
         # If we want to create a random password, and the host
         # already has Keytab: true, then we need first to run
@@ -203,19 +369,27 @@ def ensure_host_present(module, api, ipahost):
         if module.params.get('random') and ipahost['has_keytab'] == True:
             api.Command.host_disable(fqdn)
 
-        result = api.Command.host_mod(fqdn, **diffs)
+        # Only the changed certificates are sent and written to LDAP
+        if certs_remove:
+            result = api.Command.host_remove_cert(
+                fqdn, usercertificate=certs_remove)
+        if certs_add:
+            result = api.Command.host_add_cert(
+                fqdn, usercertificate=certs_add)
+        if diffs:
+            result = api.Command.host_mod(fqdn, **diffs)
         # Save random password as it is not displayed by host-show
         if module.params.get('random'):
             randompassword = result['result']['randompassword']
-        result = api.Command.host_show(fqdn)
+        host = result_host(module, api, fqdn, result['result'])
         if module.params.get('random'):
-            result['result']['randompassword'] = randompassword
-        module.exit_json(changed=True, host=result['result'])
+            host['randompassword'] = randompassword
+        module.exit_json(changed=True, server=get_server(api), host=host)
 
     if not ipahost:
         # Need to add the user, only if not in check_mode
         if module.check_mode:
-            module.exit_json(changed=True)
+            module.exit_json(changed=True, server=get_server(api))
 
         # Must add the user
         module_host = get_module_host(module)
@@ -223,10 +397,62 @@ def ensure_host_present(module, api, ipahost):
         # Save random password as it is not displayed by host-show
         if module.params.get('random'):
             randompassword = result['result']['randompassword']
-        result = api.Command.host_show(fqdn)
+        host = result_host(module, api, fqdn, result['result'])
         if module.params.get('random'):
-            result['result']['randompassword'] = randompassword
-        module.exit_json(changed=True, host=result['result'])
+            host['randompassword'] = randompassword
+        module.exit_json(changed=True, server=get_server(api), host=host)
+
+
+def batch(api, methods):
+    """
+    Execute the methods with a single batch call.
+
+    :param api: the IPA API handle
+    :param methods: list of (command, args, options) tuples
+    :returns: the list of results, failed methods have error set
+    """
+    batch_args = [dict(method=unicode(command), params=[args, options])
+                  for command, args, options in methods]
+    return api.Command.batch(batch_args)['results']
+
+
+def ensure_hosts_random(module, api, fqdns):
+    """
+    Ensures that the hosts exist in IPA and generates random passwords for
+    them. All hosts are looked up in a single batch call and added or
+    modified in a second one.
+
+    :param module: the ansible module
+    :param api: the IPA API handle
+    :param fqdns: the fully-qualified hostnames
+    """
+    if not fqdns:
+        module.exit_json(changed=False, server=get_server(api), hosts=dict())
+
+    methods = []
+    for fqdn, show in zip(fqdns, batch(api, [("host_show", [fqdn], dict())
+                                             for fqdn in fqdns])):
+        if show.get('error'):
+            methods.append(("host_add", [fqdn], dict(random=True)))
+        else:
+            # Remove the keytab, a password can not be set otherwise
+            if show['result'].get('has_keytab'):
+                methods.append(("host_disable", [fqdn], dict()))
+            methods.append(("host_mod", [fqdn], dict(random=True)))
+
+    if module.check_mode:
+        module.exit_json(changed=True, server=get_server(api))
+
+    hosts = dict()
+    for (command, args, options), result in zip(methods, batch(api, methods)):
+        fqdn = args[0]
+        if result.get('error'):
+            hosts.setdefault(fqdn, dict(error=result['error']))
+        elif command != "host_disable" and fqdn not in hosts:
+            hosts[fqdn] = dict(
+                randompassword=result['result']['randompassword'])
+
+    module.exit_json(changed=True, server=get_server(api), hosts=hosts)
 
 
 def ensure_host_absent(module, api, host):
@@ -240,19 +466,20 @@ def ensure_host_absent(module, api, host):
     """
     if not host:
         # Nothing to do, host already removed
-        module.exit_json(changed=False)
+        module.exit_json(changed=False, server=get_server(api))
 
     # Need to remove the host - only if not in check_mode
+    fqdn = unicode(module.params.get('fqdn'))
     if module.check_mode:
-        module.exit_json(changed=True, host=host)
+        module.exit_json(changed=True, server=get_server(api),
+                         host=project_host(module, api, fqdn, host))
 
-    fqdn = unicode(module.params.get('fqdn'))
     try:
         api.Command.host_del(fqdn)
     except Exception as e:
         module.fail_json(msg="Failed to remove host: %s" % e)
 
-    module.exit_json(changed=True)
+    module.exit_json(changed=True, server=get_server(api))
 
 
 def main():
@@ -265,15 +492,20 @@ def main():
             principal = dict(default='admin'),
             #password = dict(required=False, no_log=True),
             ccache = dict(required=False, type='path'),
-            fqdn = dict(required=True),
+            fqdn = dict(required=False),
+            hosts = dict(required=False, type='list'),
             certificates = dict(required=False, type='list'),
             sshpubkey= dict(required=False),
             ipaddress = dict(required=False),
             random = dict(default=False, type='bool'),
             state = dict(default='present', choices=[ 'present', 'absent' ]),
+            session_reuse = dict(default=False, type='bool'),
+            return_attributes = dict(required=False, type='list'),
         ),
         #mutually_exclusive=[['password','keytab']],
         #required_one_of=[['[password','keytab']],
+        mutually_exclusive=[['fqdn', 'hosts']],
+        required_one_of=[['fqdn', 'hosts']],
         supports_check_mode=True,
     )
 
@@ -282,7 +514,16 @@ def main():
     keytab = module.params.get('keytab')
     ccache = module.params.get('ccache')
     fqdn = unicode(module.params.get('fqdn'))
+    hosts = module.params.get('hosts')
     state = module.params.get('state')
+    session_reuse = module.params.get('session_reuse')
+    return_attributes = module.params.get('return_attributes')
+    session_principal = None
+
+    if hosts is not None and \
+       (state != 'present' or not module.params.get('random')):
+        module.fail_json(msg="hosts can only be used with random and state "
+                         "present")
 
     try:
         os.environ['KRB5CCNAME']=ccache
@@ -296,11 +537,23 @@ def main():
         )
         api.bootstrap(**cfg)
         api.finalize()
+        if session_reuse:
+            from ipalib.krb_utils import get_principal
+            session_principal = get_principal()
+            load_session_cookie(session_principal, get_server(api))
         api.Backend.rpcclient.connect()
 
+        if hosts is not None:
+            ensure_hosts_random(module, api,
+                                [unicode(host) for host in hosts])
+
         changed = False
         try:
-            result = api.Command.host_show(fqdn, all=True)
+            if return_attributes is None:
+                result = api.Command.host_show(fqdn, all=True)
+            else:
+                # The default attributes contain all attributes of the diff
+                result = api.Command.host_show(fqdn, no_members=True)
             host = result['result']
         except errors.NotFound:
             host = None
@@ -313,9 +566,12 @@ def main():
     except Exception as e:
         module.fail_json(msg="ipahost module failed : %s" % str(e))
     finally:
+        # exit_json is also ending up here
+        if session_principal is not None:
+            save_session_cookie(session_principal, get_server(api))
         run(["kdestroy"], raiseonerr=False, env=os.environ)
 
-    module.exit_json(changed=changed, host=host)
+    module.exit_json(changed=changed, server=get_server(api), host=host)
 
 if __name__ == '__main__':
-    main()
+    profiled(main)
@@ -0,0 +1,251 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Authors:
+#   Thomas Woerner <twoerner@redhat.com>
+#
+# Copyright (C) 2017  Red Hat
+# see file 'COPYING' for use and warranty information
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+ANSIBLE_METADATA = {'metadata_version': '1.0',
+                    'status': ['preview'],
+                    'supported_by': 'community'}
+
+DOCUMENTATION = '''
+---
+module: ipahostgroup
+short description: Manage the host members of IPA hostgroups
+description:
+  Manage the host members of many IPA hostgroups at once.
+  The members of all hostgroups are read with a single batch call, the
+  hosts to add and to remove are computed from it and applied with a second
+  batch call. Missing hostgroups are added.
+  The operation is authenticated like ipahost, with a password or a keytab
+  of a principal allowed to manage hostgroups.
+options:
+  principal:
+    description: Kerberos principal used to manage the hostgroups
+    required: true
+    default: admin
+  password:
+    description: Password for the kerberos principal
+    required: false
+  keytab:
+    description: Keytab file containing the Kerberos principal and encrypted key
+    required: false
+  lifetime:
+    description: Sets the default lifetime for initial ticket requests
+    required: false
+    default: 1h
+  realm:
+    description: The Kerberos realm, read from the IPA server if not set together with domain
+    required: false
+  domain:
+    description: The DNS domain, read from the IPA server if not set together with realm
+    required: false
+  execution:
+    description: Run the operations with the module on the IPA server (remote) or directly from the controller with the JSON-RPC interface of the server (controller)
+    required: false
+    default: remote
+    choices: [ "remote", "controller" ]
+  ca_cert:
+    description: The IPA CA certificate on the controller to verify the server with execution controller, the system CA store is used by default
+    required: false
+  max_inflight:
+    description: The maximum number of concurrent operations on the IPA server, additional operations are queued on the controller
+    required: false
+  rate:
+    description: The maximum number of operations started per second on the IPA server, only used with max_inflight
+    required: false
+  admission_server:
+    description: The IPA server the slot is acquired for, the host the task is delegated to by default.
+    required: false
+  admission_timeout:
+    description: The maximum time in seconds to wait for a slot, 0 is unlimited.
+    required: false
+    default: 0
+  members:
+    description: The fully-qualified hostnames of the hosts per hostgroup.
+    required: true
+    type: dict
+  state:
+    description: present adds the hosts to the hostgroups, absent removes them from the hostgroups and exact also removes all other hosts from the hostgroups.
+    required: false
+    default: present
+    choices: [ "present", "absent", "exact" ]
+  session_reuse:
+    description: Reuse the IPA session cookie of the principal for the server from earlier runs, see ipahost.
+    required: false
+    default: no
+    type: bool
+
+author:
+    - Thomas Woerner
+'''
+
+EXAMPLES = '''
+# Add hosts to hostgroups, authenticate using principal/password
+- ipahostgroup:
+    principal: admin
+    password: MySecretPassword
+    members:
+      webservers:
+      - web1.ipa.domain.com
+      - web2.ipa.domain.com
+      databases:
+      - db1.ipa.domain.com
+  run_once: true
+
+# Set the hosts of a hostgroup from the controller
+- ipahostgroup:
+    keytab: admin.keytab
+    execution: controller
+    members:
+      webservers: "{{ groups.webservers }}"
+    state: exact
+'''
+
+RETURN = '''
+added:
+  description: The hosts that have been added per hostgroup.
+  returned: always
+  type: dict
+removed:
+  description: The hosts that have been removed per hostgroup.
+  returned: always
+  type: dict
+failed:
+  description: The errors per hostgroup, for hostgroups that could not be read and for hosts that could not be added or removed as "host: reason".
+  returned: always
+  type: dict
+server:
+  description: The IPA server the changes have been sent to.
+  returned: always
+  type: string
+'''
+
+import os
+from six.moves.urllib.parse import urlparse
+
+from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.ansible_ipa_client import load_session_cookie, \
+    save_session_cookie, current_membership, plan_membership, \
+    apply_membership, profiled
+
+from ipalib import api
+from ipaplatform.paths import paths
+from ipapython.ipautil import run
+
+
+def get_server(api):
+    """
+    Return the name of the IPA server the API is connected to.
+    """
+    return urlparse(api.env.xmlrpc_uri).hostname
+
+
+def batch(api, methods):
+    """
+    Execute the methods with a single batch call.
+
+    :param api: the IPA API handle
+    :param methods: list of (command, args, options) tuples
+    :returns: the list of results, failed methods have error set
+    """
+    batch_args = [dict(method=unicode(command), params=[args, options])
+                  for command, args, options in methods]
+    return api.Command.batch(batch_args)['results']
+
+
+def main():
+    """
+    Main routine for the ansible module.
+    """
+    module = AnsibleModule(
+        argument_spec=dict(
+            principal = dict(default='admin'),
+            ccache = dict(required=False, type='path'),
+            members = dict(required=True, type='dict'),
+            state = dict(default='present',
+                         choices=[ 'present', 'absent', 'exact' ]),
+            session_reuse = dict(default=False, type='bool'),
+        ),
+        supports_check_mode=True,
+    )
+
+    ccache = module.params.get('ccache')
+    members = dict((unicode(group).lower(),
+                    [unicode(host) for host in hosts or []])
+                   for group, hosts in module.params.get('members').items())
+    state = module.params.get('state')
+    session_reuse = module.params.get('session_reuse')
+    session_principal = None
+
+    try:
+        os.environ['KRB5CCNAME']=ccache
+
+        cfg = dict(
+            context='ansible_module',
+            confdir=paths.ETC_IPA,
+            in_server=False,
+            debug=False,
+            verbose=0,
+        )
+        api.bootstrap(**cfg)
+        api.finalize()
+        if session_reuse:
+            from ipalib.krb_utils import get_principal
+            session_principal = get_principal()
+            load_session_cookie(session_principal, get_server(api))
+        api.Backend.rpcclient.connect()
+
+        # The members of all hostgroups with a single call
+        groups = sorted(members)
+        current, read_failed = current_membership(
+            groups, batch(api, [("hostgroup_show", [group], dict())
+                                for group in groups]))
+
+        methods, added, removed = plan_membership(current, members, state)
+        if not methods:
+            module.exit_json(changed=False, server=get_server(api),
+                             added=dict(), removed=dict(),
+                             failed=read_failed)
+        if module.check_mode:
+            module.exit_json(changed=True, server=get_server(api),
+                             added=added, removed=removed,
+                             failed=read_failed)
+
+        failed = apply_membership(methods, added, removed,
+                                  batch(api, methods))
+        failed.update(read_failed)
+
+    except Exception as e:
+        module.fail_json(msg="ipahostgroup module failed : %s" % str(e))
+    finally:
+        # exit_json is also ending up here
+        if session_principal is not None:
+            save_session_cookie(session_principal, get_server(api))
+        run(["kdestroy"], raiseonerr=False, env=os.environ)
+
+    created = [args[0] for command, args, options in methods
+               if command == "hostgroup_add" and args[0] not in failed]
+    module.exit_json(changed=len(added) > 0 or len(removed) > 0 or
+                     len(created) > 0,
+                     server=get_server(api), added=added, removed=removed,
+                     failed=failed)
+
+if __name__ == '__main__':
+    profiled(main)
@@ -75,6 +75,19 @@ options:
   debug:
     description: Enable debug mode.
     required: false
+  max_inflight:
+    description: The maximum number of concurrent operations on admission_server, the module execution is queued on the controller until a slot is free. The slot is released when the module is done. Not limited if not set.
+    required: false
+  rate:
+    description: The maximum number of operations started per second on admission_server, only used with max_inflight.
+    required: false
+  admission_server:
+    description: The IPA server the slot is acquired for, required with max_inflight.
+    required: false
+  admission_timeout:
+    description: The maximum time in seconds to wait for a slot, 0 is unlimited.
+    required: false
+    default: 0
 author:
     - Thomas Woerner
 '''
@@ -112,78 +125,18 @@ already_joined:
   description: The flag describes if the host is arelady joined.
   returned: always
   type: bool
+plan:
+  description: The changes that would be done, computed from the local state without contacting the IPA server. Dict with the lists files, certs (SHA-256 fingerprints), services and rpcs.
+  returned: in check mode
+  type: dict
 '''
 
-class Object(object):
-    pass
-options = Object()
-
-import os
-import sys
-import gssapi
-import tempfile
-import inspect
-
 from ansible.module_utils.basic import AnsibleModule
 from ipapython.version import NUM_VERSION, VERSION
 if NUM_VERSION < 40400:
     raise Exception, "freeipa version '%s' is too old" % VERSION
-from ipalib import errors
-from ipapython.dn import DN
-from ipaplatform.paths import paths
-try:
-    from ipalib.install import sysrestore
-except ImportError:
-    from ipapython import sysrestore
-try:
-    from ipalib.install.kinit import kinit_keytab, kinit_password
-except ImportError:
-    from ipapython.ipautil import kinit_keytab, kinit_password
-try:
-    from ipaclient.install.client import configure_krb5_conf, get_ca_certs, SECURE_PATH
-except ImportError:
-    # Create temporary copy of ipa-client-install script (as
-    # ipa_client_install.py) to be able to import the script easily and also
-    # to remove the global finally clause in which the generated ccache file
-    # gets removed. The ccache file will be needed in the next step.
-    # This is done in a temporary directory that gets removed right after
-    # ipa_client_install has been imported.
-    import shutil
-    temp_dir = tempfile.mkdtemp(dir="/tmp")
-    sys.path.append(temp_dir)
-    temp_file = "%s/ipa_client_install.py" % temp_dir
-
-    with open("/usr/sbin/ipa-client-install", "r") as f_in:
-        with open(temp_file, "w") as f_out:
-            for line in f_in:
-                if line.startswith("finally:"):
-                    break
-                f_out.write(line)
-    import ipa_client_install
-
-    shutil.rmtree(temp_dir, ignore_errors=True)
-    sys.path.remove(temp_dir)
-
-    argspec = inspect.getargspec(ipa_client_install.configure_krb5_conf)
-    if argspec.keywords is None:
-        def configure_krb5_conf(
-                cli_realm, cli_domain, cli_server, cli_kdc, dnsok,
-                filename, client_domain, client_hostname, force,
-                configure_sssd):
-            global options
-            options.force = force
-            options.sssd = configure_sssd
-            return ipa_client_install.configure_krb5_conf(
-                cli_realm, cli_domain, cli_server, cli_kdc, dnsok, options,
-                filename, client_domain, client_hostname)
-    else:
-        configure_krb5_conf = ipa_client_install.configure_krb5_conf
-    if NUM_VERSION < 40100:
-        get_ca_cert = ipa_client_install.get_ca_cert
-    else:
-        get_ca_certs = ipa_client_install.get_ca_certs
-    SECURE_PATH = ("/bin:/sbin:/usr/kerberos/bin:/usr/kerberos/sbin:/usr/bin:/usr/sbin")
-from ipapython.ipautil import realm_to_suffix, run
+from ansible.module_utils.ansible_ipa_client import join_ipa, \
+    plan_join, plan_changed, profiled
 
 
 import logging
@@ -228,153 +181,19 @@ def main():
        keytab is not None and keytab != "":
         module.fail_json(msg="Password and keytab cannot be used together")
 
-    client_domain = hostname[hostname.find(".")+1:]
-    nolog = tuple()
-    env = {'PATH': SECURE_PATH}
-    fstore = sysrestore.FileStore(paths.IPA_CLIENT_SYSRESTORE)
-    host_principal = 'host/%s@%s' % (hostname, realm)
-    sssd = True
-
-    options.ca_cert_file = ca_cert_file
-    options.unattended = True
-    options.principal = principal if principal != "" else None
-    options.force = False
-    options.password = password
-
-    ccache_dir = None
-    changed = False
-    already_joined = False
-    try:
-        (krb_fd, krb_name) = tempfile.mkstemp()
-        os.close(krb_fd)
-        configure_krb5_conf(
-            cli_realm=realm,
-            cli_domain=domain,
-            cli_server=servers,
-            cli_kdc=kdc,
-            dnsok=False,
-            filename=krb_name,
-            client_domain=client_domain,
-            client_hostname=hostname,
-            configure_sssd=sssd,
-            force=False)
-        env['KRB5_CONFIG'] = krb_name
-        ccache_dir = tempfile.mkdtemp(prefix='krbcc')
-        ccache_name = os.path.join(ccache_dir, 'ccache')
-        join_args = [paths.SBIN_IPA_JOIN,
-                     "-s", servers[0],
-                     "-b", str(realm_to_suffix(realm)),
-                     "-h", hostname]
-        if debug:
-            join_args.append("-d")
-            env['XMLRPC_TRACE_CURL'] = 'yes'
-        if force_join:
-            join_args.append("-f")
-        if principal:
-            if principal.find('@') == -1:
-                principal = '%s@%s' % (principal, realm)
-            try:
-                kinit_password(principal, password, ccache_name,
-                               config=krb_name)
-            except RuntimeError as e:
-                module.fail_json(
-                    msg="Kerberos authentication failed: {}".format(e))
-        elif keytab:
-            join_args.append("-f")
-            if os.path.exists(keytab):
-                try:
-                    kinit_keytab(host_principal,
-                                 keytab,
-                                 ccache_name,
-                                 config=krb_name,
-                                 attempts=kinit_attempts)
-                except gssapi.exceptions.GSSError as e:
-                    module.fail_json(
-                        msg="Kerberos authentication failed: {}".format(e))
-            else:
-                module.fail_json(
-                    msg="Keytab file could not be found: {}".format(keytab))
-
-        elif password:
-            join_args.append("-w")
-            join_args.append(password)
-            nolog = (password,)
-
-        env['KRB5CCNAME'] = os.environ['KRB5CCNAME'] = ccache_name
-        # Get the CA certificate
-        try:
-            os.environ['KRB5_CONFIG'] = env['KRB5_CONFIG']
-            if NUM_VERSION < 40100:
-                get_ca_cert(fstore, options, servers[0], basedn)
-            else:
-                get_ca_certs(fstore, options, servers[0], basedn, realm)
-            del os.environ['KRB5_CONFIG']
-        except errors.FileError as e:
-            module.fail_json(msg='%s' % e)
-        except Exception as e:
-            module.fail_json(msg="Cannot obtain CA certificate\n%s" % e)
-
-        # Now join the domain
-        result = run(
-            join_args, raiseonerr=False, env=env, nolog=nolog,
-            capture_error=True)
-        stderr = result.error_output
-
-        if result.returncode != 0:
-            if result.returncode == 13:
-                already_joined = True
-                module.log("Host is already joined")
-            else:
-                if principal:
-                    run(["kdestroy"], raiseonerr=False, env=env)
-                module.fail_json(msg="Joining realm failed: %s" % stderr)
-        else:
-            changed = True
-            module.log("Enrolled in IPA realm %s" % realm)
-
-        start = stderr.find('Certificate subject base is: ')
-        if start >= 0:
-            start = start + 29
-            subject_base = stderr[start:]
-            subject_base = subject_base.strip()
-            subject_base = DN(subject_base)
-
-        if principal:
-            run(["kdestroy"], raiseonerr=False, env=env)
-
-        # Obtain the TGT. We do it with the temporary krb5.conf, so that
-        # only the KDC we're installing under is contacted.
-        # Other KDCs might not have replicated the principal yet.
-        # Once we have the TGT, it's usable on any server.
-        try:
-            kinit_keytab(host_principal, paths.KRB5_KEYTAB,
-                         paths.IPA_DNS_CCACHE,
-                         config=krb_name,
-                         attempts=kinit_attempts)
-            env['KRB5CCNAME'] = os.environ['KRB5CCNAME'] = paths.IPA_DNS_CCACHE
-        except gssapi.exceptions.GSSError as e:
-            # failure to get ticket makes it impossible to login and bind
-            # from sssd to LDAP, abort installation and rollback changes
-            module.fail_json(msg="Failed to obtain host TGT: %s" % e)
+    if module.check_mode:
+        plan, krb5_keytab_ok = plan_join(module, servers, realm, hostname,
+                                         force_join)
+        module.exit_json(changed=plan_changed(plan),
+                         already_joined=krb5_keytab_ok and not force_join,
+                         plan=plan)
 
-    finally:
-        try:
-            os.remove(krb_name)
-        except OSError:
-            module.fail_json(msg="Could not remove %s" % krb_name)
-        if ccache_dir is not None:
-            try:
-                os.rmdir(ccache_dir)
-            except OSError:
-                pass
-        if os.path.exists(krb_name + ".ipabkp"):
-            try:
-                os.remove(krb_name + ".ipabkp")
-            except OSError:
-                module.fail_json(msg="Could not remove %s.ipabkp" % krb_name)
+    changed, already_joined = join_ipa(
+        module, servers, domain, realm, hostname, kdc, basedn, principal,
+        password, keytab, ca_cert_file, force_join, kinit_attempts, debug)
 
     module.exit_json(changed=changed,
                      already_joined=already_joined)
 
 if __name__ == '__main__':
-    main()
+    profiled(main)
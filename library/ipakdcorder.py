@@ -0,0 +1,131 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Authors:
+#   Thomas Woerner <twoerner@redhat.com>
+#
+# Copyright (C) 2017  Red Hat
+# see file 'COPYING' for use and warranty information
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+ANSIBLE_METADATA = {
+    'metadata_version': '1.0',
+    'supported_by': 'community',
+    'status': ['preview'],
+}
+
+DOCUMENTATION = '''
+---
+module: ipakdcorder
+short description: Order KDCs by the measured latency
+description:
+  Order the KDCs by the latency of a TCP connection to the KDC port,
+  measured from the managed node. The median of several attempts is used.
+  Unreachable KDCs are moved to the end of the list, keeping their order.
+options:
+  servers:
+    description: The FQDN of the KDCs.
+    required: true
+  port:
+    description: The KDC port.
+    required: false
+    default: 88
+  attempts:
+    description: The number of connections per KDC.
+    required: false
+    default: 3
+  timeout:
+    description: The connection timeout in seconds.
+    required: false
+    default: 2
+author:
+    - Thomas Woerner
+'''
+
+EXAMPLES = '''
+- name: Order the KDCs by latency
+  ipakdcorder:
+    servers: "{{ ipadiscovery.servers }}"
+  register: ipakdcorder
+'''
+
+RETURN = '''
+servers:
+  description: The KDCs ordered by latency.
+  returned: always
+  type: list
+latency:
+  description: The median connection time in seconds per KDC, null for unreachable KDCs.
+  returned: always
+  type: dict
+'''
+
+import time
+import socket
+
+from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.ansible_ipa_client import profiled
+
+
+def measure(server, port, attempts, timeout):
+    """
+    Return the median TCP connect time to server:port or None if the server
+    could not be reached.
+    """
+    times = []
+    for i in range(attempts):
+        start = time.time()
+        try:
+            sock = socket.create_connection((server, port), timeout)
+        except (socket.error, socket.timeout):
+            continue
+        times.append(time.time() - start)
+        sock.close()
+    if not times:
+        return None
+    times.sort()
+    return times[len(times) // 2]
+
+
+def main():
+    module = AnsibleModule(
+        argument_spec = dict(
+            servers=dict(required=True, type='list'),
+            port=dict(required=False, type='int', default=88),
+            attempts=dict(required=False, type='int', default=3),
+            timeout=dict(required=False, type='float', default=2),
+        ),
+        supports_check_mode = True,
+    )
+
+    servers = module.params.get('servers')
+    port = module.params.get('port')
+    attempts = module.params.get('attempts')
+    timeout = module.params.get('timeout')
+
+    latency = dict()
+    for server in servers:
+        latency[server] = measure(server, port, attempts, timeout)
+
+    # sorted is stable, unreachable servers keep their order at the end
+    ordered = sorted(servers, key=lambda s: (latency[s] is None,
+                                             latency[s] or 0))
+
+    module.exit_json(changed=False, servers=ordered,
+                     latency=dict((s, round(l, 4) if l is not None else None)
+                                  for s, l in latency.items()))
+
+if __name__ == '__main__':
+    profiled(main)
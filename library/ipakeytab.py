@@ -0,0 +1,244 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Authors:
+#   Thomas Woerner <twoerner@redhat.com>
+#
+# Copyright (C) 2017  Red Hat
+# see file 'COPYING' for use and warranty information
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+ANSIBLE_METADATA = {
+    'metadata_version': '1.0',
+    'supported_by': 'community',
+    'status': ['preview'],
+}
+
+DOCUMENTATION = '''
+---
+module: ipakeytab
+short description: Rotate the host keytab of an enrolled IPA client
+description:
+  Rotate the keys of the host principal of an enrolled IPA client without
+  a new enrollment. The host authenticates with its current keytab, gets new
+  keys with ipa-getkeytab into a copy of the keytab, verifies the new keys
+  with a kinit and moves the copy over the host keytab atomically. All
+  steps use the same IPA server and KDC, so that they do not need to wait
+  for replication. The keys with the old key version stay in the keytab
+  for tickets that are still in use. As the keys on the server have been
+  replaced by ipa-getkeytab, the new keytab is also installed if the
+  verification fails, the module fails then.
+options:
+  servers:
+    description: The FQDN of the IPA servers.
+    required: true
+  domain:
+    description: The primary DNS domain of an existing IPA deployment.
+    required: true
+  realm:
+    description: The Kerberos realm of an existing IPA deployment.
+    required: true
+  hostname:
+    description: The hostname of the machine (FQDN).
+    required: true
+  server:
+    description: The IPA server to use. By default the server is selected from servers.
+    required: false
+  enctypes:
+    description: The encryption types of the new keys. The server defaults are used if not set.
+    required: false
+  kinit_attempts:
+    description: Repeat the request for host Kerberos ticket X times.
+    required: false
+    default: 5
+  max_inflight:
+    description: The maximum number of concurrent rotations on admission_server, the module execution is queued on the controller until a slot is free. The slot is released when the module is done. Not limited if not set.
+    required: false
+  rate:
+    description: The maximum number of rotations started per second on admission_server, only used with max_inflight.
+    required: false
+  admission_server:
+    description: The IPA server the slot is acquired for, required with max_inflight.
+    required: false
+  admission_timeout:
+    description: The maximum time in seconds to wait for a slot, 0 is unlimited.
+    required: false
+    default: 0
+author:
+    - Thomas Woerner
+'''
+
+EXAMPLES = '''
+- name: Rotate the host keytab
+  ipakeytab:
+    servers: "{{ ipadiscovery.servers }}"
+    domain: "{{ ipadiscovery.domain }}"
+    realm: "{{ ipadiscovery.realm }}"
+    hostname: "{{ ipadiscovery.hostname }}"
+  register: ipakeytab
+'''
+
+RETURN = '''
+server:
+  description: The IPA server that has been used.
+  returned: always
+  type: string
+kvno_old:
+  description: The key version of the host principal before the rotation.
+  returned: always
+  type: int
+kvno_new:
+  description: The key version of the host principal after the rotation.
+  returned: if not in check mode
+  type: int
+'''
+
+import os
+import shutil
+import tempfile
+
+from ansible.module_utils.basic import AnsibleModule
+from ipapython.version import NUM_VERSION, VERSION
+if NUM_VERSION < 40400:
+    raise Exception, "freeipa version '%s' is too old" % VERSION
+from ansible.module_utils.ansible_ipa_client import temp_krb5_conf, \
+    remove_temp_krb5_conf, read_keytab, kinit_functions, select_server, \
+    profiled
+
+
+def host_kvno(filename, host_principal):
+    """
+    Return the highest key version of the host principal in the keytab or
+    None.
+    """
+    entries = read_keytab(filename)
+    if entries is None:
+        return None
+    kvnos = [kvno for (principal, kvno, enctype) in entries
+             if principal == host_principal]
+    return max(kvnos) if kvnos else None
+
+
+def main():
+    module = AnsibleModule(
+        argument_spec = dict(
+            servers=dict(required=True, type='list'),
+            domain=dict(required=True),
+            realm=dict(required=True),
+            hostname=dict(required=True),
+            server=dict(required=False),
+            enctypes=dict(required=False, type='list'),
+            kinit_attempts=dict(required=False, type='int', default=5),
+        ),
+        supports_check_mode = True,
+    )
+
+    module._ansible_debug = True
+    servers = module.params.get('servers')
+    domain = module.params.get('domain')
+    realm = module.params.get('realm')
+    hostname = module.params.get('hostname')
+    server = module.params.get('server')
+    enctypes = module.params.get('enctypes')
+    kinit_attempts = module.params.get('kinit_attempts')
+
+    import gssapi
+    from ipaplatform.paths import paths
+    kinit_keytab, kinit_password = kinit_functions()
+
+    if server is None:
+        server = select_server(servers, hostname)
+    host_principal = 'host/%s@%s' % (hostname, realm)
+
+    kvno_old = host_kvno(paths.KRB5_KEYTAB, host_principal)
+    if kvno_old is None:
+        module.fail_json(msg="%s is not in %s, the host is not enrolled" %
+                         (host_principal, paths.KRB5_KEYTAB))
+
+    if module.check_mode:
+        module.exit_json(changed=True, server=server, kvno_old=kvno_old)
+
+    krb_name = temp_krb5_conf(module, [server], domain, realm, hostname,
+                              server)
+    temp_dir = tempfile.mkdtemp(prefix='ipakeytab')
+    # The new keytab is created next to the host keytab, so that it can be
+    # renamed atomically
+    fd, new_keytab = tempfile.mkstemp(
+        dir=os.path.dirname(paths.KRB5_KEYTAB), prefix='.krb5.keytab.')
+    os.close(fd)
+    try:
+        ccache_name = os.path.join(temp_dir, 'ccache')
+        try:
+            kinit_keytab(host_principal, paths.KRB5_KEYTAB, ccache_name,
+                         config=krb_name, attempts=kinit_attempts)
+        except gssapi.exceptions.GSSError as e:
+            module.fail_json(msg="kinit with the current keytab failed: %s" %
+                             e)
+
+        # Keep the old keys in the new keytab
+        shutil.copyfile(paths.KRB5_KEYTAB, new_keytab)
+        args = [paths.IPA_GETKEYTAB, "-s", server, "-p", host_principal,
+                "-k", new_keytab]
+        if enctypes:
+            args.extend(["-e", ",".join(enctypes)])
+        retcode, stdout, stderr = module.run_command(
+            args, environ_update=dict(KRB5_CONFIG=krb_name,
+                                      KRB5CCNAME=ccache_name))
+        if retcode != 0:
+            module.fail_json(msg="ipa-getkeytab failed: %s" % stderr.strip())
+
+        # The keys have been replaced on the server, the new keytab is
+        # installed also if the verification fails, the old keys do not
+        # work anymore.
+        error = None
+        kvno_new = host_kvno(new_keytab, host_principal)
+        if kvno_new is None or kvno_new == kvno_old:
+            error = "No new keys for %s in the new keytab" % host_principal
+        else:
+            # Verify the new keys with the KDC of the server that created
+            # them
+            try:
+                kinit_keytab(host_principal, new_keytab,
+                             os.path.join(temp_dir, 'verify'),
+                             config=krb_name, attempts=kinit_attempts)
+            except gssapi.exceptions.GSSError as e:
+                error = "kinit with the new keytab failed: %s" % e
+
+        # Keeps mode, owner and SELinux context of the host keytab
+        module.atomic_move(new_keytab, paths.KRB5_KEYTAB)
+
+        # The host TGT has been obtained with the old keys
+        try:
+            os.remove(paths.IPA_DNS_CCACHE)
+        except OSError:
+            pass
+
+        if error is not None:
+            module.fail_json(msg="%s, the keytab from ipa-getkeytab has "
+                             "been installed as %s" %
+                             (error, paths.KRB5_KEYTAB),
+                             changed=True, server=server, kvno_old=kvno_old,
+                             kvno_new=kvno_new)
+    finally:
+        if os.path.exists(new_keytab):
+            os.remove(new_keytab)
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        remove_temp_krb5_conf(module, krb_name)
+
+    module.exit_json(changed=True, server=server, kvno_old=kvno_old,
+                     kvno_new=kvno_new)
+
+if __name__ == '__main__':
+    profiled(main)
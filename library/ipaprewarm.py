@@ -0,0 +1,191 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Authors:
+#   Thomas Woerner <twoerner@redhat.com>
+#
+# Copyright (C) 2017  Red Hat
+# see file 'COPYING' for use and warranty information
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+ANSIBLE_METADATA = {
+    'metadata_version': '1.0',
+    'supported_by': 'community',
+    'status': ['preview'],
+}
+
+DOCUMENTATION = '''
+---
+module: ipaprewarm
+short description: Prewarm the SSSD cache
+description:
+  Prewarm the SSSD cache after SSSD has been configured and restarted, so
+  that the first logins and sudo checks do not have to wait for the IPA
+  server. Users are looked up with id (user and initgroups), groups and
+  netgroups with getent and the sudo rules with sudo -l. The lookups are
+  done in parallel with a bounded number of workers.
+options:
+  users:
+    description: The users to look up.
+    required: false
+    default: []
+  groups:
+    description: The groups to look up.
+    required: false
+    default: []
+  netgroups:
+    description: The netgroups to look up.
+    required: false
+    default: []
+  sudo_users:
+    description: The users for which the sudo rules are looked up.
+    required: false
+    default: []
+  concurrency:
+    description: The maximum number of lookups at the same time.
+    required: false
+    default: 4
+  timeout:
+    description: The maximum time in seconds for a single lookup.
+    required: false
+    default: 30
+author:
+    - Thomas Woerner
+'''
+
+EXAMPLES = '''
+- name: Prewarm the SSSD cache
+  ipaprewarm:
+    users: ["admin", "jdoe"]
+    groups: ["admins", "developers"]
+    sudo_users: ["jdoe"]
+    concurrency: 8
+  register: ipaprewarm
+'''
+
+RETURN = '''
+warmed:
+  description: The number of entries that have been warmed per type (users, groups, netgroups, sudo_users).
+  returned: always
+  type: dict
+failed:
+  description: The entries that could not be looked up, as "type name".
+  returned: always
+  type: list
+elapsed:
+  description: The time in seconds needed for all lookups.
+  returned: always
+  type: float
+'''
+
+import time
+import threading
+
+from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.six.moves import queue
+from ansible.module_utils.ansible_ipa_client import run_command_deadline, \
+    profiled
+
+LOOKUPS = dict(
+    users=lambda name: ["id", name],
+    groups=lambda name: ["getent", "group", name],
+    netgroups=lambda name: ["getent", "netgroup", name],
+    sudo_users=lambda name: ["sudo", "-n", "-l", "-U", name],
+)
+
+
+def lookup(args, timeout):
+    """
+    Run the lookup and return True if it succeeded within timeout.
+    """
+    result = run_command_deadline(args, time.time() + timeout, capture=False)
+    return result is not None and result[0] == 0
+
+
+def prewarm(entries, concurrency, timeout):
+    """
+    Do the lookups with concurrency worker threads.
+
+    :param entries: list of tuples (type, name)
+    :returns: tuple (warmed, failed)
+    """
+    work = queue.Queue()
+    for entry in entries:
+        work.put(entry)
+    lock = threading.Lock()
+    warmed = dict((kind, 0) for kind in LOOKUPS)
+    failed = []
+
+    def worker():
+        while True:
+            try:
+                kind, name = work.get_nowait()
+            except queue.Empty:
+                return
+            ok = lookup(LOOKUPS[kind](name), timeout)
+            with lock:
+                if ok:
+                    warmed[kind] += 1
+                else:
+                    failed.append("%s %s" % (kind, name))
+
+    threads = [threading.Thread(target=worker)
+               for i in range(min(concurrency, len(entries)))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return (warmed, failed)
+
+
+def main():
+    module = AnsibleModule(
+        argument_spec = dict(
+            users=dict(required=False, type='list', default=[]),
+            groups=dict(required=False, type='list', default=[]),
+            netgroups=dict(required=False, type='list', default=[]),
+            sudo_users=dict(required=False, type='list', default=[]),
+            concurrency=dict(required=False, type='int', default=4),
+            timeout=dict(required=False, type='int', default=30),
+        ),
+        supports_check_mode = True,
+    )
+
+    module._ansible_debug = True
+    concurrency = module.params.get('concurrency')
+    timeout = module.params.get('timeout')
+
+    if concurrency < 1:
+        module.fail_json(msg="concurrency needs to be at least 1")
+
+    entries = []
+    for kind in sorted(LOOKUPS):
+        for name in module.params.get(kind):
+            entries.append((kind, name))
+
+    if module.check_mode:
+        module.exit_json(changed=False,
+                         warmed=dict((kind, 0) for kind in LOOKUPS),
+                         failed=[], elapsed=0.0)
+
+    start = time.time()
+    warmed, failed = prewarm(entries, concurrency, timeout)
+
+    # Only the SSSD cache is filled, the configuration is not changed
+    module.exit_json(changed=False, warmed=warmed, failed=sorted(failed),
+                     elapsed=round(time.time() - start, 3))
+
+if __name__ == '__main__':
+    profiled(main)
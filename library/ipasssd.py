@@ -71,6 +71,11 @@ options:
   all_ip_addresses:
     description: All routable IP addresses configured on any interface will be added to DNS.
     required: false
+  performance_profile:
+    description: The SSSD performance profile. "default" keeps the SSSD defaults, "large_directory" uses long cache timeouts, big LDAP pages, bigger memory caches and no group member lists, "high_churn" uses short cache timeouts to see changes quickly, "login_heavy" caches initgroups and PAM lookups. Options not supported by the installed SSSD are skipped.
+    required: false
+    default: default
+    choices: ["default", "large_directory", "high_churn", "login_heavy"]
 author:
     - Thomas Woerner
 '''
@@ -88,58 +93,19 @@ EXAMPLES = '''
 '''
 
 RETURN = '''
+performance_profile:
+  description: The options of the performance profile that have been set, per section (domain, nss, pam).
+  returned: always
+  type: dict
+plan:
+  description: The changes that would be done, computed from the local state without contacting the IPA server. Dict with the lists files, certs (SHA-256 fingerprints), services and rpcs.
+  returned: in check mode
+  type: dict
 '''
 
-import os
-import sys
-import tempfile
-import SSSDConfig
-
 from ansible.module_utils.basic import AnsibleModule
-try:
-    from ipalib.install import sysrestore
-except ImportError:
-    from ipapython import sysrestore
-from ipaplatform.paths import paths
-from ipapython.ipautil import file_exists
-try:
-    from ipaclient.install.client import get_server_connection_interface, \
-        configure_nsswitch_database
-except ImportError:
-    # Create temporary copy of ipa-client-install script (as
-    # ipa_client_install.py) to be able to import the script easily and also
-    # to remove the global finally clause in which the generated ccache file
-    # gets removed. The ccache file will be needed in the next step.
-    # This is done in a temporary directory that gets removed right after
-    # ipa_client_install has been imported.
-    import shutil
-    temp_dir = tempfile.mkdtemp(dir="/tmp")
-    sys.path.append(temp_dir)
-    temp_file = "%s/ipa_client_install.py" % temp_dir
-
-    with open("/usr/sbin/ipa-client-install", "r") as f_in:
-        with open(temp_file, "w") as f_out:
-            for line in f_in:
-                if line.startswith("finally:"):
-                    break
-                f_out.write(line)
-    import ipa_client_install
-
-    shutil.rmtree(temp_dir, ignore_errors=True)
-    sys.path.remove(temp_dir)
-
-    get_server_connection_interface = ipa_client_install.get_server_connection_interface
-    configure_nsswitch_database = ipa_client_install.configure_nsswitch_database
-
-def sssd_enable_service(module, sssdconfig, service):
-    try:
-        sssdconfig.new_service(service)
-    except SSSDConfig.ServiceAlreadyExists:
-        pass
-    except SSSDConfig.ServiceNotRecognizedError:
-        module.fail_json(
-            msg="Unable to activate the %s service in SSSD config." % service)
-    sssdconfig.activate_service(service)
+from ansible.module_utils.ansible_ipa_client import configure_sssd, \
+    plan_changed, SSSD_PERFORMANCE_PROFILES, profiled
 
 def main():
     module = AnsibleModule(
@@ -156,6 +122,9 @@ def main():
             permit=dict(required=False, type='bool'),
             dns_updates=dict(required=False, type='bool'),
             all_ip_addresses=dict(required=False, type='bool'),
+            performance_profile=dict(
+                required=False, default='default',
+                choices=sorted(SSSD_PERFORMANCE_PROFILES)),
         ),
         supports_check_mode = True,
     )
@@ -173,126 +142,24 @@ def main():
     permit = module.params.get('permit')
     dns_updates = module.params.get('dns_updates')
     all_ip_addresses = module.params.get('all_ip_addresses')
+    performance_profile = module.params.get('performance_profile')
 
-    fstore = sysrestore.FileStore(paths.IPA_CLIENT_SYSRESTORE)
-    client_domain = client_hostname[client_hostname.find(".")+1:]
-
-    try:
-        sssdconfig = SSSDConfig.SSSDConfig()
-        sssdconfig.import_config()
-    except Exception as e:
-        if os.path.exists(paths.SSSD_CONF) and preserve_sssd:
-            # SSSD config is in place but we are unable to read it
-            # In addition, we are instructed to preserve it
-            # This all means we can't use it and have to bail out
-            module.fail_json(
-                msg="SSSD config exists but cannot be parsed: %s" % str(e))
-
-        # SSSD configuration does not exist or we are not asked to preserve it,
-        # create new one
-        # We do make new SSSDConfig instance because IPAChangeConf-derived
-        # classes have no means to reset their state and ParseError exception
-        # could come due to parsing error from older version which cannot be
-        # upgraded anymore, leaving sssdconfig instance practically unusable
-        # Note that we already backed up sssd.conf before going into this
-        # routine
-        if isinstance(e, IOError):
-            pass
-        else:
-            # It was not IOError so it must have been parsing error
-            module.fail_json(msg="Unable to parse existing SSSD config.")
-
-        module.log("New SSSD config will be created")
-        sssdconfig = SSSDConfig.SSSDConfig()
-        sssdconfig.new_config()
-
-    try:
-        domain = sssdconfig.new_domain(cli_domain)
-    except SSSDConfig.DomainAlreadyExistsError:
-        module.log("Domain %s is already configured in existing SSSD "
-                   "config, creating a new one." % cli_domain)
-        sssdconfig = SSSDConfig.SSSDConfig()
-        sssdconfig.new_config()
-        domain = sssdconfig.new_domain(cli_domain)
-
-    if on_master:
-        sssd_enable_service(module, sssdconfig, 'ifp')
-
-    if (("ssh" in services and file_exists(paths.SSH_CONFIG)) or
-        ("sshd" in services and file_exists(paths.SSHD_CONFIG))):
-        sssd_enable_service(module, sssdconfig, 'ssh')
-
-    if "sudo" in services:
-        sssd_enable_service(module, sssdconfig, 'sudo')
-        configure_nsswitch_database(fstore, 'sudoers', ['sss'],
-                                    default_value=['files'])
-
-    domain.add_provider('ipa', 'id')
-
-    # add discovery domain if client domain different from server domain
-    # do not set this config in server mode (#3947)
-    if not on_master and cli_domain != client_domain:
-        domain.set_option('dns_discovery_domain', cli_domain)
-
-    if not on_master:
-        if primary:
-            domain.set_option('ipa_server', ', '.join(cli_servers))
-        else:
-            domain.set_option('ipa_server',
-                              '_srv_, %s' % ', '.join(cli_servers))
-    else:
-        domain.set_option('ipa_server_mode', 'True')
-        # the master should only use itself for Kerberos
-        domain.set_option('ipa_server', cli_servers[0])
-
-        # increase memcache timeout to 10 minutes when in server mode
-        try:
-            nss_service = sssdconfig.get_service('nss')
-        except SSSDConfig.NoServiceError:
-            nss_service = sssdconfig.new_service('nss')
-
-        nss_service.set_option('memcache_timeout', 600)
-        sssdconfig.save_service(nss_service)
-
-    domain.set_option('ipa_domain', cli_domain)
-    domain.set_option('ipa_hostname', client_hostname)
-    if cli_domain.lower() != cli_realm.lower():
-        domain.set_option('krb5_realm', cli_realm)
-
-    # Might need this if /bin/hostname doesn't return a FQDN
-    # domain.set_option('ipa_hostname', 'client.example.com')
-
-    domain.add_provider('ipa', 'auth')
-    domain.add_provider('ipa', 'chpass')
-    if not permit:
-        domain.add_provider('ipa', 'access')
-    else:
-        domain.add_provider('permit', 'access')
-
-    domain.set_option('cache_credentials', True)
-
-    # SSSD will need TLS for checking if ipaMigrationEnabled attribute is set
-    # Note that SSSD will force StartTLS because the channel is later used for
-    # authentication as well if password migration is enabled. Thus set
-    # the option unconditionally.
-    domain.set_option('ldap_tls_cacert', paths.IPA_CA_CRT)
-
-    if dns_updates:
-        domain.set_option('dyndns_update', True)
-        if all_ip_addresses:
-            domain.set_option('dyndns_iface', '*')
-        else:
-            iface = get_server_connection_interface(cli_servers[0])
-            domain.set_option('dyndns_iface', iface)
-    if krb5_offline_passwords:
-        domain.set_option('krb5_store_password_if_offline', True)
-
-    domain.set_active(True)
+    if module.check_mode:
+        applied, plan = configure_sssd(
+            module, cli_servers, cli_domain, cli_realm, client_hostname,
+            services, krb5_offline_passwords, on_master, primary,
+            preserve_sssd, permit, dns_updates, all_ip_addresses,
+            dry_run=True, performance_profile=performance_profile)
+        module.exit_json(changed=plan_changed(plan),
+                         performance_profile=applied, plan=plan)
 
-    sssdconfig.save_domain(domain)
-    sssdconfig.write(paths.SSSD_CONF)
+    applied, plan = configure_sssd(
+        module, cli_servers, cli_domain, cli_realm, client_hostname,
+        services, krb5_offline_passwords, on_master, primary, preserve_sssd,
+        permit, dns_updates, all_ip_addresses,
+        performance_profile=performance_profile)
 
-    module.exit_json(changed=True)
+    module.exit_json(changed=True, performance_profile=applied)
 
 if __name__ == '__main__':
-    main()
+    profiled(main)
@@ -34,6 +34,8 @@ module: ipatest
 short description: Test if the krb5.keytab on the machine is valid and can be used.
 description:
   Test if the krb5.keytab on the machine is valid and can be used.
+  The keytab is checked locally first, the KDC is only contacted if the
+  host principal is in the keytab and there is no valid host TGT.
   A temporary krb5.conf file will be generated to not fail on an invalid one.
 options:
   servers:
@@ -58,6 +60,10 @@ options:
     description: Repeat the request for host Kerberos ticket X times.
     required: false
     default: 5
+  verify_kdc:
+    description: Verify the keytab with a kinit against the KDC if there is no valid host TGT. If disabled, a keytab containing the host principal is accepted without contacting the KDC.
+    required: false
+    default: yes
 author:
     - Thomas Woerner
 '''
@@ -90,67 +96,17 @@ krb5_keytab_ok:
   description: The flag describes if krb5.keytab on the host is usable.
   returned: always
   type: bool
+keytab_check:
+  description: The check that has been used for the result, one of "missing" (no keytab), "no_principal" (host principal not in the keytab), "ccache" (valid host TGT reused), "local" (host principal found in the keytab, verify_kdc disabled) or "kdc" (kinit with the keytab).
+  returned: always
+  type: string
 '''
 
-class Object(object):
-    pass
-options = Object()
-
-import os
-import sys
-import gssapi
-import tempfile
-import inspect
-
 from ansible.module_utils.basic import AnsibleModule
 from ipapython.version import NUM_VERSION, VERSION
 if NUM_VERSION < 40400:
     raise Exception, "freeipa version '%s' is too old" % VERSION
-from ipaplatform.paths import paths
-try:
-    from ipalib.install.kinit import kinit_keytab
-except ImportError:
-    from ipapython.ipautil import kinit_keytab
-try:
-    from ipaclient.install.client import configure_krb5_conf
-except ImportError:
-    # Create temporary copy of ipa-client-install script (as
-    # ipa_client_install.py) to be able to import the script easily and also
-    # to remove the global finally clause in which the generated ccache file
-    # gets removed. The ccache file will be needed in the next step.
-    # This is done in a temporary directory that gets removed right after
-    # ipa_client_install has been imported.
-    import shutil
-    temp_dir = tempfile.mkdtemp(dir="/tmp")
-    sys.path.append(temp_dir)
-    temp_file = "%s/ipa_client_install.py" % temp_dir
-
-    with open("/usr/sbin/ipa-client-install", "r") as f_in:
-        with open(temp_file, "w") as f_out:
-            for line in f_in:
-                if line.startswith("finally:"):
-                    break
-                f_out.write(line)
-    import ipa_client_install
-
-    shutil.rmtree(temp_dir, ignore_errors=True)
-    sys.path.remove(temp_dir)
-
-    argspec = inspect.getargspec(ipa_client_install.configure_krb5_conf)
-    if argspec.keywords is None:
-        def configure_krb5_conf(
-                cli_realm, cli_domain, cli_server, cli_kdc, dnsok,
-                filename, client_domain, client_hostname, force,
-                configure_sssd):
-            global options
-            options.force = force
-            options.sssd = configure_sssd
-            return ipa_client_install.configure_krb5_conf(
-                cli_realm, cli_domain, cli_server, cli_kdc, dnsok, options,
-                filename, client_domain, client_hostname)
-    else:
-        configure_krb5_conf = ipa_client_install.configure_krb5_conf
-from ipapython.ipautil import realm_to_suffix, run
+from ansible.module_utils.ansible_ipa_client import check_keytab, profiled
 
 
 import logging
@@ -166,6 +122,7 @@ def main():
             kdc=dict(required=True),
             principal=dict(required=False),
             kinit_attempts=dict(required=False, type='int', default=5),
+            verify_kdc=dict(required=False, type='bool', default=True),
         ),
         supports_check_mode = True,
     )
@@ -178,48 +135,14 @@ def main():
     kdc = module.params.get('kdc')
     principal = module.params.get('principal')
     kinit_attempts = module.params.get('kinit_attempts')
+    verify_kdc = module.params.get('verify_kdc')
 
-    client_domain = hostname[hostname.find(".")+1:]
-    host_principal = 'host/%s@%s' % (hostname, realm)
-    sssd = True
-
-    krb5_keytab_ok = True
-    try:
-        (krb_fd, krb_name) = tempfile.mkstemp()
-        os.close(krb_fd)
-        configure_krb5_conf(
-            cli_realm=realm,
-            cli_domain=domain,
-            cli_server=servers,
-            cli_kdc=kdc,
-            dnsok=False,
-            filename=krb_name,
-            client_domain=client_domain,
-            client_hostname=hostname,
-            configure_sssd=sssd,
-            force=False)
-
-        # Obtain the TGT. We do it with the temporary krb5.conf, so that
-        # only the KDC we're installing under is contacted.
-        # Other KDCs might not have replicated the principal yet.
-        # Once we have the TGT, it's usable on any server.
-        try:
-            kinit_keytab(host_principal, paths.KRB5_KEYTAB,
-                         paths.IPA_DNS_CCACHE,
-                         config=krb_name,
-                         attempts=kinit_attempts)
-        except gssapi.exceptions.GSSError as e:
-            # failure to get ticket makes it impossible to login and bind
-            # from sssd to LDAP, abort installation and rollback changes
-            krb5_keytab_ok = False
-
-    finally:
-        try:
-            os.remove(krb_name)
-        except OSError:
-            module.fail_json(msg="Could not remove %s" % krb_name)
+    krb5_keytab_ok, keytab_check = check_keytab(
+        module, servers, domain, realm, hostname, kdc, kinit_attempts,
+        verify_kdc=verify_kdc)
 
-    module.exit_json(changed=False, krb5_keytab_ok=krb5_keytab_ok)
+    module.exit_json(changed=False, krb5_keytab_ok=krb5_keytab_ok,
+                     keytab_check=keytab_check)
 
 if __name__ == '__main__':
-    main()
+    profiled(main)
@@ -0,0 +1,1987 @@
+# -*- coding: utf-8 -*-
+
+# Authors:
+#   Thomas Woerner <twoerner@redhat.com>
+#
+# Based on ipa-client-install code
+#
+# Copyright (C) 2017  Red Hat
+# see file 'COPYING' for use and warranty information
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import sys
+import shutil
+import hashlib
+import tempfile
+import inspect
+from six import text_type
+from six.moves.configparser import RawConfigParser
+from six.moves.urllib.parse import urlparse
+
+# Only light weight imports are allowed at module level. ipalib, gssapi,
+# ipaplatform and the client installer are imported on demand by the
+# functions below, so that modules ending early do not pay for them.
+
+SECURE_PATH = ("/bin:/sbin:/usr/kerberos/bin:/usr/kerberos/sbin:/usr/bin:"
+               "/usr/sbin")
+
+IPA_CLIENT_INSTALL = "/usr/sbin/ipa-client-install"
+
+
+class Object(object):
+    pass
+
+
+def rendezvous_order(servers, hostname):
+    """
+    Order the servers for the client with rendezvous (highest random weight)
+    hashing.
+
+    Every client gets a stable order that only depends on its hostname and
+    the set of servers, the clients are spread evenly over the servers. If a
+    server is added or removed, only the clients of this server are moved.
+    """
+    def weight(server):
+        return hashlib.sha256(
+            ("%s\0%s" % (server.lower(), hostname.lower())).encode("utf-8")
+        ).hexdigest()
+    return sorted(servers, key=weight, reverse=True)
+
+
+def select_server(servers, hostname):
+    """
+    Select the server the client should use for the enrollment.
+    """
+    return rendezvous_order(servers, hostname)[0]
+
+
+_client_install = None
+
+
+def client_install():
+    """
+    Return the ipa-client-install implementation.
+
+    For FreeIPA >= 4.5 this is ipaclient.install.client. For older versions
+    a temporary copy of the ipa-client-install script (as
+    ipa_client_install.py) is created to be able to import the script easily
+    and also to remove the global finally clause in which the generated ccache
+    file gets removed. The ccache file will be needed in the next step.
+    This is done in a temporary directory that gets removed right after
+    ipa_client_install has been imported.
+
+    The result is cached, the import is done only once per module run.
+    """
+    global _client_install
+
+    if _client_install is not None:
+        return _client_install
+
+    try:
+        from ipaclient.install import client
+    except ImportError:
+        temp_dir = tempfile.mkdtemp(dir="/tmp")
+        sys.path.append(temp_dir)
+        temp_file = "%s/ipa_client_install.py" % temp_dir
+
+        with open(IPA_CLIENT_INSTALL, "r") as f_in:
+            with open(temp_file, "w") as f_out:
+                for line in f_in:
+                    if line.startswith("finally:"):
+                        break
+                    f_out.write(line)
+        import ipa_client_install as client
+
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        sys.path.remove(temp_dir)
+
+    _client_install = client
+    return client
+
+
+def configure_krb5_conf(cli_realm, cli_domain, cli_server, cli_kdc, dnsok,
+                        filename, client_domain, client_hostname, force,
+                        configure_sssd):
+    """
+    Call configure_krb5_conf of ipa-client-install.
+
+    Older versions of ipa-client-install are expecting an options object
+    instead of the force and configure_sssd keyword arguments.
+    """
+    client = client_install()
+
+    argspec = inspect.getargspec(client.configure_krb5_conf)
+    if argspec.keywords is None and "options" in argspec.args:
+        options = Object()
+        options.force = force
+        options.sssd = configure_sssd
+        return client.configure_krb5_conf(
+            cli_realm, cli_domain, cli_server, cli_kdc, dnsok, options,
+            filename, client_domain, client_hostname)
+
+    return client.configure_krb5_conf(
+        cli_realm=cli_realm,
+        cli_domain=cli_domain,
+        cli_server=cli_server,
+        cli_kdc=cli_kdc,
+        dnsok=dnsok,
+        filename=filename,
+        client_domain=client_domain,
+        client_hostname=client_hostname,
+        configure_sssd=configure_sssd,
+        force=force)
+
+
+def kinit_functions():
+    """
+    Return the kinit_keytab and kinit_password functions.
+
+    :returns: tuple (kinit_keytab, kinit_password)
+    """
+    try:
+        from ipalib.install.kinit import kinit_keytab, kinit_password
+    except ImportError:
+        from ipapython.ipautil import kinit_keytab, kinit_password
+    return (kinit_keytab, kinit_password)
+
+
+def sysrestore():
+    """
+    Return the sysrestore module.
+
+    :returns: ipalib.install.sysrestore for FreeIPA >= 4.5, else
+              ipapython.sysrestore
+    """
+    try:
+        from ipalib.install import sysrestore
+    except ImportError:
+        from ipapython import sysrestore
+    return sysrestore
+
+
+def is_file_backed_up(sysrestore_dir, path):
+    """
+    Check if the file has already been backed up in the sysrestore directory.
+
+    This reads the sysrestore.index file directly instead of creating a
+    sysrestore.FileStore, which would import ipalib.
+
+    :param sysrestore_dir: the sysrestore directory
+    :param path: the path of the file
+    :returns: boolean
+    """
+    parser = RawConfigParser()
+    parser.optionxform = str
+    if not parser.read(os.path.join(sysrestore_dir, "sysrestore.index")):
+        return False
+    if not parser.has_section("files"):
+        return False
+    for (key, value) in parser.items("files"):
+        # value is "mode,uid,gid,path"
+        if value.split(',', 3)[-1] == path:
+            return True
+    return False
+
+
+def temp_krb5_conf(module, servers, domain, realm, hostname, kdc):
+    """
+    Create a temporary krb5.conf that is only using the given servers.
+
+    :returns: the name of the temporary krb5.conf file
+    """
+    client_domain = hostname[hostname.find(".")+1:]
+
+    (krb_fd, krb_name) = tempfile.mkstemp()
+    os.close(krb_fd)
+    configure_krb5_conf(
+        cli_realm=realm,
+        cli_domain=domain,
+        cli_server=servers,
+        cli_kdc=kdc,
+        dnsok=False,
+        filename=krb_name,
+        client_domain=client_domain,
+        client_hostname=hostname,
+        configure_sssd=True,
+        force=False)
+    return krb_name
+
+
+def remove_temp_krb5_conf(module, krb_name):
+    """
+    Remove the temporary krb5.conf and the backup created for it.
+    """
+    try:
+        os.remove(krb_name)
+    except OSError:
+        module.fail_json(msg="Could not remove %s" % krb_name)
+    if os.path.exists(krb_name + ".ipabkp"):
+        try:
+            os.remove(krb_name + ".ipabkp")
+        except OSError:
+            module.fail_json(msg="Could not remove %s.ipabkp" % krb_name)
+
+
+def has_valid_host_tgt(host_principal, ccache, keytab):
+    """
+    Check if the ccache contains a valid TGT for the host principal that has
+    been obtained after the last change of the keytab.
+
+    :returns: boolean
+    """
+    import gssapi
+
+    try:
+        if os.path.getmtime(ccache) < os.path.getmtime(keytab):
+            return False
+        creds = gssapi.Credentials(usage='initiate',
+                                   store={'ccache': ccache})
+        return str(creds.name) == host_principal and creds.lifetime > 0
+    except (OSError, gssapi.exceptions.GSSError):
+        return False
+
+
+def check_keytab(module, servers, domain, realm, hostname, kdc,
+                 kinit_attempts, krb_name=None, verify_kdc=True):
+    """
+    Test if the krb5.keytab on the machine is valid and can be used.
+
+    The keytab is parsed locally first, if the host principal is not in the
+    keytab, the KDC is not contacted. If there is a valid host TGT in
+    paths.IPA_DNS_CCACHE that is newer than the keytab, it is reused.
+    Otherwise, and only if verify_kdc is set, a kinit is done with the
+    keytab. On success the host TGT is stored in paths.IPA_DNS_CCACHE.
+
+    :param krb_name: temporary krb5.conf to use, a new one is created and
+                     removed again if not given
+    :param verify_kdc: verify the keytab with a kinit if there is no valid
+                       host TGT
+    :returns: tuple (krb5_keytab_ok, keytab_check), keytab_check is one of
+              "missing", "no_principal", "ccache", "local" or "kdc" and
+              describes the check that has been used for the result
+    """
+    from ipaplatform.paths import paths
+
+    # Without a keytab there is nothing to test, return before gssapi,
+    # ipalib and ipa-client-install are imported.
+    if not os.path.exists(paths.KRB5_KEYTAB):
+        return (False, "missing")
+
+    host_principal = 'host/%s@%s' % (hostname, realm)
+
+    # Keytabs that can not be parsed are verified with kinit
+    entries = read_keytab(paths.KRB5_KEYTAB)
+    if entries is not None:
+        if host_principal not in [entry[0] for entry in entries]:
+            return (False, "no_principal")
+
+    if has_valid_host_tgt(host_principal, paths.IPA_DNS_CCACHE,
+                          paths.KRB5_KEYTAB):
+        return (True, "ccache")
+
+    if not verify_kdc and entries is not None:
+        return (True, "local")
+
+    import gssapi
+    kinit_keytab, kinit_password = kinit_functions()
+
+    temp_krb_name = None
+
+    krb5_keytab_ok = True
+    try:
+        if krb_name is None:
+            krb_name = temp_krb_name = temp_krb5_conf(
+                module, servers, domain, realm, hostname, kdc)
+
+        # Obtain the TGT. We do it with the temporary krb5.conf, so that
+        # only the KDC we're installing under is contacted.
+        # Other KDCs might not have replicated the principal yet.
+        # Once we have the TGT, it's usable on any server.
+        try:
+            kinit_keytab(host_principal, paths.KRB5_KEYTAB,
+                         paths.IPA_DNS_CCACHE,
+                         config=krb_name,
+                         attempts=kinit_attempts)
+        except gssapi.exceptions.GSSError as e:
+            # failure to get ticket makes it impossible to login and bind
+            # from sssd to LDAP, abort installation and rollback changes
+            krb5_keytab_ok = False
+
+    finally:
+        if temp_krb_name is not None:
+            remove_temp_krb5_conf(module, temp_krb_name)
+
+    return (krb5_keytab_ok, "kdc")
+
+
+def join_ipa(module, servers, domain, realm, hostname, kdc, basedn,
+             principal, password, keytab, ca_cert_file, force_join,
+             kinit_attempts, debug, krb_name=None):
+    """
+    Join the machine to the IPA realm and get a keytab for the host service
+    principal.
+
+    On success the host TGT is stored in paths.IPA_DNS_CCACHE.
+
+    :param krb_name: temporary krb5.conf to use, a new one is created and
+                     removed again if not given
+    :returns: tuple (changed, already_joined)
+    """
+    import gssapi
+    from ipalib import errors
+    from ipaplatform.paths import paths
+    from ipapython.version import NUM_VERSION
+    from ipapython.dn import DN
+    from ipapython.ipautil import realm_to_suffix, run
+    kinit_keytab, kinit_password = kinit_functions()
+    client = client_install()
+
+    nolog = tuple()
+    env = {'PATH': SECURE_PATH}
+    fstore = sysrestore().FileStore(paths.IPA_CLIENT_SYSRESTORE)
+    host_principal = 'host/%s@%s' % (hostname, realm)
+
+    options = Object()
+    options.ca_cert_file = ca_cert_file
+    options.unattended = True
+    options.principal = principal if principal != "" else None
+    options.force = False
+    options.password = password
+
+    server = select_server(servers, hostname)
+    temp_krb_name = None
+    ccache_dir = None
+    changed = False
+    already_joined = False
+    try:
+        if krb_name is None:
+            krb_name = temp_krb_name = temp_krb5_conf(
+                module, servers, domain, realm, hostname, kdc)
+        env['KRB5_CONFIG'] = krb_name
+        ccache_dir = tempfile.mkdtemp(prefix='krbcc')
+        ccache_name = os.path.join(ccache_dir, 'ccache')
+        join_args = [paths.SBIN_IPA_JOIN,
+                     "-s", server,
+                     "-b", str(realm_to_suffix(realm)),
+                     "-h", hostname]
+        if debug:
+            join_args.append("-d")
+            env['XMLRPC_TRACE_CURL'] = 'yes'
+        if force_join:
+            join_args.append("-f")
+        if principal:
+            if principal.find('@') == -1:
+                principal = '%s@%s' % (principal, realm)
+            try:
+                kinit_password(principal, password, ccache_name,
+                               config=krb_name)
+            except RuntimeError as e:
+                module.fail_json(
+                    msg="Kerberos authentication failed: {}".format(e))
+        elif keytab:
+            join_args.append("-f")
+            if os.path.exists(keytab):
+                try:
+                    kinit_keytab(host_principal,
+                                 keytab,
+                                 ccache_name,
+                                 config=krb_name,
+                                 attempts=kinit_attempts)
+                except gssapi.exceptions.GSSError as e:
+                    module.fail_json(
+                        msg="Kerberos authentication failed: {}".format(e))
+            else:
+                module.fail_json(
+                    msg="Keytab file could not be found: {}".format(keytab))
+
+        elif password:
+            join_args.append("-w")
+            join_args.append(password)
+            nolog = (password,)
+
+        env['KRB5CCNAME'] = os.environ['KRB5CCNAME'] = ccache_name
+        # Get the CA certificate
+        try:
+            os.environ['KRB5_CONFIG'] = env['KRB5_CONFIG']
+            if NUM_VERSION < 40100:
+                client.get_ca_cert(fstore, options, server, basedn)
+            else:
+                client.get_ca_certs(fstore, options, server, basedn,
+                                    realm)
+            del os.environ['KRB5_CONFIG']
+        except errors.FileError as e:
+            module.fail_json(msg='%s' % e)
+        except Exception as e:
+            module.fail_json(msg="Cannot obtain CA certificate\n%s" % e)
+
+        # Now join the domain
+        result = run(
+            join_args, raiseonerr=False, env=env, nolog=nolog,
+            capture_error=True)
+        stderr = result.error_output
+
+        if result.returncode != 0:
+            if result.returncode == 13:
+                already_joined = True
+                module.log("Host is already joined")
+            else:
+                if principal:
+                    run(["kdestroy"], raiseonerr=False, env=env)
+                module.fail_json(msg="Joining realm failed: %s" % stderr)
+        else:
+            changed = True
+            module.log("Enrolled in IPA realm %s" % realm)
+
+        start = stderr.find('Certificate subject base is: ')
+        if start >= 0:
+            start = start + 29
+            subject_base = stderr[start:]
+            subject_base = subject_base.strip()
+            subject_base = DN(subject_base)
+
+        if principal:
+            run(["kdestroy"], raiseonerr=False, env=env)
+
+        # Obtain the TGT. We do it with the temporary krb5.conf, so that
+        # only the KDC we're installing under is contacted.
+        # Other KDCs might not have replicated the principal yet.
+        # Once we have the TGT, it's usable on any server.
+        try:
+            kinit_keytab(host_principal, paths.KRB5_KEYTAB,
+                         paths.IPA_DNS_CCACHE,
+                         config=krb_name,
+                         attempts=kinit_attempts)
+            env['KRB5CCNAME'] = os.environ['KRB5CCNAME'] = paths.IPA_DNS_CCACHE
+        except gssapi.exceptions.GSSError as e:
+            # failure to get ticket makes it impossible to login and bind
+            # from sssd to LDAP, abort installation and rollback changes
+            module.fail_json(msg="Failed to obtain host TGT: %s" % e)
+
+    finally:
+        if temp_krb_name is not None:
+            remove_temp_krb5_conf(module, temp_krb_name)
+        if ccache_dir is not None:
+            try:
+                os.rmdir(ccache_dir)
+            except OSError:
+                pass
+
+    return (changed, already_joined)
+
+
+# SSSD performance profiles
+#
+# The options are set in the IPA domain and in the nss and pam services.
+# Options that are not known by the installed SSSD version are skipped.
+# refresh_expired_interval is set to 75% of entry_cache_timeout, so that
+# entries are refreshed in the background before they expire.
+SSSD_PERFORMANCE_PROFILES = {
+    # SSSD defaults, nothing is set
+    "default": dict(),
+    # Many users, groups and sudo rules: long cache lifetime, big pages and
+    # no group member lists
+    "large_directory": dict(
+        domain=dict(
+            entry_cache_timeout=14400,
+            refresh_expired_interval=10800,
+            ldap_page_size=2000,
+            ignore_group_members=True,
+            ldap_sudo_smart_refresh_interval=3600,
+        ),
+        nss=dict(
+            memcache_timeout=600,
+            memcache_size_passwd=32,
+            memcache_size_group=32,
+            memcache_size_initgroups=32,
+        ),
+    ),
+    # Frequently changing users and groups: short cache lifetime, changes
+    # are visible quickly
+    "high_churn": dict(
+        domain=dict(
+            entry_cache_timeout=600,
+            refresh_expired_interval=450,
+            ldap_page_size=1000,
+            ldap_sudo_smart_refresh_interval=300,
+        ),
+        nss=dict(
+            memcache_timeout=60,
+        ),
+    ),
+    # Many logins: initgroups and the PAM responder are cached
+    "login_heavy": dict(
+        domain=dict(
+            entry_cache_timeout=7200,
+            refresh_expired_interval=5400,
+            ldap_page_size=1000,
+            ignore_group_members=True,
+        ),
+        nss=dict(
+            memcache_timeout=600,
+            memcache_size_initgroups=32,
+        ),
+        pam=dict(
+            pam_id_timeout=30,
+        ),
+    ),
+}
+
+
+def sssd_set_options(module, section, options):
+    """
+    Set the options in the section, which is a domain or service object.
+
+    :returns: dict of the options that have been set
+    """
+    import SSSDConfig
+
+    applied = dict()
+    for name in sorted(options):
+        try:
+            section.set_option(name, options[name])
+        except SSSDConfig.NoOptionError:
+            module.warn("SSSD option %s is not supported, skipped" % name)
+            continue
+        applied[name] = options[name]
+    return applied
+
+
+def sssd_enable_service(module, sssdconfig, service):
+    import SSSDConfig
+
+    try:
+        sssdconfig.new_service(service)
+    except SSSDConfig.ServiceAlreadyExists:
+        pass
+    except SSSDConfig.ServiceNotRecognizedError:
+        module.fail_json(
+            msg="Unable to activate the %s service in SSSD config." % service)
+    sssdconfig.activate_service(service)
+
+
+def configure_sssd(module, cli_servers, cli_domain, cli_realm,
+                   client_hostname, services, krb5_offline_passwords,
+                   on_master, primary, preserve_sssd, permit, dns_updates,
+                   all_ip_addresses, dry_run=False,
+                   performance_profile="default"):
+    """
+    Configure sssd for the IPA domain and write sssd.conf.
+
+    :param dry_run: only compare the new configuration with sssd.conf and
+                    nsswitch.conf, nothing is written
+    :param performance_profile: one of SSSD_PERFORMANCE_PROFILES
+    :returns: tuple (applied, plan), applied contains the options of the
+              performance profile that have been set per section, plan is
+              the plan of the changes for dry_run, else None
+    """
+    import SSSDConfig
+    from ipaplatform.paths import paths
+    from ipapython.ipautil import file_exists
+    client = client_install()
+    get_server_connection_interface = client.get_server_connection_interface
+    configure_nsswitch_database = client.configure_nsswitch_database
+
+    fstore = sysrestore().FileStore(paths.IPA_CLIENT_SYSRESTORE)
+    client_domain = client_hostname[client_hostname.find(".")+1:]
+    plan = new_plan()
+
+    try:
+        sssdconfig = SSSDConfig.SSSDConfig()
+        sssdconfig.import_config()
+    except Exception as e:
+        if os.path.exists(paths.SSSD_CONF) and preserve_sssd:
+            # SSSD config is in place but we are unable to read it
+            # In addition, we are instructed to preserve it
+            # This all means we can't use it and have to bail out
+            module.fail_json(
+                msg="SSSD config exists but cannot be parsed: %s" % str(e))
+
+        # SSSD configuration does not exist or we are not asked to preserve it,
+        # create new one
+        # We do make new SSSDConfig instance because IPAChangeConf-derived
+        # classes have no means to reset their state and ParseError exception
+        # could come due to parsing error from older version which cannot be
+        # upgraded anymore, leaving sssdconfig instance practically unusable
+        # Note that we already backed up sssd.conf before going into this
+        # routine
+        if isinstance(e, IOError):
+            pass
+        else:
+            # It was not IOError so it must have been parsing error
+            module.fail_json(msg="Unable to parse existing SSSD config.")
+
+        module.log("New SSSD config will be created")
+        sssdconfig = SSSDConfig.SSSDConfig()
+        sssdconfig.new_config()
+
+    try:
+        domain = sssdconfig.new_domain(cli_domain)
+    except SSSDConfig.DomainAlreadyExistsError:
+        module.log("Domain %s is already configured in existing SSSD "
+                   "config, creating a new one." % cli_domain)
+        sssdconfig = SSSDConfig.SSSDConfig()
+        sssdconfig.new_config()
+        domain = sssdconfig.new_domain(cli_domain)
+
+    if on_master:
+        sssd_enable_service(module, sssdconfig, 'ifp')
+
+    if (("ssh" in services and file_exists(paths.SSH_CONFIG)) or
+        ("sshd" in services and file_exists(paths.SSHD_CONFIG))):
+        sssd_enable_service(module, sssdconfig, 'ssh')
+
+    if "sudo" in services:
+        sssd_enable_service(module, sssdconfig, 'sudo')
+        if dry_run:
+            if 'sss' not in nsswitch_sources('sudoers'):
+                plan['files'].append(paths.NSSWITCH_CONF)
+        else:
+            configure_nsswitch_database(fstore, 'sudoers', ['sss'],
+                                        default_value=['files'])
+
+    domain.add_provider('ipa', 'id')
+
+    # add discovery domain if client domain different from server domain
+    # do not set this config in server mode (#3947)
+    if not on_master and cli_domain != client_domain:
+        domain.set_option('dns_discovery_domain', cli_domain)
+
+    if not on_master:
+        if primary:
+            domain.set_option('ipa_server', ', '.join(cli_servers))
+        else:
+            domain.set_option('ipa_server',
+                              '_srv_, %s' % ', '.join(cli_servers))
+    else:
+        domain.set_option('ipa_server_mode', 'True')
+        # the master should only use itself for Kerberos
+        domain.set_option('ipa_server', cli_servers[0])
+
+        # increase memcache timeout to 10 minutes when in server mode
+        try:
+            nss_service = sssdconfig.get_service('nss')
+        except SSSDConfig.NoServiceError:
+            nss_service = sssdconfig.new_service('nss')
+
+        nss_service.set_option('memcache_timeout', 600)
+        sssdconfig.save_service(nss_service)
+
+    domain.set_option('ipa_domain', cli_domain)
+    domain.set_option('ipa_hostname', client_hostname)
+    if cli_domain.lower() != cli_realm.lower():
+        domain.set_option('krb5_realm', cli_realm)
+
+    # Might need this if /bin/hostname doesn't return a FQDN
+    # domain.set_option('ipa_hostname', 'client.example.com')
+
+    domain.add_provider('ipa', 'auth')
+    domain.add_provider('ipa', 'chpass')
+    if not permit:
+        domain.add_provider('ipa', 'access')
+    else:
+        domain.add_provider('permit', 'access')
+
+    domain.set_option('cache_credentials', True)
+
+    # SSSD will need TLS for checking if ipaMigrationEnabled attribute is set
+    # Note that SSSD will force StartTLS because the channel is later used for
+    # authentication as well if password migration is enabled. Thus set
+    # the option unconditionally.
+    domain.set_option('ldap_tls_cacert', paths.IPA_CA_CRT)
+
+    if dns_updates:
+        domain.set_option('dyndns_update', True)
+        if all_ip_addresses:
+            domain.set_option('dyndns_iface', '*')
+        else:
+            iface = get_server_connection_interface(cli_servers[0])
+            domain.set_option('dyndns_iface', iface)
+    if krb5_offline_passwords:
+        domain.set_option('krb5_store_password_if_offline', True)
+
+    domain.set_active(True)
+
+    profile = SSSD_PERFORMANCE_PROFILES[performance_profile]
+    applied = dict()
+    if profile.get("domain"):
+        applied["domain"] = sssd_set_options(module, domain,
+                                             profile["domain"])
+    for service_name in ("nss", "pam"):
+        if not profile.get(service_name):
+            continue
+        try:
+            service = sssdconfig.get_service(service_name)
+        except SSSDConfig.NoServiceError:
+            service = sssdconfig.new_service(service_name)
+        applied[service_name] = sssd_set_options(
+            module, service, profile[service_name])
+        sssdconfig.save_service(service)
+
+    sssdconfig.save_domain(domain)
+    if dry_run:
+        try:
+            with open(paths.SSSD_CONF) as f:
+                current = f.read()
+        except (IOError, OSError):
+            current = None
+        if current != sssdconfig.dump(sssdconfig.opts):
+            plan['files'].append(paths.SSSD_CONF)
+        return (applied, plan)
+    sssdconfig.write(paths.SSSD_CONF)
+    return (applied, None)
+
+
+def api_enrollment(module, realm, hostname, debug, server=None,
+                   session_reuse=False):
+    """
+    Connect to the IPA API using the host TGT in paths.IPA_DNS_CCACHE and
+    check if the Certificate Authority is enabled. If it is not enabled, the
+    RA is disabled in the IPA configuration.
+
+    The CA certificates are read from paths.IPA_CA_CRT and added to a
+    temporary NSS database, that is used for the connection.
+
+    :param server: pin the API connection and the KDC to this server, for
+                   example the server that created the host entry, to not
+                   depend on replication
+    :param session_reuse: reuse the IPA session cookie from the session store
+                          instead of clearing the session data
+    :returns: boolean, whether the Certificate Authority is enabled
+    """
+    from ipaplatform.paths import paths
+
+    if server is None:
+        return _api_enrollment(module, realm, hostname, debug, None,
+                               session_reuse)
+
+    parser = RawConfigParser()
+    parser.read(paths.IPA_DEFAULT_CONF)
+    domain = parser.get('global', 'domain')
+    krb_name = temp_krb5_conf(module, [server], domain, realm, hostname,
+                              server)
+    old_config = os.environ.get('KRB5_CONFIG')
+    os.environ['KRB5_CONFIG'] = krb_name
+    try:
+        return _api_enrollment(module, realm, hostname, debug, server,
+                               session_reuse)
+    finally:
+        if old_config is not None:
+            os.environ['KRB5_CONFIG'] = old_config
+        else:
+            os.environ.pop('KRB5_CONFIG', None)
+        remove_temp_krb5_conf(module, krb_name)
+
+
+def _api_enrollment(module, realm, hostname, debug, server, session_reuse):
+    from ipaplatform.paths import paths
+    from ipapython.version import NUM_VERSION
+    if NUM_VERSION >= 40500 and NUM_VERSION < 40590:
+        from cryptography.hazmat.primitives import serialization
+    from ipalib import api, errors, x509
+    from ipalib.rpc import delete_persistent_client_session_data
+    from ipapython import certdb
+    from ipapython.ipautil import CalledProcessError, write_tmp_file, \
+        ipa_generate_password
+    disable_ra = client_install().disable_ra
+
+    fstore = sysrestore().FileStore(paths.IPA_CLIENT_SYSRESTORE)
+    statestore = sysrestore().StateFile(paths.IPA_CLIENT_SYSRESTORE)
+    host_principal = 'host/%s@%s' % (hostname, realm)
+    os.environ['KRB5CCNAME'] = paths.IPA_DNS_CCACHE
+    
+    ca_certs = x509.load_certificate_list_from_file(paths.IPA_CA_CRT)
+    if NUM_VERSION >= 40500 and NUM_VERSION < 40590:
+        ca_certs = [ cert.public_bytes(serialization.Encoding.DER)
+                     for cert in ca_certs ]
+    elif NUM_VERSION < 40500:
+        ca_certs = [ cert.der_data for cert in ca_certs ]
+
+    with certdb.NSSDatabase() as tmp_db:
+        cfg = dict(context='cli_installer',
+                   confdir=paths.ETC_IPA,
+                   debug=debug,
+                   delegate=False,
+                   nss_dir=tmp_db.secdir)
+        if server is not None:
+            cfg['server'] = server
+            cfg['xmlrpc_uri'] = 'https://%s/ipa/xml' % server
+        api.bootstrap(**cfg)
+
+        if 'config_loaded' not in api.env:
+            module.fail_json(msg="Failed to initialize IPA API.")
+
+        session_server = urlparse(api.env.xmlrpc_uri).hostname
+        if session_reuse:
+            load_session_cookie(host_principal, session_server)
+        else:
+            # Clear out any current session keyring information
+            try:
+                delete_persistent_client_session_data(host_principal)
+            except ValueError:
+                pass
+
+        # Add CA certs to a temporary NSS database
+        argspec = inspect.getargspec(tmp_db.create_db)
+        try:
+            if NUM_VERSION > 40400:
+                tmp_db.create_db()
+
+                for i, cert in enumerate(ca_certs):
+                    tmp_db.add_cert(cert,
+                                    'CA certificate %d' % (i + 1),
+                                    certdb.EXTERNAL_CA_TRUST_FLAGS)
+            else:
+                pwd_file = write_tmp_file(ipa_generate_password())
+                tmp_db.create_db(pwd_file.name)
+
+                for i, cert in enumerate(ca_certs):
+                    tmp_db.add_cert(cert, 'CA certificate %d' % (i + 1), 'C,,')
+        except CalledProcessError as e:
+            module.fail_json(msg="Failed to add CA to temporary NSS database.")
+
+        api.finalize()
+
+        # Now, let's try to connect to the server's RPC interface
+        connected = False
+        try:
+            api.Backend.rpcclient.connect()
+            connected = True
+            module.debug("Try RPC connection")
+            api.Backend.rpcclient.forward('ping')
+        except errors.KerberosError as e:
+            if connected:
+                api.Backend.rpcclient.disconnect()
+            module.log(
+                "Cannot connect to the server due to Kerberos error: %s. "
+                "Trying with delegate=True" % e)
+            try:
+                api.Backend.rpcclient.connect(delegate=True)
+                module.debug("Try RPC connection")
+                api.Backend.rpcclient.forward('ping')
+
+                module.log("Connection with delegate=True successful")
+
+                # The remote server is not capable of Kerberos S4U2Proxy
+                # delegation. This features is implemented in IPA server
+                # version 2.2 and higher
+                module.warn(
+                    "Target IPA server has a lower version than the enrolled "
+                    "client")
+                module.warn(
+                    "Some capabilities including the ipa command capability "
+                    "may not be available")
+            except errors.PublicError as e2:
+                module.fail_json(
+                    msg="Cannot connect to the IPA server RPC interface: %s" % e2)
+        except errors.PublicError as e:
+            module.fail_json(
+                msg="Cannot connect to the server due to generic error: %s" % e)
+    # Use the RPC directly so older servers are supported
+    try:
+        result = api.Backend.rpcclient.forward(
+            'ca_is_enabled',
+            version=u'2.107',
+        )
+        ca_enabled = result['result']
+    except (errors.CommandError, errors.NetworkError):
+        result = api.Backend.rpcclient.forward(
+            'env',
+            server=True,
+            version=u'2.0',
+        )
+        ca_enabled = result['result']['enable_ra']
+    if not ca_enabled:
+        disable_ra()
+
+    if session_reuse:
+        save_session_cookie(host_principal, session_server)
+
+    return ca_enabled
+
+
+def configure_nss(module, servers, domain, realm, hostname, basedn, principal,
+                  subject_base, ca_enabled, mkhomedir, on_master):
+    """
+    Create the IPA NSS database, add the CA certificates, configure
+    certmonger, SSH keys, nsswitch and the PAM stack and (re)start SSSD.
+    """
+    import time
+    from ipalib import api, errors, x509
+    try:
+        from ipalib.install import certstore
+    except ImportError:
+        from ipalib import certstore
+    from ipapython.dn import DN
+    from ipaplatform import services
+    from ipaplatform.paths import paths
+    from ipaplatform.tasks import tasks
+    from ipapython import certdb, ipautil
+    from ipapython.ipautil import CalledProcessError
+
+    client = client_install()
+    CCACHE_FILE = getattr(client, "CCACHE_FILE", paths.IPA_DNS_CCACHE)
+    client_dns = client.client_dns
+    configure_certmonger = client.configure_certmonger
+    update_ssh_keys = client.update_ssh_keys
+    configure_openldap_conf = client.configure_openldap_conf
+    hardcode_ldap_server = client.hardcode_ldap_server
+    get_certs_from_ldap = client.get_certs_from_ldap
+    save_state = client.save_state
+    if hasattr(client, "create_ipa_nssdb"):
+        create_ipa_nssdb = client.create_ipa_nssdb
+    else:
+        from ipapython.certdb import create_ipa_nssdb
+
+    fstore = sysrestore().FileStore(paths.IPA_CLIENT_SYSRESTORE)
+    statestore = sysrestore().StateFile(paths.IPA_CLIENT_SYSRESTORE)
+
+    ###########################################################################
+
+    os.environ['KRB5CCNAME'] = CCACHE_FILE
+    
+    options = Object()
+    options.dns_updates = False
+    options.all_ip_addresses = False
+    options.ip_addresses = None
+    options.request_cert = False
+    options.hostname = hostname
+    options.preserve_sssd = False
+    options.on_master = False
+    options.conf_ssh = True
+    options.conf_sshd = True
+    options.conf_sudo = True
+    options.primary = False
+    options.permit = False
+    options.krb5_offline_passwords = False
+    options.create_sshfp = True
+
+    ##########################################################################
+
+    # Create IPA NSS database
+    try:
+        create_ipa_nssdb()
+    except ipautil.CalledProcessError as e:
+        module.fail_json(msg="Failed to create IPA NSS database: %s" % e)
+
+    # Get CA certificates from the certificate store
+    try:
+        ca_certs = get_certs_from_ldap(select_server(servers, hostname),
+                                       basedn, realm, ca_enabled)
+    except errors.NoCertificateError:
+        if ca_enabled:
+            ca_subject = DN(('CN', 'Certificate Authority'), subject_base)
+        else:
+            ca_subject = None
+        ca_certs = certstore.make_compat_ca_certs(ca_certs, realm,
+                                                  ca_subject)
+    ca_certs_trust = [(c, n, certstore.key_policy_to_trust_flags(t, True, u))
+                      for (c, n, t, u) in ca_certs]
+
+    if hasattr(paths, "KDC_CA_BUNDLE_PEM"):
+        x509.write_certificate_list(
+            [c for c, n, t, u in ca_certs if t is not False],
+            paths.KDC_CA_BUNDLE_PEM)
+    if hasattr(paths, "CA_BUNDLE_PEM"):
+        x509.write_certificate_list(
+            [c for c, n, t, u in ca_certs if t is not False],
+            paths.CA_BUNDLE_PEM)
+
+    # Add the CA certificates to the IPA NSS database
+    module.debug("Adding CA certificates to the IPA NSS database.")
+    ipa_db = certdb.NSSDatabase(paths.IPA_NSSDB_DIR)
+    for cert, nickname, trust_flags in ca_certs_trust:
+        try:
+            ipa_db.add_cert(cert, nickname, trust_flags)
+        except CalledProcessError as e:
+            module.fail_json(msg="Failed to add %s to the IPA NSS database." % nickname)
+
+    # Add the CA certificates to the platform-dependant systemwide CA store
+    tasks.insert_ca_certs_into_systemwide_ca_store(ca_certs)
+
+    if not on_master:
+        client_dns(select_server(servers, hostname), hostname, options)
+        configure_certmonger(fstore, subject_base, realm, hostname,
+                             options, ca_enabled)
+
+    if hasattr(paths, "SSH_CONFIG_DIR"):
+        ssh_config_dir = paths.SSH_CONFIG_DIR
+    else:
+        ssh_config_dir = services.knownservices.sshd.get_config_dir()
+    update_ssh_keys(hostname, ssh_config_dir, options.create_sshfp)
+
+    try:
+        os.remove(CCACHE_FILE)
+    except Exception:
+        pass
+
+    ##########################################################################
+
+    # Name Server Caching Daemon. Disable for SSSD, use otherwise
+    # (if installed)
+    nscd = services.knownservices.nscd
+    if nscd.is_installed():
+        save_state(nscd, statestore)
+
+        try:
+            nscd_service_action = 'stop'
+            nscd.stop()
+        except Exception:
+            module.warn("Failed to %s the %s daemon" %
+                        (nscd_service_action, nscd.service_name))
+
+        try:
+            nscd.disable()
+        except Exception:
+            module.warn("Failed to disable %s daemon. Disable it manually." %
+                        nscd.service_name)
+
+    nslcd = services.knownservices.nslcd
+    if nslcd.is_installed():
+        save_state(nslcd, statestore)
+
+    retcode, conf = (0, None)
+
+    ##########################################################################
+
+    # Modify nsswitch/pam stack
+    tasks.modify_nsswitch_pam_stack(sssd=True,
+                                    mkhomedir=mkhomedir,
+                                    statestore=statestore)
+
+    module.log("SSSD enabled")
+
+    argspec = inspect.getargspec(services.service)
+    if len(argspec.args) > 1:
+        sssd = services.service('sssd', api)
+    else:
+        sssd = services.service('sssd')
+    try:
+        sssd.restart()
+    except CalledProcessError:
+        module.warn("SSSD service restart was unsuccessful.")
+
+    try:
+        sssd.enable()
+    except CalledProcessError as e:
+        module.warn(
+            "Failed to enable automatic startup of the SSSD daemon: "
+            "%s", e)
+
+    if configure_openldap_conf(fstore, basedn, servers):
+        module.log("Configured /etc/openldap/ldap.conf")
+    else:
+        module.log("Failed to configure /etc/openldap/ldap.conf")
+
+    # Check that nss is working properly
+    if not on_master:
+        user = principal
+        if user is None or user == "":
+            user = "admin@%s" % domain
+            module.log("Principal is not set when enrolling with OTP"
+                       "; using principal '%s' for 'getent passwd'" % user)
+        elif '@' not in user:
+            user = "%s@%s" % (user, domain)
+        n = 0
+        found = False
+        # Loop for up to 10 seconds to see if nss is working properly.
+        # It can sometimes take a few seconds to connect to the remote
+        # provider.
+        # Particulary, SSSD might take longer than 6-8 seconds.
+        while n < 10 and not found:
+            try:
+                ipautil.run(["getent", "passwd", user])
+                found = True
+            except Exception as e:
+                time.sleep(1)
+                n = n + 1
+
+        if not found:
+            module.fail_json(msg="Unable to find '%s' user with 'getent "
+                             "passwd %s'!" % (user.split("@")[0], user))
+            if conf:
+                module.log("Recognized configuration: %s" % conf)
+            else:
+                module.fail_json(msg=
+                                 "Unable to reliably detect "
+                                 "configuration. Check NSS setup manually.")
+
+            try:
+                hardcode_ldap_server(servers)
+            except Exception as e:
+                module.fail_json(msg="Adding hardcoded server name to "
+                                 "/etc/ldap.conf failed: %s" % str(e))
+
+
+def configure_extras(module, servers, domain, ntp, force_ntpd, ntp_servers,
+                     ssh, sssd, trust_sshfp, sshd, automount_location,
+                     firefox, firefox_dir, no_nisdomain, nisdomain,
+                     on_master):
+    """
+    Configure NTP, the OpenSSH client and server, automount, Firefox and the
+    NIS domain name.
+    """
+    import logging
+    from ipaplatform.paths import paths
+    try:
+        from ipaclient.install import ntpconf
+    except ImportError:
+        from ipaclient import ntpconf
+
+    client = client_install()
+    CCACHE_FILE = getattr(client, "CCACHE_FILE", paths.IPA_DNS_CCACHE)
+    configure_ssh_config = client.configure_ssh_config
+    configure_sshd_config = client.configure_sshd_config
+    configure_automount = client.configure_automount
+    configure_firefox = client.configure_firefox
+    argspec = inspect.getargspec(client.configure_nisdomain)
+    if len(argspec.args) == 3:
+        configure_nisdomain = client.configure_nisdomain
+    else:
+        def configure_nisdomain(options, domain, statestore=None):
+            return client.configure_nisdomain(options, domain)
+
+    fstore = sysrestore().FileStore(paths.IPA_CLIENT_SYSRESTORE)
+    statestore = sysrestore().StateFile(paths.IPA_CLIENT_SYSRESTORE)
+    logger = logging.getLogger("ipa-client-install")
+
+    os.environ['KRB5CCNAME'] = CCACHE_FILE
+    
+    options = Object()
+    options.sssd = sssd
+    options.trust_sshfp = trust_sshfp
+    options.location = automount_location
+    options.server = servers
+    options.firefox_dir = firefox_dir
+    options.nisdomain = nisdomain
+
+    if ntp and not on_master:
+        # disable other time&date services first
+        if force_ntpd:
+            ntpconf.force_ntpd(statestore)
+
+        ntpconf.config_ntp(ntp_servers, fstore, statestore)
+        module.log("NTP enabled")
+
+    if ssh:
+        configure_ssh_config(fstore, options)
+
+    if sshd:
+        configure_sshd_config(fstore, options)
+
+    if automount_location:
+        configure_automount(options)
+
+    if firefox:
+        configure_firefox(options, statestore, domain)
+
+    if not no_nisdomain:
+        configure_nisdomain(
+            options=options, domain=domain, statestore=statestore)
+
+    # Cleanup: Remove CCACHE_FILE
+    try:
+        os.remove(CCACHE_FILE)
+    except Exception:
+        pass
+
+
+# Check mode
+#
+# The plan functions compute the changes a module would do from the local
+# state only, nothing is written and the IPA servers are not contacted.
+# A plan lists the files that would be written, the certificates that would
+# be added, the services that would be (re)started or stopped and the RPCs
+# that would be done on the IPA server.
+
+def new_plan():
+    return dict(files=[], certs=[], services=[], rpcs=[])
+
+
+def merge_plans(*plans):
+    """
+    Merge plans, keeping the order and dropping duplicates.
+    """
+    result = new_plan()
+    for plan in plans:
+        for key in result:
+            for item in plan.get(key, []):
+                if item not in result[key]:
+                    result[key].append(item)
+    return result
+
+
+def plan_changed(plan):
+    return any(plan[key] for key in plan)
+
+
+def nsswitch_sources(database):
+    """
+    Return the sources of the database in nsswitch.conf.
+    """
+    from ipaplatform.paths import paths
+
+    try:
+        with open(paths.NSSWITCH_CONF) as f:
+            for line in f:
+                line = line.split("#", 1)[0].strip()
+                if line.startswith("%s:" % database):
+                    return line.split(":", 1)[1].split()
+    except (IOError, OSError):
+        pass
+    return []
+
+
+def read_pem_certs(data):
+    """
+    Return the DER encoded certificates of the PEM data.
+    """
+    import base64
+
+    certs = []
+    block = None
+    for line in data.splitlines():
+        line = line.strip()
+        if line == "-----BEGIN CERTIFICATE-----":
+            block = []
+        elif line == "-----END CERTIFICATE-----" and block is not None:
+            certs.append(base64.b64decode("".join(block)))
+            block = None
+        elif block is not None:
+            block.append(line)
+    return certs
+
+
+def read_pem_file(filename):
+    try:
+        with open(filename) as f:
+            return read_pem_certs(f.read())
+    except (IOError, OSError):
+        return []
+
+
+def run_command_deadline(args, deadline, capture=True):
+    """
+    Run the command and return (retcode, stdout, stderr). The command is
+    killed and None is returned if it is still running at deadline. Without
+    capture, the output is discarded and returned empty.
+    """
+    import time
+    import subprocess
+
+    if capture:
+        out = tempfile.TemporaryFile()
+        err = tempfile.TemporaryFile()
+    else:
+        out = err = open(os.devnull, "w")
+    try:
+        proc = subprocess.Popen(args, stdout=out, stderr=err)
+        while proc.poll() is None:
+            if time.time() > deadline:
+                proc.kill()
+                proc.wait()
+                return None
+            time.sleep(0.01)
+        if not capture:
+            return (proc.returncode, "", "")
+        out.seek(0)
+        err.seek(0)
+        return (proc.returncode, out.read().decode("utf-8", "replace"),
+                err.read().decode("utf-8", "replace"))
+    finally:
+        out.close()
+        err.close()
+
+
+def nssdb_ca_certs(module, nssdb_dir, deadline=None):
+    """
+    Return the DER encoded CA certificates of the NSS database, using
+    certutil only.
+
+    :param deadline: the time (time.time) the certutil calls need to be
+                     done, None if they are not limited
+    :returns: list of certificates or None if the deadline has been reached
+    """
+    import re
+
+    def run(args):
+        if deadline is None:
+            return module.run_command(args)
+        return run_command_deadline(args, deadline)
+
+    if os.path.exists(os.path.join(nssdb_dir, "cert9.db")):
+        nssdb_dir = "sql:%s" % nssdb_dir
+    result = run(["certutil", "-d", nssdb_dir, "-L"])
+    if result is None:
+        return None
+    retcode, stdout, stderr = result
+    if retcode != 0:
+        return []
+    certs = []
+    for line in stdout.splitlines():
+        parts = line.rsplit(None, 1)
+        if len(parts) != 2 or \
+           not re.match(r"^[a-zA-Z]*,[a-zA-Z]*,[a-zA-Z]*$", parts[1]) or \
+           "C" not in parts[1]:
+            continue
+        result = run(["certutil", "-d", nssdb_dir, "-L", "-n",
+                      parts[0].strip(), "-a"])
+        if result is None:
+            return None
+        retcode, stdout, stderr = result
+        if retcode == 0:
+            certs.extend(read_pem_certs(stdout))
+    return certs
+
+
+def cert_fingerprint(der):
+    return hashlib.sha256(der).hexdigest()
+
+
+def cert_der(cert):
+    """
+    Return the DER encoding of a certificate given as base64 or PEM string,
+    as DER, as JSON-RPC dict with __base64__ or as certificate object like
+    returned by IPA.
+    """
+    import base64
+
+    if hasattr(cert, 'public_bytes'):
+        from cryptography.hazmat.primitives.serialization import Encoding
+        return cert.public_bytes(Encoding.DER)
+    if isinstance(cert, dict):
+        cert = cert.get('__base64__', '')
+    if isinstance(cert, text_type):
+        cert = cert.encode('ascii')
+    if b'-----BEGIN CERTIFICATE-----' in cert:
+        certs = read_pem_certs(cert.decode('ascii'))
+        return certs[0] if certs else cert
+    # DER starts with a SEQUENCE with a long form length, not valid base64
+    head = bytearray(cert[:2])
+    if len(head) == 2 and head[0] == 0x30 and head[1] & 0x80:
+        return cert
+    return base64.b64decode(b''.join(cert.split()))
+
+
+SSH_KEY_TYPE_PREFIXES = ('ssh-', 'ecdsa-', 'sk-ssh-', 'sk-ecdsa-')
+
+
+def sshpubkey_key(sshpubkey):
+    """
+    Return the key type and the base64 key of an SSH public key, without
+    options and comment.
+    """
+    fields = sshpubkey.split()
+    for i, field in enumerate(fields):
+        if field.startswith(SSH_KEY_TYPE_PREFIXES):
+            return ' '.join(fields[i:i + 2])
+    return sshpubkey.strip()
+
+
+def plan_join(module, servers, realm, hostname, force_join):
+    """
+    Plan the join with the local host keytab.
+
+    :returns: tuple (plan, krb5_keytab_ok)
+    """
+    from ipaplatform.paths import paths
+
+    plan = new_plan()
+    host_principal = 'host/%s@%s' % (hostname, realm)
+    entries = read_keytab(paths.KRB5_KEYTAB)
+    krb5_keytab_ok = entries is not None and \
+        host_principal in [entry[0] for entry in entries]
+
+    if not krb5_keytab_ok or force_join:
+        plan['files'].extend([paths.IPA_CA_CRT, paths.KRB5_KEYTAB])
+        plan['rpcs'].append("join %s on %s" %
+                            (hostname, select_server(servers, hostname)))
+    return (plan, krb5_keytab_ok)
+
+
+def plan_api(servers, hostname):
+    """
+    Plan the API enrollment, whether the Certificate Authority is enabled is
+    taken from enable_ra in default.conf.
+
+    :returns: tuple (plan, ca_enabled)
+    """
+    from ipaplatform.paths import paths
+
+    plan = new_plan()
+    server = select_server(servers, hostname)
+    plan['rpcs'].extend(["ping on %s" % server,
+                         "ca_is_enabled on %s" % server])
+
+    parser = RawConfigParser()
+    ca_enabled = True
+    if parser.read(paths.IPA_DEFAULT_CONF) and \
+       parser.has_option('global', 'enable_ra'):
+        ca_enabled = parser.get('global', 'enable_ra').lower() == 'true'
+    return (plan, ca_enabled)
+
+
+def plan_nss(module, servers, hostname, basedn, ca_enabled, mkhomedir,
+             on_master):
+    """
+    Plan the creation of the IPA NSS database and the related configuration.
+
+    The CA certificates are taken from paths.IPA_CA_CRT instead of the LDAP
+    certificate store.
+    """
+    from ipaplatform import services
+    from ipaplatform.paths import paths
+
+    plan = new_plan()
+    server = select_server(servers, hostname)
+
+    if not os.path.exists(os.path.join(paths.IPA_NSSDB_DIR, "cert8.db")) and \
+       not os.path.exists(os.path.join(paths.IPA_NSSDB_DIR, "cert9.db")):
+        plan['files'].append(paths.IPA_NSSDB_DIR)
+        nssdb_certs = []
+    else:
+        nssdb_certs = nssdb_ca_certs(module, paths.IPA_NSSDB_DIR)
+
+    ca_certs = read_pem_file(paths.IPA_CA_CRT)
+    if not ca_certs:
+        plan['rpcs'].append("CA certificates from the LDAP certificate "
+                            "store on %s" % server)
+    for der in ca_certs:
+        if der not in nssdb_certs:
+            plan['certs'].append(cert_fingerprint(der))
+
+    for name in ("KDC_CA_BUNDLE_PEM", "CA_BUNDLE_PEM"):
+        if hasattr(paths, name):
+            filename = getattr(paths, name)
+            if not ca_certs or \
+               set(read_pem_file(filename)) != set(ca_certs):
+                plan['files'].append(filename)
+    if hasattr(paths, "IPA_P11_KIT") and \
+       (not ca_certs or not os.path.exists(paths.IPA_P11_KIT)):
+        plan['files'].append(paths.IPA_P11_KIT)
+
+    if not on_master:
+        plan['rpcs'].append("host_mod (SSH public keys) on %s" % server)
+
+    nscd = services.knownservices.nscd
+    if nscd.is_installed() and nscd.is_running():
+        plan['services'].append("nscd: stop, disable")
+
+    if 'sss' not in nsswitch_sources('passwd'):
+        plan['files'].extend([paths.NSSWITCH_CONF, "PAM stack"])
+    elif mkhomedir:
+        try:
+            with open("/etc/pam.d/system-auth") as f:
+                if "mkhomedir" not in f.read():
+                    plan['files'].append("PAM stack")
+        except (IOError, OSError):
+            plan['files'].append("PAM stack")
+
+    try:
+        with open(paths.OPENLDAP_LDAP_CONF) as f:
+            ldap_conf = f.read()
+    except (IOError, OSError):
+        ldap_conf = ""
+    if "BASE %s" % basedn not in ldap_conf or \
+       any("ldaps://%s" % s not in ldap_conf for s in servers):
+        plan['files'].append(paths.OPENLDAP_LDAP_CONF)
+
+    # configure_nss always restarts SSSD
+    plan['services'].append("sssd: restart, enable")
+    return plan
+
+
+def ssh_config_missing(filename, options):
+    """
+    Return the options that are not set in the OpenSSH configuration file.
+
+    :param options: dict of option names and values
+    """
+    current = dict()
+    try:
+        with open(filename) as f:
+            for line in f:
+                parts = line.split("#", 1)[0].strip().split(None, 1)
+                if len(parts) == 2:
+                    current.setdefault(parts[0].lower(), parts[1].strip())
+    except (IOError, OSError):
+        pass
+    return [name for name in sorted(options)
+            if current.get(name.lower()) != options[name]]
+
+
+def plan_extras(module, servers, domain, ntp, force_ntpd, ntp_servers, ssh,
+                sssd, trust_sshfp, sshd, automount_location, firefox,
+                firefox_dir, no_nisdomain, nisdomain, on_master):
+    """
+    Plan the configuration of NTP, the OpenSSH client and server, automount,
+    Firefox and the NIS domain name.
+    """
+    from ipaplatform import services
+    from ipaplatform.paths import paths
+
+    plan = new_plan()
+    sss_proxy = os.path.isfile(paths.SSS_SSH_KNOWNHOSTSPROXY)
+    sss_keys = os.path.isfile(paths.SSS_SSH_AUTHORIZEDKEYS)
+
+    if ntp and not on_master:
+        try:
+            with open(paths.NTP_CONF) as f:
+                ntp_conf = f.read().split()
+        except (IOError, OSError):
+            ntp_conf = []
+        if not ntp_servers or any(s not in ntp_conf for s in ntp_servers):
+            plan['files'].append(paths.NTP_CONF)
+            plan['services'].append("ntpd: restart, enable")
+        if force_ntpd:
+            chronyd = services.knownservices.chronyd
+            if chronyd.is_installed() and chronyd.is_running():
+                plan['services'].append("chronyd: stop, disable")
+
+    if ssh:
+        options = dict(PubkeyAuthentication="yes")
+        if sssd and sss_proxy:
+            options['ProxyCommand'] = \
+                "%s -p %%p %%h" % paths.SSS_SSH_KNOWNHOSTSPROXY
+            options['GlobalKnownHostsFile'] = paths.SSSD_PUBCONF_KNOWN_HOSTS
+        if trust_sshfp:
+            options['VerifyHostKeyDNS'] = "yes"
+        if ssh_config_missing(paths.SSH_CONFIG, options):
+            plan['files'].append(paths.SSH_CONFIG)
+
+    if sshd:
+        options = dict(ChallengeResponseAuthentication="yes",
+                       GSSAPIAuthentication="yes",
+                       KerberosAuthentication="no",
+                       PubkeyAuthentication="yes",
+                       UsePAM="yes")
+        if sssd and sss_keys:
+            options['AuthorizedKeysCommand'] = paths.SSS_SSH_AUTHORIZEDKEYS
+        if ssh_config_missing(paths.SSHD_CONFIG, options):
+            plan['files'].append(paths.SSHD_CONFIG)
+            plan['services'].append("sshd: restart")
+
+    if automount_location:
+        plan['rpcs'].append("automountlocation_show %s on %s" %
+                            (automount_location, servers[0]))
+        if 'sss' not in nsswitch_sources('automount'):
+            plan['files'].extend([paths.NSSWITCH_CONF, paths.SSSD_CONF])
+            plan['services'].append("autofs: restart, enable")
+
+    if firefox:
+        ff_dir = firefox_dir or paths.FIREFOX_INSTALL_DIRS[0]
+        pref = os.path.join(ff_dir, "defaults", "preferences", "all-ipa.js")
+        if not os.path.exists(pref):
+            plan['files'].append(pref)
+
+    if not no_nisdomain:
+        try:
+            with open("/proc/sys/kernel/domainname") as f:
+                current = f.read().strip()
+        except (IOError, OSError):
+            current = None
+        if current != (nisdomain or domain):
+            plan['files'].append(paths.SYSCONFIG_NETWORK)
+            plan['services'].append("nis-domainname: enable")
+
+    return plan
+
+
+def read_keytab(filename):
+    """
+    Read the entries of a MIT keytab file (format version 0x502) without
+    using klist or gssapi.
+
+    :param filename: the keytab file
+    :returns: list of tuples (principal, kvno, enctype) or None if the file
+              does not exist or has an unsupported format
+    """
+    import struct
+
+    try:
+        with open(filename, "rb") as f:
+            data = f.read()
+    except (IOError, OSError):
+        return None
+
+    if len(data) < 2 or data[:2] != b"\x05\x02":
+        return None
+
+    def read_data(buf, pos):
+        (length,) = struct.unpack_from(">H", buf, pos)
+        pos += 2
+        return (buf[pos:pos + length].decode("utf-8"), pos + length)
+
+    entries = []
+    pos = 2
+    try:
+        while pos + 4 <= len(data):
+            (size,) = struct.unpack_from(">i", data, pos)
+            pos += 4
+            if size <= 0:
+                # Deleted entry (hole) or end of the keytab
+                if size == 0:
+                    break
+                pos += -size
+                continue
+            end = pos + size
+            entry = data[pos:end]
+            (num_components,) = struct.unpack_from(">H", entry, 0)
+            realm, epos = read_data(entry, 2)
+            components = []
+            for i in range(num_components):
+                component, epos = read_data(entry, epos)
+                components.append(component)
+            # name_type, timestamp, vno8, enctype
+            (name_type, timestamp, kvno, enctype) = struct.unpack_from(
+                ">IIBH", entry, epos)
+            epos += 11
+            (key_length,) = struct.unpack_from(">H", entry, epos)
+            epos += 2 + key_length
+            # The 32bit kvno is optional and replaces the 8bit kvno if set
+            if epos + 4 <= len(entry):
+                (kvno32,) = struct.unpack_from(">I", entry, epos)
+                if kvno32 != 0:
+                    kvno = kvno32
+            entries.append(("%s@%s" % ("/".join(components), realm),
+                            kvno, enctype))
+            pos = end
+    except (struct.error, UnicodeDecodeError):
+        return None
+
+    return entries
+
+
+# IPA error code of a missing entry
+NOT_FOUND = 4001
+
+
+def current_membership(groups, results):
+    """
+    Returns the member hosts of the hostgroups from the results of the
+    hostgroup_show batch call. Only NotFound errors are treated as missing
+    hostgroups.
+
+    :param groups: the hostgroups in the order of the results
+    :param results: the hostgroup_show results of the batch call
+    :returns: tuple (current, failed), current is the dict hostgroup ->
+              list of member hosts, None for hostgroups that do not exist.
+              Hostgroups that could not be read are only in failed as
+              hostgroup -> list of errors.
+    """
+    current = dict()
+    failed = dict()
+    for group, show in zip(groups, results):
+        if not show.get('error'):
+            current[group] = show['result'].get('member_host', [])
+        elif show.get('error_code') == NOT_FOUND:
+            current[group] = None
+        else:
+            failed[group] = [show['error']]
+    return (current, failed)
+
+
+def plan_membership(current, members, state):
+    """
+    Computes the changes of the hostgroup members. This is also used by
+    the ipahostgroup action plugin on the controller.
+
+    :param current: dict hostgroup -> list of member hosts, None for
+                    hostgroups that do not exist, hostgroups that are not
+                    in current are skipped
+    :param members: dict hostgroup -> list of hosts of the module params
+    :param state: present, absent or exact
+    :returns: tuple (methods, added, removed), methods is the list of
+              (command, args, options) tuples
+    """
+    methods = []
+    added = dict()
+    removed = dict()
+    for group in sorted(current):
+        wanted = set(host.lower() for host in members[group] or [])
+        have = current[group]
+        if have is None:
+            if state == 'absent':
+                continue
+            methods.append(("hostgroup_add", [group], dict()))
+            have = []
+        have = set(host.lower() for host in have)
+
+        add = sorted(wanted - have) if state != 'absent' else []
+        if state == 'absent':
+            remove = sorted(wanted & have)
+        elif state == 'exact':
+            remove = sorted(have - wanted)
+        else:
+            remove = []
+        if add:
+            methods.append(("hostgroup_add_member", [group],
+                            dict(host=add)))
+            added[group] = add
+        if remove:
+            methods.append(("hostgroup_remove_member", [group],
+                            dict(host=remove)))
+            removed[group] = remove
+    return (methods, added, removed)
+
+
+def member_failures(result):
+    """
+    Returns the hosts that failed in a hostgroup_add_member or
+    hostgroup_remove_member result as "host: reason".
+    """
+    failures = []
+    for entries in result.get('failed', dict()).get('member',
+                                                     dict()).values():
+        for name, reason in entries:
+            failures.append("%s: %s" % (name, reason))
+    return failures
+
+
+def apply_membership(methods, added, removed, results):
+    """
+    Removes the failed hosts from added and removed.
+
+    :returns: dict hostgroup -> list of errors
+    """
+    failed = dict()
+    for (command, args, options), result in zip(methods, results):
+        group = args[0]
+        if result.get('error'):
+            failed.setdefault(group, []).append(result['error'])
+            added.pop(group, None)
+            removed.pop(group, None)
+            continue
+        failures = member_failures(result)
+        if failures:
+            failed.setdefault(group, []).extend(failures)
+            hosts = set(failure.split(":", 1)[0] for failure in failures)
+            changes = added if command == "hostgroup_add_member" else removed
+            changes[group] = [host for host in changes.get(group, [])
+                              if host not in hosts]
+            if not changes[group]:
+                del changes[group]
+    return failed
+
+
+SESSION_STORE = "~/.cache/ansible_ipa_sessions.json"
+SESSION_LIFETIME = 1200
+
+
+def _session_key(principal, server):
+    return "%s|%s" % (principal, server)
+
+
+def _read_session_store(store):
+    import json
+    try:
+        with open(os.path.expanduser(store)) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return dict()
+
+
+def stored_session_cookie(principal, server, store=SESSION_STORE):
+    """
+    Return the stored IPA session cookie of the principal for the server or
+    None if there is none or if it has expired.
+    """
+    import time
+
+    entry = _read_session_store(store).get(_session_key(principal, server))
+    if entry is None or entry.get("expires", 0) < time.time():
+        return None
+    return entry["cookie"]
+
+
+def store_session_cookie(principal, server, cookie, store=SESSION_STORE):
+    """
+    Store the IPA session cookie of the principal for the server in the
+    session store, expired cookies are removed.
+    """
+    import json
+    import time
+
+    store = os.path.expanduser(store)
+    data = _read_session_store(store)
+    now = time.time()
+    for key in [k for k in data if data[k].get("expires", 0) < now]:
+        del data[key]
+    data[_session_key(principal, server)] = dict(
+        cookie=cookie, expires=now + SESSION_LIFETIME)
+
+    temp_name = "%s.%d" % (store, os.getpid())
+    try:
+        dirname = os.path.dirname(store)
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname, 0o700)
+        fd = os.open(temp_name, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f)
+        os.rename(temp_name, store)
+    except (IOError, OSError):
+        # The session store is optional
+        try:
+            os.remove(temp_name)
+        except OSError:
+            pass
+
+
+def load_session_cookie(principal, server, store=SESSION_STORE):
+    """
+    Load the stored IPA session cookie of the principal for the server into
+    the persistent client session data of ipalib, that is used by
+    rpcclient.connect. ipalib falls back to Kerberos negotiation if the
+    cookie has expired or is rejected by the server.
+
+    :returns: True if a cookie has been loaded
+    """
+    from ipalib.rpc import update_persistent_client_session_data, \
+        delete_persistent_client_session_data
+
+    cookie = stored_session_cookie(principal, server, store)
+    if cookie is None:
+        # Do not use a cookie of another server or an expired one
+        try:
+            delete_persistent_client_session_data(principal)
+        except ValueError:
+            pass
+        return False
+    try:
+        update_persistent_client_session_data(principal,
+                                              cookie.encode("utf-8"))
+    except ValueError:
+        return False
+    return True
+
+
+def save_session_cookie(principal, server, store=SESSION_STORE):
+    """
+    Save the IPA session cookie of the principal for the server from the
+    persistent client session data of ipalib in the session store.
+    """
+    from ipalib.rpc import read_persistent_client_session_data
+
+    try:
+        cookie = read_persistent_client_session_data(principal)
+    except ValueError:
+        return
+    if not cookie:
+        return
+    if isinstance(cookie, bytes):
+        cookie = cookie.decode("utf-8")
+    store_session_cookie(principal, server, cookie, store)
+
+
+PROFILE_ENV = "ANSIBLE_IPA_PROFILE"
+PROFILE_TOP_ENV = "ANSIBLE_IPA_PROFILE_TOP"
+PROFILE_FILE_ENV = "ANSIBLE_IPA_PROFILE_FILE"
+
+
+def profile_result(profiler, top, start_time, pstats_file):
+    """
+    Create the profile result: the top functions by cumulative time, the
+    total time and the peak memory.
+    """
+    import pstats
+    import time
+
+    stats = pstats.Stats(profiler)
+    stats.sort_stats("cumulative")
+    table = []
+    for func in stats.fcn_list[:top]:
+        (cc, nc, tt, ct, callers) = stats.stats[func]
+        table.append("%8d %9.3f %9.3f  %s:%d(%s)" % (
+            nc, tt, ct, os.path.basename(func[0]), func[1], func[2]))
+
+    result = dict(
+        total_time=round(time.time() - start_time, 3),
+        top=["   ncalls   tottime   cumtime  function"] + table,
+    )
+    try:
+        import tracemalloc
+    except ImportError:
+        # Python 2 does not have tracemalloc, use the peak RSS instead
+        tracemalloc = None
+    if tracemalloc is not None and tracemalloc.is_tracing():
+        (current, peak) = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        result["peak_memory_kb"] = peak // 1024
+        result["memory_source"] = "tracemalloc"
+    else:
+        import resource
+        result["peak_memory_kb"] = resource.getrusage(
+            resource.RUSAGE_SELF).ru_maxrss
+        result["memory_source"] = "rusage"
+    if pstats_file:
+        profiler.dump_stats(pstats_file)
+        result["pstats_file"] = pstats_file
+    return result
+
+
+def profiled(main):
+    """
+    Run the main function of a module, profiled if the environment variable
+    ANSIBLE_IPA_PROFILE is set.
+
+    The module body is run with cProfile and tracemalloc (if available). The
+    top ANSIBLE_IPA_PROFILE_TOP (default 20) functions by cumulative time and
+    the peak memory are added as profile to the module result. If
+    ANSIBLE_IPA_PROFILE_FILE is set, the complete pstats data is written to
+    this file on the managed node.
+
+    Example:
+
+    - ipajoin:
+        ...
+      environment:
+        ANSIBLE_IPA_PROFILE: 1
+    """
+    if os.environ.get(PROFILE_ENV, "").lower() in ("", "0", "no", "false"):
+        return main()
+
+    import cProfile
+    import time
+    from ansible.module_utils.basic import AnsibleModule
+
+    top = int(os.environ.get(PROFILE_TOP_ENV, 20))
+    pstats_file = os.environ.get(PROFILE_FILE_ENV)
+    profiler = cProfile.Profile()
+    start_time = time.time()
+
+    # The profile is created once, fail_json can follow an exit_json that
+    # raised, for example in a finally block
+    profile = []
+
+    def wrap(orig):
+        def _wrapped(self, *args, **kwargs):
+            if not profile:
+                profiler.disable()
+                profile.append(profile_result(profiler, top, start_time,
+                                              pstats_file))
+            kwargs["profile"] = profile[0]
+            return orig(self, *args, **kwargs)
+        return _wrapped
+
+    AnsibleModule.exit_json = wrap(AnsibleModule.exit_json)
+    AnsibleModule.fail_json = wrap(AnsibleModule.fail_json)
+
+    try:
+        import tracemalloc
+        tracemalloc.start()
+    except ImportError:
+        pass
+    profiler.enable()
+    return main()
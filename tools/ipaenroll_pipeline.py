@@ -0,0 +1,221 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+# Authors:
+#   Thomas Woerner <twoerner@redhat.com>
+#
+# Copyright (C) 2017  Red Hat
+# see file 'COPYING' for use and warranty information
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Pipelined enrollment of IPA clients.
+
+The hosts are split into batches. Every batch passes two stages, each one is
+an ansible-playbook run limited to the hosts of the batch:
+
+  otp     - tools/pipeline_otp.yml generates the One-Time Passwords for the
+            batch with a single ipahost batch call
+  enroll  - the ipaclient playbook (site.yml) enrolls the hosts using the
+            pre-generated passwords (ipaclient_otp_passwords)
+
+The stages of different batches overlap: the passwords for the next batches
+are generated while the current batch is enrolled. The number of concurrent
+runs is limited per stage, the OTP stage is at most enroll_concurrency
+batches ahead of the enroll stage.
+"""
+
+import argparse
+import asyncio
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+OTP_PLAYBOOK = os.path.join(TOOLS_DIR, "pipeline_otp.yml")
+SITE_PLAYBOOK = os.path.join(os.path.dirname(TOOLS_DIR), "site.yml")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Pipelined enrollment of IPA clients")
+    parser.add_argument("-i", "--inventory", required=True,
+                        help="the inventory file")
+    parser.add_argument("-l", "--limit", default="ipaclients",
+                        help="the hosts to enroll (default: ipaclients)")
+    parser.add_argument("-e", "--extra-vars", action="append", default=[],
+                        help="extra variables passed to ansible-playbook, "
+                        "for example -e @secrets.yml")
+    parser.add_argument("--playbook", default=SITE_PLAYBOOK,
+                        help="the enrollment playbook (default: site.yml)")
+    parser.add_argument("--batch-size", type=int, default=50,
+                        help="the number of hosts per batch (default: 50)")
+    parser.add_argument("--otp-concurrency", type=int, default=1,
+                        help="the number of concurrent OTP stage runs "
+                        "(default: 1)")
+    parser.add_argument("--enroll-concurrency", type=int, default=2,
+                        help="the number of concurrent enrollment stage runs "
+                        "(default: 2)")
+    parser.add_argument("--forks", type=int, default=None,
+                        help="the forks of every ansible-playbook run")
+    parser.add_argument("--ansible-playbook", default="ansible-playbook",
+                        help="the ansible-playbook command")
+    return parser.parse_args(argv)
+
+
+async def list_hosts(args):
+    """
+    Return the hosts matching the limit pattern in the inventory.
+    """
+    ansible = os.path.join(os.path.dirname(args.ansible_playbook), "ansible")
+    proc = await asyncio.create_subprocess_exec(
+        ansible, args.limit, "-i", args.inventory, "--list-hosts",
+        stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+    stdout, stderr = await proc.communicate()
+    if proc.returncode != 0:
+        raise RuntimeError("Failed to list hosts: %s" %
+                           stderr.decode("utf-8", "replace").strip())
+    lines = stdout.decode("utf-8").splitlines()
+    # The first line is the header "  hosts (N):"
+    return [line.strip() for line in lines[1:] if line.strip()]
+
+
+class Pipeline(object):
+    """
+    Run the stages for all batches with a bounded concurrency per stage.
+
+    The stages are connected by a queue of enroll_concurrency batches, the
+    OTP stage does not generate passwords for more batches than the enroll
+    stage can take next. The passwords of a batch are on disk from the OTP
+    stage until the end of its enroll stage only.
+    """
+
+    def __init__(self, args, temp_dir):
+        self.args = args
+        self.temp_dir = temp_dir
+        self.results = []
+
+    async def playbook(self, playbook, hosts, extra_vars, log_name):
+        cmd = [self.args.ansible_playbook, playbook,
+               "-i", self.args.inventory,
+               "--limit", ",".join(hosts)]
+        if self.args.forks:
+            cmd.extend(["--forks", str(self.args.forks)])
+        for value in self.args.extra_vars + extra_vars:
+            cmd.extend(["-e", value])
+        with open(os.path.join(self.temp_dir, log_name), "wb") as log:
+            proc = await asyncio.create_subprocess_exec(
+                *cmd, stdout=log, stderr=asyncio.subprocess.STDOUT)
+            return await proc.wait()
+
+    def done(self, result, otp_file):
+        # The passwords are not needed anymore
+        if os.path.exists(otp_file):
+            os.remove(otp_file)
+        self.results.append(result)
+        print("batch %(batch)d: %(hosts)d hosts, otp rc %(otp_rc)s, "
+              "enroll rc %(enroll_rc)s" %
+              dict(dict(otp_rc=None, enroll_rc=None), **result),
+              flush=True)
+
+    async def otp_worker(self, batches, ready):
+        while batches:
+            number, hosts = batches.pop(0)
+            otp_file = os.path.join(self.temp_dir, "otp-%d.json" % number)
+            result = dict(batch=number, hosts=len(hosts))
+            try:
+                start = time.time()
+                result["otp_rc"] = await self.playbook(
+                    OTP_PLAYBOOK, hosts,
+                    ["ipaclient_otp_file=%s" % otp_file],
+                    "otp-%d.log" % number)
+                result["otp_time"] = time.time() - start
+            except BaseException:
+                self.done(result, otp_file)
+                raise
+            if result["otp_rc"] != 0:
+                self.done(result, otp_file)
+                continue
+            # Waits while the look-ahead of the enroll stage is full
+            await ready.put((number, hosts, otp_file, result))
+
+    async def enroll_worker(self, ready):
+        while True:
+            item = await ready.get()
+            if item is None:
+                return
+            number, hosts, otp_file, result = item
+            try:
+                start = time.time()
+                result["enroll_rc"] = await self.playbook(
+                    self.args.playbook, hosts, ["@%s" % otp_file],
+                    "enroll-%d.log" % number)
+                result["enroll_time"] = time.time() - start
+            finally:
+                self.done(result, otp_file)
+
+    async def run(self, hosts):
+        size = self.args.batch_size
+        batches = [(number, hosts[i:i+size]) for number, i in
+                   enumerate(range(0, len(hosts), size))]
+        ready = asyncio.Queue(maxsize=self.args.enroll_concurrency)
+        enrollers = [asyncio.ensure_future(self.enroll_worker(ready))
+                     for i in range(self.args.enroll_concurrency)]
+        await asyncio.gather(*[self.otp_worker(batches, ready)
+                               for i in range(self.args.otp_concurrency)])
+        for enroller in enrollers:
+            await ready.put(None)
+        await asyncio.gather(*enrollers)
+
+
+async def run(args):
+    hosts = await list_hosts(args)
+    if not hosts:
+        print("No hosts matching %s" % args.limit)
+        return 0
+
+    temp_dir = tempfile.mkdtemp(prefix="ipaenroll-pipeline-")
+    os.chmod(temp_dir, 0o700)
+    pipeline = Pipeline(args, temp_dir)
+    start = time.time()
+    await pipeline.run(hosts)
+    failed = [r for r in pipeline.results
+              if r.get("otp_rc") != 0 or r.get("enroll_rc") != 0]
+    print("%d hosts in %d batches enrolled in %.1f seconds, %d batches "
+          "failed" % (len(hosts), len(pipeline.results), time.time() - start,
+                      len(failed)))
+    if failed:
+        print("The logs of the failed batches are in %s" % temp_dir)
+        return 1
+    shutil.rmtree(temp_dir, ignore_errors=True)
+    return 0
+
+
+def main():
+    args = parse_args()
+    if args.batch_size < 1 or args.otp_concurrency < 1 or \
+       args.enroll_concurrency < 1:
+        sys.exit("batch size and concurrency need to be at least 1")
+    loop = asyncio.get_event_loop()
+    try:
+        sys.exit(loop.run_until_complete(run(args)))
+    finally:
+        loop.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+# Authors:
+#   Thomas Woerner <twoerner@redhat.com>
+#
+# Copyright (C) 2017  Red Hat
+# see file 'COPYING' for use and warranty information
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Import times of the modules.
+
+The script is run on a client with ansible and freeipa-client installed.
+Every module of library/ is imported in a fresh interpreter, with the
+interpreter the modules are executed with on the managed nodes (--python).
+Two times are reported per module:
+
+  fast  - the import of the module and module_utils, this is the fixed
+          cost of the early exits, no-op runs and check mode
+  full  - fast and the libraries that are only imported on demand by the
+          code paths doing the work (gssapi, ipalib, the client
+          installer, ...)
+
+The median of --repeat runs is reported, as table or as JSON with --json.
+Modules that can not be imported are reported with the error.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+TOP_DIR = os.path.dirname(TOOLS_DIR)
+LIBRARY_DIR = os.path.join(TOP_DIR, "library")
+MODULE_UTILS = os.path.join(TOP_DIR, "module_utils", "ansible_ipa_client.py")
+
+# The libraries the modules import on demand only
+ON_DEMAND = ["gssapi", "ipalib", "ipaplatform.paths", "ipapython.certdb",
+             "SSSDConfig"]
+
+# Executed in the child interpreter, also with Python 2
+CHILD = """
+import json
+import sys
+import time
+
+def load(name, path):
+    if sys.version_info[0] >= 3:
+        import importlib.util
+        spec = importlib.util.spec_from_file_location(name, path)
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[name] = module
+        spec.loader.exec_module(module)
+        return module
+    import imp
+    return imp.load_source(name, path)
+
+module_utils, module, full = sys.argv[1], sys.argv[2], sys.argv[3] == "1"
+on_demand = sys.argv[4:]
+start = time.time()
+import ansible.module_utils
+utils = load("ansible.module_utils.ansible_ipa_client", module_utils)
+load("ansible_ipa_module", module)
+fast = time.time() - start
+missing = []
+if full:
+    for name in on_demand:
+        try:
+            __import__(name)
+        except ImportError:
+            missing.append(name)
+    try:
+        utils.client_install()
+    except Exception:
+        missing.append("client_install")
+print(json.dumps(dict(fast=fast, full=time.time() - start,
+                      missing=missing)))
+"""
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Import times of the modules")
+    parser.add_argument("modules", nargs="*",
+                        help="the modules to measure (default: all)")
+    parser.add_argument("--python", default=sys.executable,
+                        help="the interpreter of the modules (default: %s)" %
+                        sys.executable)
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="the number of runs per module (default: 5)")
+    parser.add_argument("--json", action="store_true",
+                        help="print the report as JSON")
+    return parser.parse_args(argv)
+
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+
+def measure(python, module, full):
+    """
+    Import the module in a fresh interpreter.
+
+    :returns: dict with fast, full and missing
+    """
+    proc = subprocess.run(
+        [python, "-c", CHILD, MODULE_UTILS,
+         os.path.join(LIBRARY_DIR, "%s.py" % module),
+         "1" if full else "0"] + ON_DEMAND,
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if proc.returncode != 0:
+        lines = proc.stderr.decode("utf-8", "replace").strip().splitlines()
+        return dict(error=lines[-1] if lines else str(proc.returncode))
+    return json.loads(proc.stdout.decode("utf-8").splitlines()[-1])
+
+
+def report(args, modules):
+    """
+    Return the median times per module.
+    """
+    result = dict()
+    for module in modules:
+        fast = [measure(args.python, module, False)
+                for i in range(args.repeat)]
+        errors = [run["error"] for run in fast if "error" in run]
+        if errors:
+            result[module] = dict(error=errors[0])
+            continue
+        full = [measure(args.python, module, True)
+                for i in range(args.repeat)]
+        result[module] = dict(
+            fast=round(median([run["fast"] for run in fast]), 4),
+            full=round(median([run["full"] for run in full]), 4),
+            missing=full[-1]["missing"])
+    return result
+
+
+def main():
+    args = parse_args()
+    if args.repeat < 1:
+        sys.exit("repeat needs to be at least 1")
+    modules = args.modules or sorted(
+        name[:-3] for name in os.listdir(LIBRARY_DIR)
+        if name.endswith(".py"))
+    result = report(args, modules)
+
+    if args.json:
+        print(json.dumps(result, indent=2, sort_keys=True))
+        return
+    print("%-16s %9s %9s  %s" % ("module", "fast [s]", "full [s]",
+                                  "not installed"))
+    for module in modules:
+        times = result[module]
+        if "error" in times:
+            print("%-16s import failed: %s" % (module, times["error"]))
+            continue
+        print("%-16s %9.4f %9.4f  %s" % (module, times["fast"], times["full"],
+                                        ", ".join(times["missing"])))
+
+
+if __name__ == "__main__":
+    main()